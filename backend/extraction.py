@@ -0,0 +1,205 @@
+"""Text extraction for uploaded documents.
+
+These functions run in the extraction process pool (``ExtractionPool`` in
+server.py), so this module must stay importable without the server's side
+effects: no Mongo client, no embedding model.
+"""
+import io
+import re
+import signal
+from typing import Dict, List, Tuple, Union
+
+import PyPDF2
+import docx
+from PIL import Image
+import pytesseract
+
+# Uploaded file contents, or a path to them
+Source = Union[bytes, str]
+# (offset in the extracted text, heading title)
+Headings = List[Tuple[int, str]]
+
+HEADING_MAX_LENGTH = 80
+NUMBERED_HEADING = re.compile(r'\d+(\.\d+)*\.?\s+[A-Z]')
+
+class ExtractionTimeout(Exception):
+    pass
+
+def _open(source: Source):
+    """Binary stream over the source; paths are read lazily rather than loaded whole"""
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else open(source, 'rb')
+
+def init_worker(memory_limit_mb: int):
+    """Process pool initializer: cap the worker's address space"""
+    if memory_limit_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_with_deadline(timeout: float, func, *args):
+    """Run ``func(*args)``, raising ExtractionTimeout after ``timeout`` seconds"""
+    if not timeout or not hasattr(signal, 'setitimer'):
+        return func(*args)
+
+    def expired(signum, frame):
+        raise ExtractionTimeout(f"Extraction took longer than {timeout:g}s")
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def find_headings(text: str) -> Headings:
+    """Lines that look like headings: numbered ("2.1 Scope") or all caps"""
+    headings = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        title = line.strip()
+        if (3 <= len(title) <= HEADING_MAX_LENGTH and title[0] not in '=-[' and title[-1] not in '.,;:'
+                and (NUMBERED_HEADING.match(title) or title.isupper())):
+            headings.append((offset, title))
+        offset += len(line)
+    return headings
+
+def extract_pdf_outline(source: Source) -> Tuple[str, int, Dict[int, List[str]]]:
+    """Metadata header, page count and bookmarks (page index -> titles) of a PDF"""
+    with _open(source) as stream:
+        pdf_reader = PyPDF2.PdfReader(stream)
+        return _pdf_metadata(pdf_reader), len(pdf_reader.pages), _pdf_bookmarks(pdf_reader)
+
+def _pdf_metadata(pdf_reader: PyPDF2.PdfReader) -> str:
+    text = ""
+
+    if pdf_reader.metadata:
+        text += "=== DOCUMENT METADATA ===\n"
+        if pdf_reader.metadata.title:
+            text += f"Title: {pdf_reader.metadata.title}\n"
+        if pdf_reader.metadata.author:
+            text += f"Author: {pdf_reader.metadata.author}\n"
+        if pdf_reader.metadata.subject:
+            text += f"Subject: {pdf_reader.metadata.subject}\n"
+        text += "\n"
+    return text
+
+def _pdf_bookmarks(pdf_reader: PyPDF2.PdfReader) -> Dict[int, List[str]]:
+    bookmarks = {}
+
+    def walk(items):
+        for item in items:
+            if isinstance(item, list):
+                walk(item)
+                continue
+            try:
+                page_index = pdf_reader.get_destination_page_number(item)
+            except Exception:
+                continue
+            bookmarks.setdefault(page_index, []).append(str(item.title).strip())
+
+    try:
+        walk(pdf_reader.outline)
+    except Exception:
+        pass
+    return bookmarks
+
+def extract_pdf_pages(source: Source, start: int, end: int, detect_headings: bool = True) -> List[Tuple[str, Headings]]:
+    """Text and links of pages [start, end), with the headings found on each page"""
+    with _open(source) as stream:
+        pdf_reader = PyPDF2.PdfReader(stream)
+        pages = []
+        for page_num in range(start + 1, end + 1):
+            text = _pdf_page_text(pdf_reader.pages[page_num - 1], page_num)
+            pages.append((text, find_headings(text) if detect_headings else []))
+        return pages
+
+def _pdf_page_text(page, page_num: int) -> str:
+    parts = [f"\n--- Page {page_num} ---\n"]
+
+    page_text = page.extract_text()
+    if page_text:
+        parts.append(page_text + "\n")
+
+    # Extract links/annotations
+    if "/Annots" in page:
+        parts.append("\n[Links on this page]\n")
+        for annot in page["/Annots"]:
+            try:
+                obj = annot.get_object()
+                if obj["/Subtype"] == "/Link":
+                    if "/A" in obj:
+                        link_info = obj["/A"].get_object()
+                        if "/URI" in link_info:
+                            parts.append(f"- Link: {link_info['/URI']}\n")
+            except Exception:
+                pass
+
+    return "".join(parts)
+
+def extract_text_from_docx(source: Source) -> Tuple[str, Headings]:
+    """Extract text, links, tables, and images from Word document, with its headings"""
+    with _open(source) as stream:
+        doc = docx.Document(stream)
+    parts = []
+    headings = []
+    length = 0
+
+    # Extract from paragraphs (preserves links)
+    for para in doc.paragraphs:
+        if para.text.strip():
+            style = para.style.name if para.style is not None else ''
+            if style.startswith('Heading') or style == 'Title':
+                headings.append((length, para.text.strip()))
+            parts.append(para.text + "\n")
+            length += len(parts[-1])
+
+        # Extract hyperlinks from paragraph runs
+        for run in para.runs:
+            if run.element.rPr is not None:
+                rPr = run.element.rPr
+                if rPr.rStyle is not None:
+                    # Check for hyperlinks
+                    for child in run.element.iter():
+                        if 'hyperlink' in child.tag.lower():
+                            href = child.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
+                            if href:
+                                parts.append(f"[Link: {run.text}]\n")
+                                length += len(parts[-1])
+
+    # Extract tables
+    if doc.tables:
+        parts.append("\n=== TABLES ===\n")
+        for table_idx, table in enumerate(doc.tables, 1):
+            parts.append(f"\nTable {table_idx}:\n")
+            for row in table.rows:
+                parts.append(" | ".join(cell.text.strip() for cell in row.cells) + "\n")
+
+    # Extract image information
+    image_count = sum(1 for rel in doc.part.rels.values() if "image" in rel.target_ref)
+    if image_count > 0:
+        parts.append(f"\n[Document contains {image_count} images]\n")
+
+    return "".join(parts), headings
+
+def extract_text_from_image(source: Source, timeout: float = 0) -> str:
+    """Extract text and image info using OCR"""
+    with _open(source) as stream:
+        image = Image.open(stream)
+
+        # Get image metadata
+        text = f"[Image: {image.format}, {image.width}x{image.height}px]\n\n"
+
+        # Extract text via OCR; the timeout kills a stuck tesseract process
+        extracted_text = pytesseract.image_to_string(image, timeout=timeout)
+    if extracted_text.strip():
+        text += "=== OCR TEXT ===\n"
+        text += extracted_text
+    else:
+        text += "[No text detected in image]"
+
+    return text
@@ -0,0 +1,84 @@
+"""Local mock of an OpenAI-compatible chat completions API.
+
+Lets the backend run and be tested without Azure OpenAI:
+
+    uvicorn mock_llm_server:app --port 8001
+    LLM_BASE_URL=http://localhost:8001/v1 uvicorn server:app --port 8000
+
+Answers are built from the question and the number of sources in the
+prompt, and can be streamed token by token like the real API.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+# Delay between streamed tokens, to mimic generation latency
+MOCK_TOKEN_DELAY_MS = float(os.environ.get('MOCK_TOKEN_DELAY_MS', '20'))
+# Delay before the first token (or the whole non-streamed answer)
+MOCK_FIRST_TOKEN_DELAY_MS = float(os.environ.get('MOCK_FIRST_TOKEN_DELAY_MS', '200'))
+
+app = FastAPI()
+
+def build_answer(messages: list) -> str:
+    """Deterministic answer citing every source in the prompt"""
+    prompt = messages[-1]['content'] if messages else ''
+    question = re.search(r'Question: (.*)', prompt)
+    question = question.group(1).strip() if question else 'your question'
+    num_sources = len(re.findall(r'\[Source \d+ - ', prompt))
+    if num_sources == 0:
+        return "I don't have information about this in the provided documents."
+    citations = " ".join(f"[{i}]" for i in range(1, num_sources + 1))
+    return f"This is a mock answer to **{question}** drawn from the provided sources {citations}."
+
+def completion_chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        'id': completion_id,
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.post("/v1/chat/completions")
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(request: Request, deployment: str = None):
+    body = await request.json()
+    model = body.get('model') or deployment or 'mock'
+    answer = build_answer(body.get('messages', []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if not body.get('stream'):
+        await asyncio.sleep(MOCK_FIRST_TOKEN_DELAY_MS / 1000)
+        return {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': answer},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': len(answer.split()), 'total_tokens': len(answer.split())}
+        }
+
+    async def stream():
+        await asyncio.sleep(MOCK_FIRST_TOKEN_DELAY_MS / 1000)
+        yield completion_chunk(completion_id, model, {'role': 'assistant', 'content': ''})
+        for token in re.findall(r'\S+\s*', answer):
+            yield completion_chunk(completion_id, model, {'content': token})
+            await asyncio.sleep(MOCK_TOKEN_DELAY_MS / 1000)
+        yield completion_chunk(completion_id, model, {}, finish_reason='stop')
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -1,33 +1,48 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Response
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from bson import Binary
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, NamedTuple, Sequence, Tuple
+import tempfile
+import threading
 import uuid
-from datetime import datetime, timezone
+import zipfile
+import base64
+import codecs
+import hashlib
+import itertools
+import json
+import re
+import shutil
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
 import asyncio
+import bisect
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cachetools import TTLCache
 
 # Document processing
-import PyPDF2
-import docx
-from PIL import Image
-import pytesseract
-import io
-import base64
+import multiprocessing
+import extraction
 
 # RAG components
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # LLM
-from openai import AzureOpenAI
+import httpx
+import tiktoken
+from openai import AsyncAzureOpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -37,8 +52,199 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Initialize sentence transformer model (free)
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Identifies this process; the ingestion jobs it runs are stamped with it
+INSTANCE_ID = str(uuid.uuid4())
+
+# MongoDB indexes: every hot query's filter or sort is covered by one of these
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    unique: bool = False
+
+MONGO_INDEXES = [
+    IndexSpec('documents', [('id', 1)], unique=True),
+    IndexSpec('documents', [('content_hash', 1)]),
+    IndexSpec('documents', [('upload_date', -1)]),
+    IndexSpec('document_chunks', [('id', 1)], unique=True),
+    IndexSpec('document_chunks', [('document_id', 1), ('chunk_index', 1)]),
+    IndexSpec('document_chunks', [('text_hash', 1)]),
+    IndexSpec('document_jobs', [('id', 1)], unique=True),
+    IndexSpec('document_jobs', [('status', 1)]),
+    IndexSpec('document_jobs', [('owner', 1), ('status', 1)]),
+    IndexSpec('chat_sessions', [('id', 1)], unique=True),
+    IndexSpec('chat_sessions', [('updated_at', -1), ('id', -1)]),
+    IndexSpec('chat_messages', [('chat_id', 1), ('seq', 1)], unique=True),
+    IndexSpec('chat_messages', [('id', 1)]),
+    IndexSpec('message_feedback', [('chat_id', 1)]),
+    IndexSpec('search_queries', [('timestamp', -1)]),
+    IndexSpec('index_changes', [('version', 1)], unique=True),
+    IndexSpec('answer_cache', [('key', 1), ('index_version', 1), ('created_at', -1)]),
+    IndexSpec('answer_cache', [('index_version', 1)]),
+]
+
+# (collection, filter, sort) of the queries the API runs on every request or job
+HOT_QUERIES = [
+    ('documents', {'id': ''}, None),
+    ('documents', {'content_hash': ''}, None),
+    ('documents', {}, [('upload_date', -1)]),
+    ('document_chunks', {'document_id': ''}, [('chunk_index', 1)]),
+    ('document_chunks', {'text_hash': {'$in': ['']}}, None),
+    ('document_jobs', {'id': ''}, None),
+    ('document_jobs', {'status': {'$in': ['queued', 'processing']}}, None),
+    ('document_jobs', {'owner': '', 'status': {'$in': ['queued', 'processing']}}, None),
+    ('chat_sessions', {'id': ''}, None),
+    ('chat_sessions', {}, [('updated_at', -1), ('id', -1)]),
+    ('chat_messages', {'chat_id': ''}, [('seq', -1)]),
+    ('chat_messages', {'id': '', 'chat_id': ''}, None),
+    ('message_feedback', {'chat_id': ''}, None),
+    ('search_queries', {}, [('timestamp', -1)]),
+    ('index_changes', {'version': {'$gt': 0}}, [('version', 1)]),
+    ('answer_cache', {'key': '', 'index_version': 0}, [('created_at', -1)]),
+    ('answer_cache', {'index_version': {'$lt': 0}}, None),
+]
+
+# Run explain() on HOT_QUERIES at startup and log any collection scans
+MONGO_EXPLAIN_ON_STARTUP = os.environ.get('MONGO_EXPLAIN_ON_STARTUP', 'false').lower() == 'true'
+
+async def ensure_indexes():
+    """Create every index in MONGO_INDEXES; existing ones are left as they are"""
+    for spec in MONGO_INDEXES:
+        try:
+            await db[spec.collection].create_index(spec.keys, unique=spec.unique)
+        except Exception as e:
+            # e.g. duplicate keys in old data: keep serving, but make it visible
+            logging.error(f"Could not create index {spec.keys} on {spec.collection}: {e}")
+
+def plan_stages(plan) -> List[str]:
+    """Every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+async def explain_hot_queries() -> List[Dict[str, Any]]:
+    """Winning plan stages of each hot query, flagging the ones that scan the whole collection"""
+    report = []
+    for collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = await cursor.limit(1).explain()
+        stages = plan_stages(plan.get('queryPlanner', {}).get('winningPlan', {}))
+        report.append({
+            'collection': collection,
+            'filter': json.dumps(query),
+            'sort': sort,
+            'stages': stages,
+            'collscan': 'COLLSCAN' in stages
+        })
+    return report
+
+async def check_query_plans():
+    """Log a warning for every hot query that falls back to a collection scan"""
+    for entry in await explain_hot_queries():
+        if entry['collscan']:
+            logging.warning(f"COLLSCAN on {entry['collection']} for {entry['filter']} sort={entry['sort']}")
+
+# Sentence transformer model (free), loaded on startup rather than at import
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+# Embedding inference runs in worker threads; concurrent queries are micro-batched
+EMBEDDING_DOCUMENT_WORKERS = int(os.environ.get('EMBEDDING_DOCUMENT_WORKERS', '1'))
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get('EMBEDDING_BATCH_WINDOW_MS', '5'))
+EMBEDDING_MAX_BATCH = int(os.environ.get('EMBEDDING_MAX_BATCH', '64'))
+
+class EmbeddingService:
+    """Runs embedding inference off the event loop.
+
+    Query texts from concurrent requests are collected for up to
+    EMBEDDING_BATCH_WINDOW_MS (or EMBEDDING_MAX_BATCH texts) and encoded in a
+    single call on a dedicated thread. Document batches use their own pool,
+    so a large ingestion never queues in front of query embeddings.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.model = None
+        self._load_lock = threading.Lock()
+        self._query_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embed-query')
+        self._document_executor = ThreadPoolExecutor(max_workers=EMBEDDING_DOCUMENT_WORKERS,
+                                                     thread_name_prefix='embed-document')
+        self._pending = []  # (text, future) awaiting the next micro-batch
+        self._flush_handle = None
+        self._batch_tasks = set()  # Running micro-batches; the loop only keeps weak references
+
+    def load(self):
+        """Load the model unless it already is (blocking; startup runs it in a thread)"""
+        with self._load_lock:
+            if self.model is None:
+                # Imported here so that importing this module doesn't pull in torch
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    def _encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        model = self.model or self.load()
+        # Unit-length vectors, so inner product search is cosine similarity
+        embeddings = model.encode(texts, convert_to_numpy=True, batch_size=batch_size, normalize_embeddings=True)
+        return embeddings.astype('float32')
+
+    async def encode_documents(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Embed document chunks in the document pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._document_executor, self._encode, texts, batch_size)
+
+    async def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of queries in a single encode call on the query thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._query_executor, self._encode, texts, EMBEDDING_MAX_BATCH)
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        """Embed one query, sharing an encode call with concurrent queries"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= EMBEDDING_MAX_BATCH:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(EMBEDDING_BATCH_WINDOW_MS / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[tuple]):
+        loop = asyncio.get_running_loop()
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = await loop.run_in_executor(self._query_executor, self._encode, texts, len(texts))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def shutdown(self):
+        self._query_executor.shutdown(wait=False)
+        self._document_executor.shutdown(wait=False)
+
+embedding_service = EmbeddingService(EMBEDDING_MODEL)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -47,70 +253,1015 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # FAISS index (in-memory)
-faiss_index = None
-chunk_metadata = {}  # Changed from list to dict for O(1) lookup
-metadata_index_map = []  # Maps FAISS index position to chunk_id
+# Fraction of removed vectors after which the index storage is compacted
+INDEX_COMPACTION_RATIO = float(os.environ.get('INDEX_COMPACTION_RATIO', '0.25'))
+# Number of chunks streamed from MongoDB per batch while rebuilding the index
+INDEX_REBUILD_BATCH_SIZE = int(os.environ.get('INDEX_REBUILD_BATCH_SIZE', '2048'))
+# Only the fields the index needs are read back during a rebuild
+CHUNK_INDEX_PROJECTION = {
+    '_id': 0, 'id': 1, 'vector_id': 1, 'document_id': 1, 'document_name': 1,
+    'chunk_index': 1, 'text': 1, 'page_number': 1, 'section_title': 1,
+    'embedding': 1, 'embedding_dtype': 1
+}
+# Local snapshot of the index, versioned against the change counter in MongoDB
+INDEX_SNAPSHOT_PATH = Path(os.environ.get('INDEX_SNAPSHOT_PATH', str(ROOT_DIR / 'index_snapshot' / 'faiss')))
+# Number of index changes after which a fresh snapshot is written
+INDEX_SNAPSHOT_INTERVAL = int(os.environ.get('INDEX_SNAPSHOT_INTERVAL', '50'))
+# Logged index changes kept behind the latest snapshot, for other processes replaying older snapshots
+INDEX_CHANGE_RETENTION = int(os.environ.get('INDEX_CHANGE_RETENTION', '1000'))
+# Index backend: flat, hnsw, ivf, ivfpq, or auto (flat until INDEX_AUTO_THRESHOLD chunks)
+INDEX_TYPES = ('flat', 'hnsw', 'ivf', 'ivfpq')
+# Vectors are normalized and searched by inner product, i.e. cosine similarity.
+# Snapshots record the metric; one built for another metric is rebuilt from MongoDB.
+INDEX_METRIC = 'cosine'
+INDEX_TYPE = os.environ.get('INDEX_TYPE', 'auto')
+INDEX_AUTO_THRESHOLD = int(os.environ.get('INDEX_AUTO_THRESHOLD', '50000'))
+INDEX_AUTO_TYPE = os.environ.get('INDEX_AUTO_TYPE', 'hnsw')
+if INDEX_TYPE not in INDEX_TYPES + ('auto',) or INDEX_AUTO_TYPE not in INDEX_TYPES:
+    raise ValueError(f"INDEX_TYPE must be one of {INDEX_TYPES + ('auto',)}")
+# IVF modes need enough vectors to train on; below this they fall back to flat
+INDEX_MIN_TRAIN_SIZE = int(os.environ.get('INDEX_MIN_TRAIN_SIZE', '10000'))
+INDEX_TRAIN_SAMPLE = int(os.environ.get('INDEX_TRAIN_SAMPLE', '100000'))
+HNSW_M = int(os.environ.get('HNSW_M', '32'))
+HNSW_EF_CONSTRUCTION = int(os.environ.get('HNSW_EF_CONSTRUCTION', '80'))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', '64'))
+IVF_NLIST = int(os.environ.get('IVF_NLIST', '0'))  # 0 = 4 * sqrt(corpus size)
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', '16'))
+IVFPQ_M = int(os.environ.get('IVFPQ_M', '48'))  # Sub-quantizers; must divide the dimension
+# Document-scoped searches up to this many vectors run exactly over just the scope
+SCOPED_EXACT_SEARCH_LIMIT = int(os.environ.get('SCOPED_EXACT_SEARCH_LIMIT', '20000'))
+# Larger scopes use an IDSelector: ranges over contiguous ID blocks, else an ID batch
+SCOPE_MAX_RANGES = int(os.environ.get('SCOPE_MAX_RANGES', '16'))
+# Embeddings are stored as raw little-endian binary: float32 (default) or float16
+EMBEDDING_STORAGE_DTYPE = os.environ.get('EMBEDDING_STORAGE_DTYPE', 'float32')
+if EMBEDDING_STORAGE_DTYPE not in ('float32', 'float16'):
+    raise ValueError("EMBEDDING_STORAGE_DTYPE must be 'float32' or 'float16'")
+# Lexical (BM25) side of hybrid retrieval
+BM25_K1 = float(os.environ.get('BM25_K1', '1.2'))
+BM25_B = float(os.environ.get('BM25_B', '0.75'))
+# Reciprocal-rank fusion constant and per-retriever candidate depth (x top_k)
+HYBRID_RRF_K = int(os.environ.get('HYBRID_RRF_K', '60'))
+HYBRID_CANDIDATE_FACTOR = int(os.environ.get('HYBRID_CANDIDATE_FACTOR', '4'))
+RETRIEVAL_MODES = ('dense', 'hybrid')
 
-async def rebuild_faiss_index():
-    """Rebuild FAISS index from MongoDB on startup"""
-    global faiss_index, chunk_metadata, metadata_index_map
-    
-    try:
-        # Load all chunks from MongoDB
-        chunks = await db.document_chunks.find({}, {"_id": 0}).to_list(10000)
-        
-        if not chunks:
-            logging.info("No chunks found in MongoDB, FAISS index empty")
-            faiss_index = None
-            return
-        
-        # Extract embeddings and metadata
-        embeddings_list = []
-        chunk_metadata = {}  # Reset to empty dict
-        metadata_index_map = []
-        
-        for chunk in chunks:
-            if 'embedding' in chunk and chunk['embedding']:
-                chunk_id = chunk.get('id')
-                embeddings_list.append({
-                    'embedding': np.array(chunk['embedding']),
-                    'chunk_id': chunk_id,
-                    'document_id': chunk.get('document_id'),
-                    'document_name': chunk.get('document_name', ''),
-                    'chunk_index': chunk.get('chunk_index', 0),
-                    'text': chunk.get('text', '')
-                })
-        
-        if not embeddings_list:
-            logging.info("No embeddings found in MongoDB")
-            faiss_index = None
+def encode_embedding(embedding: np.ndarray) -> Binary:
+    """Pack an embedding as compact BSON binary in the configured dtype"""
+    stored = np.dtype(EMBEDDING_STORAGE_DTYPE).newbyteorder('<')
+    return Binary(np.asarray(embedding, dtype=stored).tobytes())
+
+def decode_embedding(value, dtype: Optional[str] = None) -> np.ndarray:
+    """Decode a stored embedding (binary or legacy float list) to float32"""
+    if isinstance(value, (bytes, bytearray)):
+        stored = np.dtype(dtype or 'float32').newbyteorder('<')
+        return np.frombuffer(value, dtype=stored).astype('float32')
+    return np.asarray(value, dtype='float32')
+
+async def allocate_vector_ids(count: int) -> np.ndarray:
+    """Reserve a contiguous block of stable integer FAISS IDs for new chunks"""
+    counter = await db.counters.find_one_and_update(
+        {'_id': 'vector_id'},
+        {'$inc': {'value': count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    end = counter['value']
+    return np.arange(end - count, end, dtype='int64')
+
+async def get_index_version() -> int:
+    """Current value of the index change counter kept in MongoDB"""
+    state = await db.index_state.find_one({'_id': 'faiss'})
+    return state['version'] if state else 0
+
+async def record_index_change(op: str, document_ids: List[str]) -> int:
+    """Bump the index change counter and log the change for snapshot replay"""
+    state = await db.index_state.find_one_and_update(
+        {'_id': 'faiss'},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await db.index_changes.insert_one({
+        'version': state['version'],
+        'op': op,
+        'document_ids': document_ids,
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    })
+    return state['version']
+
+def resolve_index_type(num_vectors: int, index_type: Optional[str] = None) -> str:
+    """Index backend to use for a corpus of the given size (INDEX_TYPE unless one is pinned)"""
+    index_type = index_type or INDEX_TYPE
+    if index_type == 'auto':
+        index_type = INDEX_AUTO_TYPE if num_vectors >= INDEX_AUTO_THRESHOLD else 'flat'
+    if index_type in ('ivf', 'ivfpq') and num_vectors < INDEX_MIN_TRAIN_SIZE:
+        return 'flat'
+    return index_type
+
+def build_faiss_index(index_type: str, dimension: int, training_vectors: Optional[np.ndarray] = None):
+    """Create an empty ID-addressable index of the given type, training it if needed"""
+    if index_type == 'flat':
+        # Simple FlatIP storage - exact, and works with any number of documents
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+    if index_type == 'hnsw':
+        hnsw = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+
+    # IVF indexes store IDs themselves; a hashtable direct map allows reconstruct by ID
+    num_train = len(training_vectors)
+    nlist = IVF_NLIST or int(4 * np.sqrt(num_train))
+    nlist = max(1, min(nlist, num_train // 39))
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_type == 'ivf':
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        pq_m = IVFPQ_M if dimension % IVFPQ_M == 0 else max(m for m in range(1, dimension // 4 + 1) if dimension % m == 0)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+    index.train(training_vectors)
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    index.nprobe = IVF_NPROBE
+    return index
+
+def search_params(index_type: str, selector=None):
+    """FAISS search parameters (nprobe / efSearch / ID filter) for a backend"""
+    if index_type == 'hnsw':
+        return faiss.SearchParametersHNSW(efSearch=HNSW_EF_SEARCH, sel=selector)
+    if index_type in ('ivf', 'ivfpq'):
+        return faiss.SearchParametersIVF(nprobe=IVF_NPROBE, sel=selector)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+def stored_vectors(index) -> tuple:
+    """Return (vector_ids, vectors) held by an index; IVFPQ vectors are approximate"""
+    if isinstance(index, faiss.IndexIDMap2):
+        vector_ids = faiss.vector_to_array(index.id_map).astype('int64')
+        return vector_ids, index.index.reconstruct_n(0, index.ntotal)
+    invlists = index.invlists
+    vector_ids = np.concatenate([
+        faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+        for list_no in range(index.nlist)
+    ]).astype('int64')
+    return vector_ids, index.reconstruct_batch(vector_ids)
+
+def sample_rows(vectors: np.ndarray, limit: int) -> np.ndarray:
+    """Random subset of rows used for training IVF quantizers"""
+    if len(vectors) <= limit:
+        return vectors
+    rows = np.random.default_rng(0).choice(len(vectors), limit, replace=False)
+    return vectors[np.sort(rows)]
+
+# Identifiers such as "E-1042", "v2.3.1" or "part_no" stay whole, and are also indexed by their parts
+LEXICAL_TOKEN = re.compile(r'[a-z0-9]+(?:[-_./:][a-z0-9]+)*')
+LEXICAL_PART = re.compile(r'[a-z0-9]+')
+LEXICAL_STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have how i if in into is it its of on or '
+    'that the their then there these this to was were what when where which who why will with'.split()
+)
+
+def lexical_tokens(text: str) -> List[str]:
+    """Lowercased BM25 terms of a text"""
+    text = text.lower()
+    tokens = [t for t in LEXICAL_TOKEN.findall(text) if t not in LEXICAL_STOPWORDS]
+    compounds = list(itertools.filterfalse(str.isalnum, tokens))
+    if compounds:
+        tokens.extend(LEXICAL_PART.findall(' '.join(compounds)))
+    return tokens
+
+class PostingsSegment(NamedTuple):
+    """Immutable CSR postings: the postings of ``terms[i]`` are ``[offsets[i], offsets[i + 1])``"""
+    terms: np.ndarray  # Sorted term IDs (int32)
+    offsets: np.ndarray  # int64, len(terms) + 1
+    rows: np.ndarray  # int32, ascending within each term
+    frequencies: np.ndarray  # uint16 term frequencies
+
+    @classmethod
+    def from_sorted(cls, term_ids: np.ndarray, rows: np.ndarray, frequencies: np.ndarray) -> 'PostingsSegment':
+        terms, starts = np.unique(term_ids, return_index=True)
+        offsets = np.append(starts, len(term_ids)).astype('int64')
+        return cls(terms.astype('int32'), offsets, rows.astype('int32'), frequencies.astype('uint16'))
+
+    def postings(self, term_id: int):
+        i = int(np.searchsorted(self.terms, term_id))
+        if i == len(self.terms) or self.terms[i] != term_id:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rows[start:end], self.frequencies[start:end]
+
+    def triples(self):
+        """(term_ids, rows, frequencies), one entry per posting, ordered by term"""
+        return np.repeat(self.terms, np.diff(self.offsets)), self.rows, self.frequencies
+
+def merge_segments(segments: List[PostingsSegment], live: np.ndarray,
+                   renumber: Optional[np.ndarray] = None) -> PostingsSegment:
+    """Merge segments into one, dropping postings of dead rows (and renumbering rows if given)"""
+    parts = [segment.triples() for segment in segments]
+    term_ids = np.concatenate([p[0] for p in parts])
+    rows = np.concatenate([p[1] for p in parts])
+    frequencies = np.concatenate([p[2] for p in parts])
+    keep = live[rows]
+    term_ids, rows, frequencies = term_ids[keep], rows[keep], frequencies[keep]
+    if renumber is not None:
+        rows = renumber[rows]
+    # Segments hold increasing row ranges, so a stable sort keeps rows ascending per term
+    order = np.argsort(term_ids, kind='stable')
+    return PostingsSegment.from_sorted(term_ids[order], rows[order], frequencies[order])
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over chunk texts, keyed by FAISS vector_id.
+
+    Each chunk gets a dense row number. Postings are kept as compact CSR
+    segments of numpy arrays (rows as int32, term frequencies as uint16):
+    every ingested batch becomes a small new segment, and segments are merged
+    pairwise as they grow, so ingest stays incremental and a query touches
+    only a handful of arrays per term. Removed rows are just marked dead and
+    skipped at query time; once INDEX_COMPACTION_RATIO of the rows are dead
+    everything is merged into one segment and the rows renumbered. Document
+    frequencies are counted over live rows at query time, so they never go
+    stale.
+
+    Updates run in a worker thread while searches keep running on the event
+    loop; writers are serialized by the caller and build new arrays aside,
+    then swap them in under ``_swap_lock``, which searches hold only to read
+    a consistent set of arrays.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}  # term -> term ID
+        self.segments = []  # Oldest (largest) first
+        self.row_vector_ids = np.empty(0, dtype='int64')
+        self.row_lengths = np.empty(0, dtype='int32')
+        self.live = np.empty(0, dtype=bool)
+        self.vector_rows = {}  # vector_id -> row
+        self.live_length = 0  # Total tokens in live rows
+        self._swap_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.vector_rows)
+
+    @classmethod
+    def build(cls, items) -> 'LexicalIndex':
+        """Index an iterable of (vector_id, text) in one go (runs in a thread)"""
+        index = cls()
+        index.add_many(items)
+        return index
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """The index as named arrays for the snapshot; caller must hold off writers"""
+        # Terms never contain a newline, and term IDs follow insertion order
+        arrays = {
+            'vocabulary': np.frombuffer('\n'.join(self.vocabulary).encode(), dtype='uint8'),
+            'row_vector_ids': self.row_vector_ids,
+            'row_lengths': self.row_lengths,
+            'live': self.live
+        }
+        for i, segment in enumerate(self.segments):
+            for field, values in zip(segment._fields, segment):
+                arrays[f'segment{i}_{field}'] = values
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays) -> 'LexicalIndex':
+        """Restore an index saved with ``to_arrays`` (runs in a thread)"""
+        index = cls()
+        terms = arrays['vocabulary'].tobytes().decode()
+        index.vocabulary = {term: i for i, term in enumerate(terms.split('\n'))} if terms else {}
+        i = 0
+        while f'segment{i}_terms' in arrays:
+            index.segments.append(PostingsSegment(*(arrays[f'segment{i}_{field}'] for field in PostingsSegment._fields)))
+            i += 1
+        index.row_vector_ids = arrays['row_vector_ids']
+        index.row_lengths = arrays['row_lengths']
+        index.live = arrays['live']
+        live_rows = np.flatnonzero(index.live)
+        index.vector_rows = dict(zip(index.row_vector_ids[live_rows].tolist(), live_rows.tolist()))
+        index.live_length = int(index.row_lengths[live_rows].sum())
+        return index
+
+    def add_many(self, items):
+        """Index (vector_id, text) pairs as one new segment"""
+        term_ids, rows, frequencies = [], [], []
+        vector_ids, lengths = [], []
+        new_rows = {}
+        row = len(self.row_vector_ids)
+        vocabulary = self.vocabulary
+        for vector_id, text in items:
+            if vector_id in self.vector_rows or vector_id in new_rows:
+                continue
+            tokens = lexical_tokens(text)
+            counts = Counter(tokens)
+            try:
+                ids = list(map(vocabulary.__getitem__, counts))
+            except KeyError:  # New terms; rare once the vocabulary has warmed up
+                ids = [vocabulary.setdefault(t, len(vocabulary)) for t in counts]
+            term_ids.extend(ids)
+            frequencies.extend(counts.values())
+            rows.extend([row] * len(counts))
+            new_rows[vector_id] = row
+            vector_ids.append(vector_id)
+            lengths.append(len(tokens))
+            row += 1
+        if not vector_ids:
             return
-        
-        # Initialize FAISS index with FlatL2 (simple, reliable, no training needed)
-        embeddings_array = np.array([e['embedding'] for e in embeddings_list]).astype('float32')
-        dimension = embeddings_array.shape[1]
-        
-        # Use simple FlatL2 index - reliable and works with any number of documents
-        faiss_index = faiss.IndexFlatL2(dimension)
-        faiss_index.add(embeddings_array)
-        
-        # Rebuild metadata as dictionary for O(1) lookup
-        for idx, e in enumerate(embeddings_list):
-            chunk_id = e['chunk_id']
-            chunk_metadata[chunk_id] = {
-                'document_id': e['document_id'],
-                'document_name': e['document_name'],
-                'chunk_index': e['chunk_index'],
-                'text': e['text'],
+
+        row_vector_ids = np.concatenate([self.row_vector_ids, np.array(vector_ids, dtype='int64')])
+        row_lengths = np.concatenate([self.row_lengths, np.array(lengths, dtype='int32')])
+        live = np.concatenate([self.live, np.ones(len(vector_ids), dtype=bool)])
+
+        term_ids = np.array(term_ids, dtype='int32')
+        order = np.argsort(term_ids, kind='stable')
+        segments = self.segments + [PostingsSegment.from_sorted(
+            term_ids[order],
+            np.array(rows, dtype='int32')[order],
+            np.minimum(np.array(frequencies, dtype='int64'), 0xFFFF)[order]
+        )]
+        # Binary-counter merging keeps O(log n) segments at amortized O(log n) work per posting
+        while len(segments) > 1 and len(segments[-2].rows) <= 2 * len(segments[-1].rows):
+            segments[-2:] = [merge_segments(segments[-2:], live)]
+
+        with self._swap_lock:
+            self.row_vector_ids, self.row_lengths, self.live = row_vector_ids, row_lengths, live
+            self.segments = segments
+            self.vector_rows.update(new_rows)
+            self.live_length += sum(lengths)
+
+    def remove(self, vector_ids):
+        with self._swap_lock:
+            for vector_id in vector_ids:
+                row = self.vector_rows.pop(vector_id, None)
+                if row is not None:
+                    self.live[row] = False
+                    self.live_length -= int(self.row_lengths[row])
+        dead = len(self.live) - len(self.vector_rows)
+        if dead and dead / len(self.live) >= INDEX_COMPACTION_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """Merge every segment into one without the dead rows, renumbering the live ones"""
+        live = self.live
+        renumber = (np.cumsum(live) - 1).astype('int32')
+        segments = [merge_segments(self.segments, live, renumber)] if self.vector_rows else []
+        row_vector_ids = self.row_vector_ids[live]
+        vector_rows = {vector_id: row for row, vector_id in enumerate(row_vector_ids.tolist())}
+        with self._swap_lock:
+            self.segments = segments
+            self.row_vector_ids = row_vector_ids
+            self.row_lengths = self.row_lengths[live]
+            self.live = np.ones(len(row_vector_ids), dtype=bool)
+            self.vector_rows = vector_rows
+
+    def search(self, query: str, k: int, scope: Optional[np.ndarray] = None):
+        """Top-k (vector_ids, BM25 scores), best first; ``scope`` limits the vector_ids searched.
+
+        Scores are summed into one dense float32 array over the rows, so each
+        posting is touched once with no sorting, and a term found in nearly
+        every chunk costs a few passes over its postings. On a 200k-chunk
+        corpus a query for three terms, one of them in almost every chunk,
+        takes a few milliseconds; queries of rarer terms well under one.
+        """
+        empty = np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+        term_ids = [self.vocabulary[t] for t in dict.fromkeys(lexical_tokens(query)) if t in self.vocabulary]
+        if not term_ids or k <= 0:
+            return empty
+        with self._swap_lock:
+            segments, live, row_lengths, row_vector_ids = self.segments, self.live, self.row_lengths, self.row_vector_ids
+            num_live, live_length = len(self.vector_rows), self.live_length
+            if scope is not None:
+                scope_rows = np.sort(np.fromiter(
+                    (row for row in map(self.vector_rows.get, scope.tolist()) if row is not None), dtype='int64'
+                ))
+        if num_live == 0:
+            return empty
+
+        has_dead = num_live < len(live)
+        # BM25 length normalization as length * scale + offset, in float32
+        scale = np.float32(BM25_K1 * BM25_B / (live_length / num_live or 1.0))
+        offset = np.float32(BM25_K1 * (1.0 - BM25_B))
+        scores = np.zeros(len(live), dtype='float32')
+        touched = []
+        for term_id in term_ids:
+            found = [p for p in (segment.postings(term_id) for segment in segments) if p is not None]
+            if has_dead:
+                document_frequency = sum(int(np.count_nonzero(live[rows])) for rows, _ in found)
+            else:
+                document_frequency = sum(len(rows) for rows, _ in found)
+            if document_frequency == 0:
+                continue
+            idf = np.log(1.0 + (num_live - document_frequency + 0.5) / (document_frequency + 0.5))
+            for rows, frequencies in found:
+                term_scores = frequencies.astype('float32')
+                denominator = np.multiply(row_lengths[rows], scale, dtype='float32')
+                denominator += offset
+                denominator += term_scores
+                term_scores /= denominator
+                term_scores *= np.float32(idf * (BM25_K1 + 1.0))
+                # Rows are unique within a term, so the scatter-add has no collisions
+                scores[rows] += term_scores
+                touched.append(rows)
+
+        if scope is not None:
+            rows = scope_rows[scores[scope_rows] > 0]
+        elif sum(map(len, touched)) * 8 > len(scores):
+            rows = np.flatnonzero(scores)
+        else:
+            rows = np.unique(np.concatenate(touched)) if touched else np.empty(0, dtype='int64')
+        if has_dead:
+            rows = rows[live[rows]]
+        if len(rows) == 0:
+            return empty
+        top = np.argpartition(-scores[rows], k - 1)[:k] if len(rows) > k else np.arange(len(rows))
+        top = rows[top[np.argsort(-scores[rows[top]], kind='stable')]]
+        return row_vector_ids[top], scores[top]
+
+class FaissIndexManager:
+    """Owns the live FAISS index and the chunk metadata that backs it.
+
+    Vectors are keyed by each chunk's stable integer ``vector_id`` (an
+    IndexIDMap2 for flat/HNSW storage, native IDs for IVF), so uploads
+    append directly and deletes really remove vectors. HNSW cannot remove
+    in place, so its deletes become tombstones that are filtered at search
+    time until compaction. The backend follows ``resolve_index_type`` and is
+    retrained in the background when the corpus crosses the auto threshold,
+    unless an admin compact pinned one.
+    Every change bumps a version counter in MongoDB and is logged
+    to ``index_changes``; a local snapshot tagged with that version lets a
+    restart load the index from disk and replay only the newer changes. A
+    full rebuild from MongoDB is only needed when no usable snapshot exists
+    or as an explicit repair. A BM25 ``LexicalIndex`` over the same chunk
+    texts is kept in step with the vectors for hybrid retrieval and saved
+    with the snapshot; its updates run in a worker thread.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.lexical = LexicalIndex()
+        self.chunk_metadata = {}  # chunk_id -> metadata dict for O(1) lookup
+        self.id_to_chunk = {}  # FAISS vector_id -> chunk_id
+        self.document_vector_ids = {}  # document_id -> list of vector_ids
+        self.index_type = 'flat'
+        self.index_type_override = None  # Backend pinned by an admin compact; kept across resets
+        self.tombstones = set()  # Removed vector_ids still held by HNSW storage
+        self._tombstone_selector = None
+        self.removed_since_compaction = 0
+        self._mapped = False  # Storage is a read-only view of the snapshot file
+        self.version = 0  # Index change counter this state corresponds to
+        self.snapshot_version = 0  # Version of the last snapshot written/loaded
+        self._snapshot_task = None
+        self._storage_task = None
+        self._lock = asyncio.Lock()
+        self._snapshot_lock = asyncio.Lock()  # Held from a snapshot's first file to its last
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_metadata)
+
+    def _reset(self):
+        self.index = None
+        self.lexical = LexicalIndex()
+        self.index_type = 'flat'
+        self.chunk_metadata = {}
+        self.id_to_chunk = {}
+        self.document_vector_ids = {}
+        self._set_tombstones(set())
+        self.removed_since_compaction = 0
+        self._mapped = False
+
+    def _set_tombstones(self, tombstones: set):
+        self.tombstones = tombstones
+        if tombstones:
+            batch = faiss.IDSelectorBatch(np.fromiter(tombstones, dtype='int64', count=len(tombstones)))
+            # Keep the inner selector alive alongside the wrapper that points at it
+            self._tombstone_selector = (faiss.IDSelectorNot(batch), batch)
+        else:
+            self._tombstone_selector = None
+
+    def search(self, query_embeddings: np.ndarray, k: int, selector=None):
+        """Search the live index, excluding tombstones; returns (cosine similarities, vector_ids)"""
+        if self._tombstone_selector is not None:
+            not_removed = self._tombstone_selector[0]
+            selector = faiss.IDSelectorAnd(selector, not_removed) if selector is not None else not_removed
+        params = search_params(self.index_type, selector)
+        return self.index.search(query_embeddings, k, params=params)
+
+    def scope_vector_ids(self, document_ids: List[str]) -> np.ndarray:
+        """Sorted vector_ids of the live chunks belonging to the given documents"""
+        vector_ids = [v for document_id in dict.fromkeys(document_ids)
+                      for v in self.document_vector_ids.get(document_id, [])]
+        return np.sort(np.array(vector_ids, dtype='int64'))
+
+    @staticmethod
+    def scope_selector(vector_ids: np.ndarray):
+        """IDSelector for a sorted scope; returns (selector, objects to keep alive)"""
+        # Each document's chunks get one contiguous ID block, so scopes are usually a few ranges
+        breaks = np.flatnonzero(np.diff(vector_ids) != 1) + 1
+        starts = vector_ids[np.r_[0, breaks]]
+        ends = vector_ids[np.r_[breaks - 1, len(vector_ids) - 1]] + 1
+        if len(starts) > SCOPE_MAX_RANGES:
+            batch = faiss.IDSelectorBatch(vector_ids)
+            return batch, [batch]
+
+        selector = None
+        keep_alive = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            id_range = faiss.IDSelectorRange(start, end)
+            selector = id_range if selector is None else faiss.IDSelectorOr(selector, id_range)
+            keep_alive.extend([id_range, selector])
+        return selector, keep_alive
+
+    def search_scoped(self, query_embeddings: np.ndarray, k: int, document_ids: List[str]):
+        """Search only the chunks of the given documents; returns (cosine similarities, vector_ids).
+
+        Small scopes (and any scope on flat storage) are searched exactly over
+        the scope's own vectors, so cost follows the scope size rather than the
+        corpus. Larger scopes on ANN backends filter inside FAISS with an
+        IDSelector.
+        """
+        vector_ids = self.scope_vector_ids(document_ids)
+        k = min(k, len(vector_ids))
+        if k == 0:
+            empty = np.empty((len(query_embeddings), 0))
+            return empty.astype('float32'), empty.astype('int64')
+
+        if self.index_type == 'flat' or len(vector_ids) <= SCOPED_EXACT_SEARCH_LIMIT:
+            vectors = self.index.reconstruct_batch(vector_ids)
+            similarities, rows = faiss.knn(query_embeddings, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)
+            return similarities, vector_ids[rows]
+
+        selector, _keep_alive = self.scope_selector(vector_ids)
+        return self.search(query_embeddings, k, selector)
+
+    async def _append(self, embeddings: np.ndarray, vector_ids: np.ndarray, chunks: List[Dict]):
+        """Add vectors and their metadata; caller must hold the lock"""
+        # New embeddings are already unit length; this also covers ones stored before that
+        embeddings = np.array(embeddings, dtype='float32', order='C')
+        faiss.normalize_L2(embeddings)
+        vector_ids = np.ascontiguousarray(vector_ids, dtype='int64')
+        if self.index is None:
+            # Start on storage that needs no training; IVF is trained once there is enough data
+            self.index_type = resolve_index_type(len(embeddings), self.index_type_override)
+            if self.index_type in ('ivf', 'ivfpq'):
+                self.index_type = 'flat'
+            self.index = build_faiss_index(self.index_type, embeddings.shape[1])
+        await self._own_storage()
+        self.index.add_with_ids(embeddings, vector_ids)
+
+        for chunk, vector_id in zip(chunks, vector_ids.tolist()):
+            chunk_id = chunk['id']
+            self.chunk_metadata[chunk_id] = {
+                'vector_id': vector_id,
+                'document_id': chunk['document_id'],
+                'document_name': chunk.get('document_name', ''),
+                'chunk_index': chunk.get('chunk_index', 0),
+                'text': chunk.get('text', ''),
                 'page_number': chunk.get('page_number'),
                 'section_title': chunk.get('section_title')
             }
-            metadata_index_map.append(chunk_id)
-        
-        logging.info(f"FAISS index rebuilt from MongoDB: {len(chunk_metadata)} chunks loaded")
-    except Exception as e:
-        logging.error(f"Error rebuilding FAISS index: {e}")
-        faiss_index = None
+            self.id_to_chunk[vector_id] = chunk_id
+            self.document_vector_ids.setdefault(chunk['document_id'], []).append(vector_id)
+        texts = [(vector_id, chunk.get('text', '')) for chunk, vector_id in zip(chunks, vector_ids.tolist())]
+        await asyncio.to_thread(self.lexical.add_many, texts)
+
+    async def _own_storage(self):
+        """Copy memory-mapped snapshot storage into memory before its first change; caller must hold the lock"""
+        if self._mapped:
+            self.index = await asyncio.to_thread(
+                lambda index: faiss.deserialize_index(faiss.serialize_index(index)), self.index
+            )
+            self._mapped = False
+
+    async def _exact_vectors(self) -> tuple:
+        """(vector_ids, vectors) of the live chunks, decoded from the embeddings in MongoDB
+
+        Used instead of the index's own vectors when those are lossy (IVFPQ),
+        so rebuilding never compounds quantization error. Caller must hold the lock.
+        """
+        vector_ids = np.empty(self.size, dtype='int64')
+        vectors = np.empty((self.size, self.index.d), dtype='float32')
+        row = 0
+        cursor = db.document_chunks.find(
+            {'embedding': {'$ne': None}},
+            {'_id': 0, 'vector_id': 1, 'embedding': 1, 'embedding_dtype': 1},
+            batch_size=INDEX_REBUILD_BATCH_SIZE
+        )
+        async for chunk in cursor:
+            if chunk.get('vector_id') not in self.id_to_chunk or row == self.size:
+                continue
+            vector_ids[row] = chunk['vector_id']
+            vectors[row] = decode_embedding(chunk['embedding'], chunk.get('embedding_dtype'))
+            row += 1
+        vector_ids, vectors = vector_ids[:row], vectors[:row]
+        missing = np.setdiff1d(np.fromiter(self.id_to_chunk, dtype='int64', count=self.size), vector_ids)
+        if len(missing):
+            logging.warning(f"{len(missing)} indexed chunks have no embedding in MongoDB, keeping their indexed vectors")
+            vector_ids = np.concatenate([vector_ids, missing])
+            vectors = np.concatenate([vectors, self.index.reconstruct_batch(missing)])
+        faiss.normalize_L2(vectors)
+        return vector_ids, vectors
+
+    def _build_storage(self, index_type: str, exact: Optional[tuple] = None):
+        """Copy the live vectors (or the given exact ones) into fresh storage of the given type (runs in a thread)"""
+        if exact is not None:
+            vector_ids, vectors = exact
+        else:
+            vector_ids, vectors = stored_vectors(self.index)
+            if self.tombstones:
+                keep = ~np.isin(vector_ids, np.fromiter(self.tombstones, dtype='int64', count=len(self.tombstones)))
+                vector_ids, vectors = vector_ids[keep], vectors[keep]
+        training = sample_rows(vectors, INDEX_TRAIN_SAMPLE) if index_type in ('ivf', 'ivfpq') else None
+        index = build_faiss_index(index_type, self.index.d, training)
+        if len(vector_ids):
+            index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), vector_ids)
+        return index
+
+    async def _rebuild_storage(self):
+        """Compact and/or switch backend; caller must hold the lock.
+
+        Searches keep using the old index until the new one is swapped in.
+        """
+        if self.index is None:
+            return
+        index_type = resolve_index_type(self.size, self.index_type_override)
+        started = datetime.now(timezone.utc)
+        exact = await self._exact_vectors() if self.index_type == 'ivfpq' else None
+        self.index = await asyncio.to_thread(self._build_storage, index_type, exact)
+        elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+        logging.info(f"FAISS storage rebuilt as {index_type}: {self.index.ntotal} live vectors, "
+                     f"{self.removed_since_compaction} removed, {elapsed:.1f}s")
+        self.index_type = index_type
+        self._set_tombstones(set())
+        self.removed_since_compaction = 0
+        self._mapped = False
+
+    def _needs_storage_rebuild(self) -> bool:
+        if self.index is None:
+            return False
+        if resolve_index_type(self.size, self.index_type_override) != self.index_type:
+            return True
+        total = self.index.ntotal + (0 if self.tombstones else self.removed_since_compaction)
+        return bool(total) and self.removed_since_compaction / total >= INDEX_COMPACTION_RATIO
+
+    def _maybe_rebuild_storage(self):
+        """Schedule compaction / backend switch in the background when due"""
+        if not self._needs_storage_rebuild():
+            return
+        if self._storage_task is None or self._storage_task.done():
+            self._storage_task = asyncio.create_task(self.compact())
+
+    async def add_chunks(self, embeddings: np.ndarray, chunks: List[Dict]):
+        """Add freshly embedded chunks (carrying their ``vector_id``) to the live index"""
+        if len(chunks) == 0:
+            return
+        if len(embeddings) != len(chunks):
+            raise ValueError("Embeddings and chunks must have the same length")
+
+        vector_ids = np.array([c['vector_id'] for c in chunks], dtype='int64')
+        document_ids = list(dict.fromkeys(c['document_id'] for c in chunks))
+        async with self._lock:
+            await self._append(embeddings, vector_ids, chunks)
+            self.version = await record_index_change('add', document_ids)
+        self._maybe_rebuild_storage()
+        self._maybe_snapshot()
+
+    async def _remove_document(self, document_id: str) -> int:
+        """Drop a document's vectors and metadata; caller must hold the lock"""
+        vector_ids = self.document_vector_ids.pop(document_id, [])
+        if not vector_ids:
+            return 0
+
+        removed = 0
+        if self.index is not None:
+            if self.index_type == 'hnsw':
+                self._set_tombstones(self.tombstones | set(vector_ids))
+                removed = len(vector_ids)
+            else:
+                await self._own_storage()
+                removed = self.index.remove_ids(np.array(vector_ids, dtype='int64'))
+        for vector_id in vector_ids:
+            chunk_id = self.id_to_chunk.pop(vector_id, None)
+            self.chunk_metadata.pop(chunk_id, None)
+        await asyncio.to_thread(self.lexical.remove, vector_ids)
+
+        self.removed_since_compaction += removed
+        return removed
+
+    async def remove_document(self, document_id: str) -> int:
+        """Remove every vector belonging to a document, compacting when needed"""
+        async with self._lock:
+            removed = await self._remove_document(document_id)
+            if removed:
+                self.version = await record_index_change('remove', [document_id])
+        if removed:
+            self._maybe_rebuild_storage()
+            self._maybe_snapshot()
+        return removed
+
+    async def compact(self, index_type: Optional[str] = None):
+        """Compact storage and retrain/switch the backend if needed (admin/repair)
+
+        An explicit ``index_type`` pins the backend, so automatic switching
+        leaves it alone until a compact with ``'auto'`` unpins it. The pin is
+        saved with the snapshot.
+        """
+        async with self._lock:
+            if index_type is not None:
+                self.index_type_override = None if index_type == 'auto' else index_type
+            await self._rebuild_storage()
+        if index_type is not None:
+            await self.save_snapshot(force=True)
+
+    async def rebuild(self):
+        """Rebuild the index from MongoDB (startup and admin repair only).
+
+        Chunks are streamed from the cursor in batches of
+        INDEX_REBUILD_BATCH_SIZE and added straight into the index, so peak
+        memory for embeddings stays bounded by the batch size.
+        """
+        async with self._lock:
+            try:
+                self._reset()
+                self.version = await get_index_version()
+                query = {'embedding': {'$ne': None}}
+                total = await db.document_chunks.count_documents(query)
+                if total == 0:
+                    logging.info("No embeddings found in MongoDB, FAISS index empty")
+                    return
+
+                cursor = db.document_chunks.find(query, CHUNK_INDEX_PROJECTION, batch_size=INDEX_REBUILD_BATCH_SIZE)
+                loaded = 0
+                batch = []
+                async for chunk in cursor:
+                    batch.append(chunk)
+                    if len(batch) >= INDEX_REBUILD_BATCH_SIZE:
+                        loaded += await self._load_batch(batch)
+                        batch = []
+                        logging.info(f"Rebuilding FAISS index: {loaded}/{total} chunks loaded")
+                if batch:
+                    loaded += await self._load_batch(batch)
+
+                # Vectors are streamed into flat storage; ANN backends are built from it
+                if resolve_index_type(self.size, self.index_type_override) != self.index_type:
+                    await self._rebuild_storage()
+
+                logging.info(f"FAISS index rebuilt from MongoDB: {self.size} chunks loaded ({self.index_type})")
+            except Exception as e:
+                logging.error(f"Error rebuilding FAISS index: {e}")
+                self._reset()
+        await self.save_snapshot(force=True)
+
+    async def _load_batch(self, chunks: List[Dict]) -> int:
+        """Add one streamed batch of chunks to the index; caller must hold the lock"""
+        # Replayed changes may reference chunks that are already indexed
+        chunks = [c for c in chunks if c.get('vector_id') not in self.id_to_chunk]
+        if not chunks:
+            return 0
+
+        # Chunks written before stable IDs existed get one assigned now
+        migrations = {}
+        legacy = [c for c in chunks if c.get('vector_id') is None]
+        if legacy:
+            new_ids = await allocate_vector_ids(len(legacy))
+            for chunk, vector_id in zip(legacy, new_ids.tolist()):
+                chunk['vector_id'] = vector_id
+                migrations.setdefault(chunk['id'], {})['vector_id'] = vector_id
+
+        # Decode embeddings into a preallocated float32 matrix
+        first = decode_embedding(chunks[0]['embedding'], chunks[0].get('embedding_dtype'))
+        embeddings = np.empty((len(chunks), first.shape[0]), dtype='float32')
+        vector_ids = np.empty(len(chunks), dtype='int64')
+        for row, chunk in enumerate(chunks):
+            stored = chunk.pop('embedding')
+            embeddings[row] = decode_embedding(stored, chunk.get('embedding_dtype'))
+            vector_ids[row] = chunk['vector_id']
+            # Legacy float-list embeddings are rewritten as compact binary
+            if isinstance(stored, list):
+                migrations.setdefault(chunk['id'], {}).update({
+                    'embedding': encode_embedding(embeddings[row]),
+                    'embedding_dtype': EMBEDDING_STORAGE_DTYPE
+                })
+
+        if migrations:
+            await db.document_chunks.bulk_write(
+                [UpdateOne({'id': chunk_id}, {'$set': fields}) for chunk_id, fields in migrations.items()],
+                ordered=False
+            )
+            logging.info(f"Migrated {len(migrations)} legacy chunks (vector IDs / binary embeddings)")
+
+        await self._append(embeddings, vector_ids, chunks)
+        return len(chunks)
+
+    def _maybe_snapshot(self):
+        """Schedule a background snapshot once enough changes have accumulated"""
+        if self.version - self.snapshot_version < INDEX_SNAPSHOT_INTERVAL:
+            return
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_task = asyncio.create_task(self.save_snapshot())
+
+    async def save_snapshot(self, force: bool = False):
+        """Write the index and its chunk-ID mapping to the local snapshot, then prune the change log.
+
+        The index and lexical files are written under the lock, as writers
+        change them in place. The metadata JSON, which holds every chunk's
+        text, is written after the lock is released, from a copy of the
+        mapping; ``_snapshot_lock`` keeps snapshots from interleaving files.
+        """
+        async with self._snapshot_lock:
+            async with self._lock:
+                if self.index is None or (self.version == self.snapshot_version and not force):
+                    return
+                meta = {
+                    'version': self.version,
+                    'index_type': self.index_type,
+                    'index_type_override': self.index_type_override,
+                    'metric': INDEX_METRIC,
+                    'ntotal': self.index.ntotal,
+                    'tombstones': sorted(self.tombstones),
+                    'removed_since_compaction': self.removed_since_compaction,
+                    'chunks': dict(self.chunk_metadata)
+                }
+                try:
+                    await asyncio.to_thread(self._write_storage_files, self.index, self.lexical, meta['version'])
+                except Exception as e:
+                    logging.error(f"Error writing FAISS snapshot: {e}")
+                    return
+            try:
+                await asyncio.to_thread(self._write_meta_file, meta)
+            except Exception as e:
+                logging.error(f"Error writing FAISS snapshot: {e}")
+                return
+            self.snapshot_version = meta['version']
+            logging.info(f"FAISS snapshot written at version {meta['version']}")
+            await db.index_changes.delete_many({'version': {'$lte': meta['version'] - INDEX_CHANGE_RETENTION}})
+
+    @staticmethod
+    def _write_storage_files(index, lexical: LexicalIndex, version: int):
+        INDEX_SNAPSHOT_PATH.parent.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(index, str(INDEX_SNAPSHOT_PATH.with_suffix('.index')) + '.tmp')
+        with open(str(INDEX_SNAPSHOT_PATH.with_suffix('.lexical.npz')) + '.tmp', 'wb') as f:
+            np.savez(f, version=np.int64(version), **lexical.to_arrays())
+
+    @staticmethod
+    def _write_meta_file(meta: Dict):
+        index_path = INDEX_SNAPSHOT_PATH.with_suffix('.index')
+        lexical_path = INDEX_SNAPSHOT_PATH.with_suffix('.lexical.npz')
+        meta_path = INDEX_SNAPSHOT_PATH.with_suffix('.meta.json')
+        with open(str(meta_path) + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        # The metadata file is replaced last, so it only ever describes complete index files
+        os.replace(str(index_path) + '.tmp', index_path)
+        os.replace(str(lexical_path) + '.tmp', lexical_path)
+        os.replace(str(meta_path) + '.tmp', meta_path)
+
+    async def load_snapshot(self) -> bool:
+        """Load the local snapshot and replay newer changes; False if unusable"""
+        index_path = INDEX_SNAPSHOT_PATH.with_suffix('.index')
+        lexical_path = INDEX_SNAPSHOT_PATH.with_suffix('.lexical.npz')
+        meta_path = INDEX_SNAPSHOT_PATH.with_suffix('.meta.json')
+        if not index_path.exists() or not meta_path.exists():
+            return False
+
+        async with self._lock:
+            try:
+                def read():
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    if meta.get('metric', 'l2') != INDEX_METRIC:
+                        raise ValueError(f"snapshot uses the {meta.get('metric', 'l2')} metric, rebuilding for {INDEX_METRIC}")
+                    lexical = None
+                    if lexical_path.exists():
+                        with np.load(lexical_path) as arrays:
+                            # Snapshots written by another version are rebuilt below instead
+                            if int(arrays['version']) == meta['version']:
+                                lexical = LexicalIndex.from_arrays(arrays)
+                    # Vector, graph and inverted-list storage is mapped from the file rather than
+                    # read into memory; it is read-only, so it is copied on the first change
+                    return faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP_IFC), lexical, meta
+
+                index, lexical, meta = await asyncio.to_thread(read)
+                if index.ntotal != meta['ntotal']:
+                    raise ValueError("snapshot index and metadata disagree")
+
+                self._reset()
+                self.index = index
+                self._mapped = True
+                self.index_type = meta.get('index_type', 'flat')
+                self.index_type_override = meta.get('index_type_override')
+                self._set_tombstones(set(meta.get('tombstones', [])))
+                self.removed_since_compaction = meta.get('removed_since_compaction', 0)
+                for chunk_id, chunk_meta in meta['chunks'].items():
+                    self.chunk_metadata[chunk_id] = chunk_meta
+                    self.id_to_chunk[chunk_meta['vector_id']] = chunk_id
+                    self.document_vector_ids.setdefault(chunk_meta['document_id'], []).append(chunk_meta['vector_id'])
+                if lexical is None or lexical.size != self.size:
+                    logging.info("Lexical index not in the snapshot, rebuilding it from the chunk texts")
+                    lexical = await asyncio.to_thread(
+                        LexicalIndex.build, [(m['vector_id'], m['text']) for m in self.chunk_metadata.values()]
+                    )
+                self.lexical = lexical
+                self.version = self.snapshot_version = meta['version']
+
+                replayed = await self._replay_changes()
+                logging.info(f"FAISS index loaded from snapshot v{meta['version']}: "
+                             f"{self.size} chunks ({self.index_type}), {replayed} changes replayed")
+                if self._needs_storage_rebuild():
+                    await self._rebuild_storage()
+                return True
+            except Exception as e:
+                logging.error(f"Error loading FAISS snapshot: {e}")
+                self._reset()
+                return False
+
+    async def _replay_changes(self) -> int:
+        """Apply changes logged after the loaded snapshot; caller must hold the lock"""
+        replayed = 0
+        cursor = db.index_changes.find({'version': {'$gt': self.version}}, {'_id': 0}).sort('version', 1)
+        async for change in cursor:
+            if change['version'] != self.version + 1:
+                raise ValueError(f"index change log has a gap after version {self.version}")
+            for document_id in change['document_ids']:
+                if change['op'] == 'add':
+                    chunks = await db.document_chunks.find(
+                        {'document_id': document_id, 'embedding': {'$ne': None}},
+                        CHUNK_INDEX_PROJECTION
+                    ).to_list(None)
+                    if chunks:
+                        await self._load_batch(chunks)
+                else:
+                    await self._remove_document(document_id)
+            self.version = change['version']
+            replayed += 1
+        return replayed
+
+index_manager = FaissIndexManager()
+
+async def rebuild_faiss_index():
+    """Rebuild FAISS index from MongoDB (startup and admin repair)"""
+    await index_manager.rebuild()
+
+def _evaluate_index_types(vectors: np.ndarray, k: int, num_queries: int) -> List[Dict]:
+    """Build every backend over the vectors and compare it with exact search"""
+    faiss.normalize_L2(vectors)
+    vector_ids = np.arange(len(vectors), dtype='int64')
+    queries = sample_rows(vectors, num_queries)
+    k = min(k, len(vectors))
+
+    exact = build_faiss_index('flat', vectors.shape[1])
+    exact.add_with_ids(vectors, vector_ids)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for index_type in INDEX_TYPES:
+        if index_type in ('ivf', 'ivfpq') and len(vectors) < INDEX_MIN_TRAIN_SIZE:
+            results.append({'index_type': index_type, 'skipped': f"needs at least {INDEX_MIN_TRAIN_SIZE} vectors to train"})
+            continue
+        started = time.perf_counter()
+        training = sample_rows(vectors, INDEX_TRAIN_SAMPLE) if index_type in ('ivf', 'ivfpq') else None
+        index = build_faiss_index(index_type, vectors.shape[1], training)
+        index.add_with_ids(vectors, vector_ids)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        _, found = index.search(queries, k, params=search_params(index_type))
+        query_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found.tolist(), truth.tolist())])
+        results.append({
+            'index_type': index_type,
+            f'recall_at_{k}': round(float(recall), 4),
+            'avg_query_ms': round(query_ms, 3),
+            'build_seconds': round(build_seconds, 2)
+        })
+    return results
+
+async def evaluate_index_types(k: int = 10, num_queries: int = 200) -> Dict[str, Any]:
+    """Report recall@k and latency of each backend on the stored corpus.
+
+    Query vectors are sampled from the corpus itself; exact flat search is the
+    ground truth.
+    """
+    query = {'embedding': {'$ne': None}}
+    total = await db.document_chunks.count_documents(query)
+    if total == 0:
+        return {'total_chunks': 0, 'results': []}
+
+    vectors = None
+    row = 0
+    cursor = db.document_chunks.find(query, {'_id': 0, 'embedding': 1, 'embedding_dtype': 1},
+                                     batch_size=INDEX_REBUILD_BATCH_SIZE)
+    async for chunk in cursor:
+        if row >= total:
+            break
+        embedding = decode_embedding(chunk['embedding'], chunk.get('embedding_dtype'))
+        if vectors is None:
+            vectors = np.empty((total, embedding.shape[0]), dtype='float32')
+        vectors[row] = embedding
+        row += 1
+
+    results = await asyncio.to_thread(_evaluate_index_types, vectors[:row], k, num_queries)
+    return {'total_chunks': row, 'active_index_type': index_manager.index_type, 'results': results}
+
+async def load_faiss_index():
+    """Warm-start from the local snapshot, falling back to a full rebuild"""
+    if not await index_manager.load_snapshot():
+        await rebuild_faiss_index()
 
 # Models
 class Document(BaseModel):
@@ -121,14 +1272,44 @@ class Document(BaseModel):
     upload_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     total_chunks: int = 0
     processed: bool = False
+    job_id: Optional[str] = None  # Ingestion job processing this document
+    content_hash: Optional[str] = None  # SHA-256 of the uploaded file
+
+class DocumentJob(BaseModel):
+    """Background ingestion job for an uploaded document"""
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    document_id: str
+    filename: str
+    status: str = "queued"  # queued, processing, completed, failed
+    stage: str = "queued"  # queued, extracting, embedding, done
+    progress: float = 0.0  # 0-1 across all stages
+    total_chunks: int = 0
+    reused_chunks: int = 0  # Chunks whose embedding was reused from identical stored text
+    error: Optional[str] = None
+    owner: str = Field(default_factory=lambda: INSTANCE_ID)  # Process running the job
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    heartbeat_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # Refreshed by the owner
+
+class BulkUploadResult(BaseModel):
+    """Outcome for one file (or archive member) of a bulk upload"""
+    filename: str
+    status: str  # queued, duplicate, rejected
+    document: Optional[Document] = None
+    error: Optional[str] = None
 
 class DocumentChunk(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     document_id: str
+    document_name: str = ""
     chunk_index: int
+    vector_id: Optional[int] = None  # Stable integer ID in the FAISS IndexIDMap2
     text: str
-    embedding: Optional[List[float]] = None
+    text_hash: Optional[str] = None  # SHA-256 of text, to reuse embeddings of unchanged chunks
+    embedding: Optional[bytes] = None  # Packed with encode_embedding()
+    embedding_dtype: Optional[str] = None  # Storage dtype of the packed embedding
     page_number: Optional[int] = None  # Track page for PDFs
     section_title: Optional[str] = None  # Track section headers
 
@@ -136,6 +1317,7 @@ class QueryRequest(BaseModel):
     query: str
     mode: str = "detailed"  # concise, detailed, research
     document_ids: Optional[List[str]] = None
+    retrieval: str = "dense"  # dense, hybrid (dense + BM25 with rank fusion)
 
 class Citation(BaseModel):
     chunk_id: str
@@ -155,21 +1337,51 @@ class QueryResponse(BaseModel):
     retrieval_details: Optional[Dict[str, Any]] = None
     refused: bool = False
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    mode: str = "detailed"  # concise, detailed, research
+    document_ids: Optional[List[str]] = None
+    retrieval: str = "dense"  # dense, hybrid
+    generate_answers: bool = False  # Retrieval and citations only unless set
+
+class BatchQueryResult(BaseModel):
+    query: str
+    answer: Optional[str] = None  # Only when answers were requested
+    citations: List[Citation]
+    faithfulness_score: Optional[float] = None
+    retrieval_details: Optional[Dict[str, Any]] = None
+    refused: bool = False
+    error: Optional[str] = None
+
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     role: str  # "user" or "assistant"
     content: str
     citations: Optional[List[Citation]] = None
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    seq: Optional[int] = None  # Position in the chat; stored in chat_messages
 
 class ChatSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str = "New Chat"
-    messages: List[ChatMessage] = []
+    messages: List[ChatMessage] = []  # Most recent messages only, see get_chat
+    has_more_messages: bool = False  # Older messages can be paged in
+    message_count: int = 0
     document_ids: Optional[List[str]] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ChatSummary(BaseModel):
+    """Sidebar entry for a chat session"""
+    id: str
+    title: str = "New Chat"
+    updated_at: datetime
+    message_count: int = 0
+
+class ChatSummaryPage(BaseModel):
+    chats: List[ChatSummary]
+    next_cursor: Optional[str] = None  # Pass as ``cursor`` to get the next page
+
 class MessageFeedback(BaseModel):
     """User feedback on AI responses"""
     message_id: str
@@ -186,254 +1398,1094 @@ class SearchQuery(BaseModel):
     result_count: int = 0
 
 # Helper functions
-def extract_text_from_pdf(file_bytes: bytes) -> str:
-    """Extract text, links, and metadata from PDF"""
-    try:
-        pdf_file = io.BytesIO(file_bytes)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        
-        # Extract metadata
-        if pdf_reader.metadata:
-            text += "=== DOCUMENT METADATA ===\n"
-            if pdf_reader.metadata.title:
-                text += f"Title: {pdf_reader.metadata.title}\n"
-            if pdf_reader.metadata.author:
-                text += f"Author: {pdf_reader.metadata.author}\n"
-            if pdf_reader.metadata.subject:
-                text += f"Subject: {pdf_reader.metadata.subject}\n"
-            text += "\n"
-        
-        # Extract text and links from pages
-        for page_num, page in enumerate(pdf_reader.pages, 1):
-            text += f"\n--- Page {page_num} ---\n"
-            
-            # Extract text
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-            
-            # Extract links/annotations
-            if "/Annots" in page:
-                text += "\n[Links on this page]\n"
-                for annot in page["/Annots"]:
-                    try:
-                        obj = annot.get_object()
-                        if obj["/Subtype"] == "/Link":
-                            if "/A" in obj:
-                                link_info = obj["/A"].get_object()
-                                if "/URI" in link_info:
-                                    uri = link_info["/URI"]
-                                    text += f"- Link: {uri}\n"
-                    except:
-                        pass
+class TextPiece(NamedTuple):
+    """Extracted text, in document order, with the metadata chunking needs"""
+    text: str
+    progress: float  # Fraction of the file consumed so far
+    page_number: Optional[int] = None  # Page that starts with this piece
+    headings: Sequence[Tuple[int, str]] = ()  # (offset in text, title)
+
+# Text extraction runs in worker processes so PDF parsing and OCR use every core
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', str(os.cpu_count() or 1)))
+EXTRACTION_TIMEOUT_SECONDS = float(os.environ.get('EXTRACTION_TIMEOUT_SECONDS', '120'))
+EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', '2048'))
+# Extra time a worker gets past its own deadline before the pool is killed
+EXTRACTION_KILL_GRACE_SECONDS = float(os.environ.get('EXTRACTION_KILL_GRACE_SECONDS', '10'))
+EXTRACTION_MAX_PDF_PAGES_PER_TASK = int(os.environ.get('EXTRACTION_MAX_PDF_PAGES_PER_TASK', '16'))
+
+class ExtractionPool:
+    """Runs the extractors in ``extraction`` on a process pool.
+
+    PDFs are split into page ranges that are extracted in parallel. Each task
+    is bounded by EXTRACTION_TIMEOUT_SECONDS and each worker's address space
+    by EXTRACTION_MEMORY_LIMIT_MB. A worker that overruns its deadline by
+    ``kill_grace`` seconds (stuck in native code, where the deadline signal
+    cannot interrupt it) gets the pool killed and replaced. Workers are
+    spawned rather than forked so they import only the extraction module, not
+    the server. That holds as long as the app is served with
+    ``uvicorn server:app``: spawn re-runs a main script in every worker, so
+    this module has no ``__main__`` entry point.
+    """
+
+    def __init__(self, workers: int, timeout: float, memory_limit_mb: int, kill_grace: float):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.kill_grace = kill_grace
+        self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=extraction.init_worker,
+                initargs=(self.memory_limit_mb,)
+            )
+        return self._executor
+
+    def _reset(self, kill: bool = False):
+        """Drop a broken (or wedged) pool; the next task starts a fresh one"""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        if kill:
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool(), extraction.run_with_deadline, self.timeout, func, *args)
+        try:
+            # The worker enforces the deadline itself; this only catches a worker stuck in native code
+            return await asyncio.wait_for(future, self.timeout + self.kill_grace if self.timeout else None)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the future, but the worker is still busy; the stuck
+            # process can't be told apart from its siblings, so the whole pool goes
+            self._reset(kill=True)
+            raise HTTPException(status_code=422, detail="Text extraction timed out")
+        except extraction.ExtractionTimeout:
+            raise HTTPException(status_code=422, detail="Text extraction timed out")
+        except MemoryError:
+            raise HTTPException(status_code=413, detail="File needs too much memory to extract")
+        except BrokenProcessPool:
+            self._reset()
+            raise HTTPException(status_code=500, detail="Extraction worker crashed")
+
+    async def _iter_pdf(self, source: extraction.Source):
+        """Yield PDF metadata, then pages in order, with at most one range in flight per worker
         
-        return text
-    except Exception as e:
-        logging.error(f"Error extracting PDF: {e}")
-        return ""
+        Bookmarks give each page its section headings; PDFs without them fall
+        back to heading-like lines found on the page.
+        """
+        header, page_count, bookmarks = await self._call(extraction.extract_pdf_outline, source)
+        yield TextPiece(header, 0.0)
+        pages_per_task = min(EXTRACTION_MAX_PDF_PAGES_PER_TASK, max(1, -(-page_count // self.workers)))
+        ranges = iter([(start, min(start + pages_per_task, page_count))
+                       for start in range(0, page_count, pages_per_task)])
+        in_flight = deque()
+        try:
+            while True:
+                for start, end in ranges:
+                    task = asyncio.ensure_future(
+                        self._call(extraction.extract_pdf_pages, source, start, end, not bookmarks)
+                    )
+                    in_flight.append((start, end, task))
+                    if len(in_flight) >= self.workers:
+                        break
+                if not in_flight:
+                    break
+                start, end, task = in_flight.popleft()
+                for page_index, (text, headings) in enumerate(await task, start):
+                    if bookmarks:
+                        headings = [(0, title) for title in bookmarks.get(page_index, [])]
+                    yield TextPiece(text, end / page_count, page_index + 1, headings)
+        finally:
+            for _, _, task in in_flight:
+                task.cancel()
+
+    async def iter_text(self, source: extraction.Source, file_type: str):
+        """Yield the TextPieces of a PDF, Word document or image"""
+        try:
+            if file_type == 'pdf':
+                async for piece in self._iter_pdf(source):
+                    yield piece
+            elif file_type in ['docx', 'doc']:
+                text, headings = await self._call(extraction.extract_text_from_docx, source)
+                yield TextPiece(text, 1.0, headings=headings)
+            else:
+                yield TextPiece(await self._call(extraction.extract_text_from_image, source, self.timeout), 1.0)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logging.error(f"Error extracting {file_type.upper()}: {e}")
+            raise HTTPException(status_code=400, detail="No text could be extracted from file")
+
+    def shutdown(self):
+        self._reset()
 
-def extract_text_from_docx(file_bytes: bytes) -> str:
-    """Extract text, links, tables, and images from Word document"""
+extraction_pool = ExtractionPool(EXTRACTION_WORKERS, EXTRACTION_TIMEOUT_SECONDS, EXTRACTION_MEMORY_LIMIT_MB,
+                                 EXTRACTION_KILL_GRACE_SECONDS)
+
+# Uploads are streamed to spool files on disk instead of being held in memory
+UPLOAD_SPOOL_DIR = Path(os.environ.get('UPLOAD_SPOOL_DIR', str(ROOT_DIR / 'upload_spool')))
+# Each process spools into its own subdirectory, so processes sharing the spool never clear each other's files
+INSTANCE_SPOOL_DIR = UPLOAD_SPOOL_DIR / INSTANCE_ID
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+MAX_UPLOAD_SIZE_MB = int(os.environ.get('MAX_UPLOAD_SIZE_MB', '200'))
+BULK_MAX_ARCHIVE_SIZE_MB = int(os.environ.get('BULK_MAX_ARCHIVE_SIZE_MB', '2048'))
+# Total size the members of one zip archive may unpack to
+BULK_MAX_UNPACKED_SIZE_MB = int(os.environ.get('BULK_MAX_UNPACKED_SIZE_MB', '4096'))
+
+async def spool_upload(file: UploadFile, max_size_mb: int = MAX_UPLOAD_SIZE_MB) -> Tuple[Path, str]:
+    """Copy an upload to a spool file, UPLOAD_CHUNK_SIZE bytes at a time
+    
+    Returns the spool path and the SHA-256 of the contents. Raises 413 once
+    the upload is larger than ``max_size_mb``. The caller owns the returned
+    file and must delete it.
+    """
+    limit = max_size_mb * 1024 * 1024
+    too_large = HTTPException(status_code=413, detail=f"File is larger than {max_size_mb} MB")
+    if file.size is not None and file.size > limit:
+        raise too_large
+    
+    INSTANCE_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(dir=INSTANCE_SPOOL_DIR, suffix=Path(file.filename).suffix)
+    path = Path(name)
+    digest = hashlib.sha256()
     try:
-        doc_file = io.BytesIO(file_bytes)
-        doc = docx.Document(doc_file)
-        text = ""
-        
-        # Extract from paragraphs (preserves links)
-        for para in doc.paragraphs:
-            if para.text.strip():
-                text += para.text + "\n"
+        size = 0
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise too_large
+                digest.update(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, digest.hexdigest()
+
+def touch_upload_spool():
+    """Mark this process's spool directory as in use; called on every job heartbeat"""
+    INSTANCE_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    os.utime(INSTANCE_SPOOL_DIR)
+
+def clear_upload_spool():
+    """Delete the spool directories of processes that are gone; their jobs cannot resume
+
+    A directory not touched within JOB_LEASE_SECONDS belongs to a process
+    whose heartbeat stopped. Other live processes sharing the spool keep
+    theirs. Loose files are from before spools were kept per process.
+    """
+    if not UPLOAD_SPOOL_DIR.is_dir():
+        return
+    cutoff = time.time() - JOB_LEASE_SECONDS
+    for path in UPLOAD_SPOOL_DIR.iterdir():
+        try:
+            if path == INSTANCE_SPOOL_DIR or path.stat().st_mtime >= cutoff:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+        except OSError:
+            continue  # Removed by another process meanwhile
+
+class SpooledFile(NamedTuple):
+    """An upload (or archive member) on disk, or the reason it was rejected"""
+    filename: str
+    path: Optional[Path]
+    content_hash: Optional[str]
+    error: Optional[str] = None
+
+def spool_archive(zip_path: Path, max_files: int) -> List[SpooledFile]:
+    """Copy the members of a zip archive to spool files, each bounded by MAX_UPLOAD_SIZE_MB
+
+    At most ``max_files`` members are spooled, together at most
+    BULK_MAX_UNPACKED_SIZE_MB. Both limits are enforced before and while
+    writing each member, so an archive that unpacks to far more never fills
+    the disk; members past either limit are rejected unread.
+    """
+    limit = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    total_limit = BULK_MAX_UNPACKED_SIZE_MB * 1024 * 1024
+    too_many = f"More than {BULK_MAX_FILES} files in one upload"
+    too_large = f"Archive unpacks to more than {BULK_MAX_UNPACKED_SIZE_MB} MB"
+    spooled = []
+    files = 0
+    total = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            filename = Path(info.filename).name
+            if info.is_dir() or info.filename.startswith('__MACOSX/') or filename.startswith('.'):
+                continue
+            if filename.split('.')[-1].lower() not in SUPPORTED_FILE_TYPES:
+                spooled.append(SpooledFile(filename, None, None, "Unsupported file type"))
+                continue
+            if files >= max_files or total >= total_limit:
+                spooled.append(SpooledFile(filename, None, None, too_many if files >= max_files else too_large))
+                continue
             
-            # Extract hyperlinks from paragraph runs
-            for run in para.runs:
-                if run.element.rPr is not None:
-                    rPr = run.element.rPr
-                    if rPr.rStyle is not None:
-                        # Check for hyperlinks
-                        for child in run.element.iter():
-                            if 'hyperlink' in child.tag.lower():
-                                href = child.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
-                                if href:
-                                    text += f"[Link: {run.text}]\n"
-        
-        # Extract tables
-        if doc.tables:
-            text += "\n=== TABLES ===\n"
-            for table_idx, table in enumerate(doc.tables, 1):
-                text += f"\nTable {table_idx}:\n"
-                for row in table.rows:
-                    row_text = " | ".join(cell.text.strip() for cell in row.cells)
-                    text += row_text + "\n"
-        
-        # Extract image information
-        image_count = 0
-        for rel in doc.part.rels.values():
-            if "image" in rel.target_ref:
-                image_count += 1
-        
-        if image_count > 0:
-            text += f"\n[Document contains {image_count} images]\n"
-        
-        return text
-    except Exception as e:
-        logging.error(f"Error extracting DOCX: {e}")
-        return ""
+            fd, name = tempfile.mkstemp(dir=INSTANCE_SPOOL_DIR, suffix=Path(filename).suffix)
+            path = Path(name)
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with archive.open(info) as member, os.fdopen(fd, 'wb') as spool:
+                    while True:
+                        chunk = member.read(UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        # Checked while reading: the sizes in the archive directory can lie
+                        size += len(chunk)
+                        if size > limit:
+                            raise ValueError(f"File is larger than {MAX_UPLOAD_SIZE_MB} MB")
+                        if total + size > total_limit:
+                            total = total_limit  # The rest of the archive is rejected unread
+                            raise ValueError(too_large)
+                        digest.update(chunk)
+                        spool.write(chunk)
+            except Exception as e:
+                path.unlink(missing_ok=True)
+                spooled.append(SpooledFile(filename, None, None, str(e)))
+                continue
+            total += size
+            files += 1
+            spooled.append(SpooledFile(filename, path, digest.hexdigest()))
+    return spooled
 
-def extract_text_from_image(file_bytes: bytes) -> str:
-    """Extract text and image info using OCR"""
-    try:
-        image = Image.open(io.BytesIO(file_bytes))
-        
-        # Get image metadata
-        text = f"[Image: {image.format}, {image.width}x{image.height}px]\n\n"
-        
-        # Extract text via OCR
-        extracted_text = pytesseract.image_to_string(image)
-        if extracted_text.strip():
-            text += "=== OCR TEXT ===\n"
-            text += extracted_text
-        else:
-            text += "[No text detected in image]"
-        
-        return text
-    except Exception as e:
-        logging.error(f"Error extracting text from image: {e}")
-        return ""
+# Chunking and batched storage for the ingestion pipeline
+CHUNK_SIZE = 1000  # Optimized size
+CHUNK_OVERLAP = 150
+INGESTION_BATCH_SIZE = int(os.environ.get('INGESTION_BATCH_SIZE', '256'))
+
+MARKDOWN_HEADING = re.compile(r'^#{1,6}[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+
+async def iter_plain_text(path: Path, markdown: bool = False):
+    """Yield the text of a .txt/.md file block by block, then the links found in it"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    size = max(1, path.stat().st_size)
+    done = 0
+    pending = ""
+    urls = set()
+    with open(path, 'rb') as f:
+        while True:
+            block = await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE)
+            done += len(block)
+            text = pending + decoder.decode(block, final=not block)
+            # Hold back a trailing partial line (or word) so headings and URLs are not split between blocks
+            cut = (text.rfind('\n') + 1 or text.rfind(' ') + 1) if block else len(text)
+            text, pending = text[:cut], text[cut:]
+            # Extract URLs from text files
+            urls.update(re.findall(r'https?://[^\s\n]+', text))
+            headings = [(m.start(), m.group(1)) for m in MARKDOWN_HEADING.finditer(text)] if markdown else []
+            if text:
+                yield TextPiece(text, done / size, headings=headings)
+            if not block:
+                break
+    if urls:
+        links = "\n\n=== EXTRACTED LINKS ===\n"
+        links += "".join(f"- {url}\n" for url in set(urls))  # Remove duplicates
+        yield TextPiece(links, 1.0)
+
+class OffsetIndex:
+    """Values that take effect at increasing text offsets, looked up by bisect"""
 
-async def process_document(file: UploadFile, document_id: str):
-    """Process uploaded document: extract text, chunk, embed"""
-    global faiss_index, chunk_metadata, metadata_index_map
+    def __init__(self):
+        self.offsets = []
+        self.values = []
+
+    def add(self, offset: int, value):
+        self.offsets.append(offset)
+        self.values.append(value)
+
+    def lookup(self, offset: int):
+        """Value in effect at ``offset``, or None before the first one"""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        return self.values[i] if i >= 0 else None
+
+    def prune(self, offset: int):
+        """Forget entries that no lookup at or after ``offset`` can return"""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        if i > 0:
+            del self.offsets[:i]
+            del self.values[:i]
+
+async def iter_chunks(pieces, text_splitter: RecursiveCharacterTextSplitter):
+    """Split a stream of TextPieces into ``(chunk, progress, page_number, section_title)``.
+
+    Only the unfinished tail of the text is kept between pieces: every split
+    emits all but its last chunk, which is carried into the next split.
+    Chunk start offsets are tracked as the text streams by, and page and
+    section are those in effect at each chunk's start.
+    """
+    buffer = ""
+    buffer_start = 0  # Offset of buffer[0] in the whole text
+    pages = OffsetIndex()
+    sections = OffsetIndex()
+    progress = 0.0
+
+    def split(final: bool):
+        nonlocal buffer, buffer_start
+        located = []
+        position = 0
+        for chunk in text_splitter.split_text(buffer):
+            found = buffer.find(chunk, position)
+            position = found if found >= 0 else position
+            located.append((chunk, buffer_start + position))
+            position += 1
+        if not final and located:
+            # Carry the raw tail, trailing whitespace included, so separators survive
+            tail_start = located.pop()[1]
+            buffer = buffer[tail_start - buffer_start:]
+            buffer_start = tail_start
+        results = [(chunk, progress, pages.lookup(start), sections.lookup(start)) for chunk, start in located]
+        pages.prune(buffer_start)
+        sections.prune(buffer_start)
+        return results
+
+    async for piece in pieces:
+        piece_start = buffer_start + len(buffer)
+        if piece.page_number is not None:
+            pages.add(piece_start, piece.page_number)
+        for offset, title in piece.headings:
+            sections.add(piece_start + offset, title)
+        buffer += piece.text
+        progress = piece.progress
+        if len(buffer) >= 2 * CHUNK_SIZE:
+            for result in split(final=False):
+                yield result
+    for result in split(final=True):
+        yield result
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+async def embed_chunks(chunks: List[str], text_hashes: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Embeddings for a batch of chunk texts, and a mask of the chunks whose embedding was reused
     
-    file_bytes = await file.read()
-    file_type = file.filename.split('.')[-1].lower()
+    Chunks whose text is already stored (same text hash, e.g. unchanged
+    pages of a revised document) reuse the stored embedding; only new texts
+    are encoded, each once.
+    """
+    known = {}
+    # One stored embedding per hash, however many chunks share that text
+    async for stored in db.document_chunks.aggregate([
+        {'$match': {'text_hash': {'$in': list(set(text_hashes))}, 'embedding': {'$ne': None}}},
+        {
+            '$group': {
+                '_id': '$text_hash',
+                'embedding': {'$first': '$embedding'},
+                'embedding_dtype': {'$first': '$embedding_dtype'}
+            }
+        }
+    ]):
+        known[stored['_id']] = decode_embedding(stored['embedding'], stored.get('embedding_dtype'))
+    
+    missing = {}
+    for chunk, text_hash in zip(chunks, text_hashes):
+        if text_hash not in known:
+            missing.setdefault(text_hash, chunk)
+    if missing:
+        encoded = await embedding_service.encode_documents(list(missing.values()), batch_size=32)
+        known.update(zip(missing.keys(), encoded))
+    
+    embeddings = np.vstack([known[text_hash] for text_hash in text_hashes]).astype('float32')
+    reused = np.array([text_hash not in missing for text_hash in text_hashes], dtype=bool)
+    return embeddings, reused
+
+class PendingChunk(NamedTuple):
+    """A chunk waiting to be embedded and stored"""
+    document_id: str
+    filename: str
+    chunk_index: int
+    text: str
+    page_number: Optional[int]
+    section_title: Optional[str]
+
+async def write_chunk_batch(batch: List[PendingChunk], text_hashes: List[str], embeddings: np.ndarray,
+                            ordered: bool = True):
+    """Store one batch of embedded chunks (from any number of documents) and index them together"""
+    # Reserve stable FAISS IDs for the new chunks
+    vector_ids = await allocate_vector_ids(len(batch))
+    
+    chunk_docs = []
+    for chunk, text_hash, embedding, vector_id in zip(batch, text_hashes, embeddings, vector_ids.tolist()):
+        chunk_doc = DocumentChunk(
+            document_id=chunk.document_id,
+            document_name=chunk.filename,
+            chunk_index=chunk.chunk_index,
+            vector_id=vector_id,
+            text=chunk.text,
+            text_hash=text_hash,
+            embedding=encode_embedding(embedding),
+            embedding_dtype=EMBEDDING_STORAGE_DTYPE,
+            page_number=chunk.page_number,
+            section_title=chunk.section_title
+        )
+        chunk_dict = chunk_doc.model_dump()
+        chunk_dict['upload_date'] = datetime.now(timezone.utc).isoformat()
+        chunk_docs.append(chunk_dict)
+    
+    await db.document_chunks.insert_many(chunk_docs, ordered=ordered)
+    
+    # Append the new vectors to the live index instead of rebuilding it
+    await index_manager.add_chunks(embeddings, chunk_docs)
+
+async def store_chunk_batch(batch: List[PendingChunk]) -> int:
+    """Embed, store and index one batch of chunks; returns how many embeddings were reused"""
+    text_hashes = [hash_text(chunk.text) for chunk in batch]
+    embeddings, reused = await embed_chunks([chunk.text for chunk in batch], text_hashes)
+    await write_chunk_batch(batch, text_hashes, embeddings)
+    return int(reused.sum())
+
+def iter_document_chunks(file_path: Path, filename: str):
+    """Extract a spooled upload and yield ``(chunk, progress, page_number, section_title)``"""
+    file_type = filename.split('.')[-1].lower()
     
     # Extract text based on file type
-    text = ""
-    if file_type == 'pdf':
-        text = extract_text_from_pdf(file_bytes)
-    elif file_type in ['docx', 'doc']:
-        text = extract_text_from_docx(file_bytes)
-    elif file_type in ['txt', 'md']:
-        raw_text = file_bytes.decode('utf-8')
-        # Extract URLs from text files
-        import re
-        urls = re.findall(r'https?://[^\s\n]+', raw_text)
-        text = raw_text
-        if urls:
-            text += "\n\n=== EXTRACTED LINKS ===\n"
-            for url in set(urls):  # Remove duplicates
-                text += f"- {url}\n"
-    elif file_type in ['png', 'jpg', 'jpeg', 'bmp', 'gif']:
-        text = extract_text_from_image(file_bytes)
+    if file_type in ['txt', 'md']:
+        pieces = iter_plain_text(file_path, markdown=file_type == 'md')
+    elif file_type in ['pdf', 'docx', 'doc', 'png', 'jpg', 'jpeg', 'bmp', 'gif']:
+        pieces = extraction_pool.iter_text(str(file_path), file_type)
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type")
     
-    if not text.strip():
-        raise HTTPException(status_code=400, detail="No text could be extracted from file")
-    
-    # Chunk the text
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,  # Optimized size
-        chunk_overlap=150,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
-    chunks = text_splitter.split_text(text)
+    return iter_chunks(pieces, text_splitter)
+
+async def process_document(file_path: Path, filename: str, document_id: str, report=None) -> Tuple[int, int]:
+    """Process uploaded document: extract text, chunk, embed; returns (chunks, reused embeddings)
     
-    # Generate embeddings in batch
-    embeddings = embedding_model.encode(chunks, convert_to_numpy=True, batch_size=32)
-    embeddings = embeddings.astype('float32')
+    Pages are chunked as they are extracted, and every INGESTION_BATCH_SIZE
+    chunks are embedded, stored and indexed before more text is read, so
+    memory follows the batch size rather than the document size.
+    ``report(stage, progress)`` is awaited as the pipeline moves between stages.
+    """
+    report = report or _ignore_progress
+    chunks = iter_document_chunks(file_path, filename)
     
-    # Batch insert chunks into database
-    chunk_docs = []
-    for idx, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-        # Extract page number if present in chunk
-        page_number = None
-        if "--- Page " in chunk:
-            import re
-            page_match = re.search(r'--- Page (\d+) ---', chunk)
-            if page_match:
-                page_number = int(page_match.group(1))
-        
-        chunk_doc = DocumentChunk(
-            document_id=document_id,
-            chunk_index=idx,
-            text=chunk,
-            embedding=embedding.tolist(),
-            page_number=page_number,
-            section_title=None
-        )
-        chunk_dict = chunk_doc.model_dump()
-        chunk_dict['upload_date'] = datetime.now(timezone.utc).isoformat()
-        chunk_docs.append(chunk_dict)
+    await report('extracting', 0.05)
+    total_chunks = 0
+    reused = 0
+    batch = []
+    async for chunk, progress, page_number, section_title in chunks:
+        batch.append(PendingChunk(document_id, filename, total_chunks + len(batch), chunk, page_number, section_title))
+        if len(batch) < INGESTION_BATCH_SIZE:
+            continue
+        await report('embedding', 0.05 + 0.9 * progress)
+        reused += await store_chunk_batch(batch)
+        total_chunks += len(batch)
+        batch = []
+    if batch:
+        await report('embedding', 0.95)
+        reused += await store_chunk_batch(batch)
+        total_chunks += len(batch)
     
-    # Batch insert all chunks
-    if chunk_docs:
-        await db.document_chunks.insert_many(chunk_docs)
+    if total_chunks == 0:
+        raise HTTPException(status_code=400, detail="No text could be extracted from file")
+    if reused:
+        logging.info(f"Reused stored embeddings for {reused} of {total_chunks} chunks of {filename}")
     
     # Update document
     await db.documents.update_one(
         {'id': document_id},
-        {'$set': {'total_chunks': len(chunks), 'processed': True}}
+        {'$set': {'total_chunks': total_chunks, 'processed': True}}
     )
     
-    # Rebuild FAISS index to ensure consistency
-    await rebuild_faiss_index()
+    return total_chunks, reused
+
+# Query caches: normalized query text -> embedding, and search key -> results
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', '3600'))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '4096'))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get('RETRIEVAL_CACHE_SIZE', '1024'))
+
+class CountingCache:
+    """Bounded LRU cache with a TTL and hit/miss counters.
+
+    When built with ``versioned=True`` the cache is tied to the index version:
+    it is cleared the first time it is used after the index changes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, versioned: bool = False):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versioned = versioned
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        if self._versioned and self._version != index_manager.version:
+            self._cache.clear()
+            self._version = index_manager.version
+
+    def get(self, key):
+        self._check_version()
+        value = self._cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._check_version()
+        self._cache[key] = value
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'maxsize': self._cache.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+query_embedding_cache = CountingCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_CACHE_TTL)
+retrieval_cache = CountingCache(RETRIEVAL_CACHE_SIZE, QUERY_CACHE_TTL, versioned=True)
+
+def normalize_query(query: str) -> str:
+    """Cache key for query text: case- and whitespace-insensitive"""
+    return ' '.join(query.lower().split())
+
+async def embed_queries_cached(queries: List[str]) -> np.ndarray:
+    """Query embeddings as an (n, d) array; the uncached ones are encoded in one call"""
+    embeddings = {}
+    missing = {}
+    for query in queries:
+        key = normalize_query(query)
+        if key in embeddings or key in missing:
+            continue
+        embedding = query_embedding_cache.get(key)
+        if embedding is None:
+            missing[key] = query
+        else:
+            embeddings[key] = embedding
+    if len(missing) == 1:
+        # A single query joins the micro-batch shared with concurrent requests
+        encoded = [await embedding_service.embed_query(next(iter(missing.values())))]
+    else:
+        encoded = await embedding_service.embed_queries(list(missing.values())) if missing else []
+    for key, embedding in zip(missing, encoded):
+        embeddings[key] = embedding.reshape(1, -1)
+        query_embedding_cache.set(key, embeddings[key])
+    return np.vstack([embeddings[normalize_query(query)] for query in queries])
+
+async def _ignore_progress(stage: str, progress: float):
+    pass
+
+# Background ingestion
+INGESTION_CONCURRENCY = int(os.environ.get('INGESTION_CONCURRENCY', '2'))
+INGESTION_QUEUE_SIZE = int(os.environ.get('INGESTION_QUEUE_SIZE', '100'))
+# Every process refreshes the heartbeat of the jobs it owns; a queued or running job whose
+# heartbeat is older than JOB_LEASE_SECONDS belongs to a process that is gone
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '30'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '120'))
+SUPPORTED_FILE_TYPES = ('pdf', 'docx', 'doc', 'txt', 'md', 'png', 'jpg', 'jpeg', 'bmp', 'gif')
+
+# Bulk ingestion: many documents share one extraction -> embedding -> storage pipeline
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', '2000'))
+BULK_EXTRACTION_CONCURRENCY = int(os.environ.get('BULK_EXTRACTION_CONCURRENCY', str(EXTRACTION_WORKERS)))
+BULK_EMBED_BATCH_SIZE = int(os.environ.get('BULK_EMBED_BATCH_SIZE', '512'))
+BULK_BATCH_WAIT_SECONDS = float(os.environ.get('BULK_BATCH_WAIT_SECONDS', '0.5'))
+
+class BulkIngestion:
+    """Ingests a batch of spooled uploads as three concurrent stages.
+
+    Documents are extracted and chunked several at a time on the extraction
+    pool; their chunks are pooled into BULK_EMBED_BATCH_SIZE batches that
+    span documents; each embedded batch is written with one unordered
+    insert_many and one index update. Bounded queues between the stages
+    keep all three busy without letting extraction run ahead of storage.
+    """
+
+    def __init__(self, entries: List[Tuple[DocumentJob, Path]], update_job):
+        self.entries = entries
+        self.update_job = update_job
+        self._chunks = asyncio.Queue(maxsize=2 * BULK_EMBED_BATCH_SIZE)
+        self._embedded = asyncio.Queue(maxsize=2)
+        self._jobs = {job.document_id: job for job, _ in entries}
+        self._unstored = {}  # document_id -> chunks queued but not yet stored
+        self._totals = {}  # document_id -> chunk count, once extraction is done
+        self._reused = Counter()  # document_id -> chunks whose stored embedding was reused
+        self._failed = {}  # document_id -> error
+        self._completed = set()
+
+    async def run(self):
+        stages = [
+            asyncio.create_task(self._extract_all()),
+            asyncio.create_task(self._embed()),
+            asyncio.create_task(self._write())
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except Exception as e:
+            for document_id in self._jobs.keys() - self._completed:
+                self._fail(document_id, str(e))
+        finally:
+            for stage in stages:
+                stage.cancel()
+        for document_id, error in self._failed.items():
+            await discard_document(document_id)
+            await self.update_job(self._jobs[document_id].id, status='failed', error=error)
+
+    def _fail(self, document_id: str, error: str):
+        if document_id not in self._failed:
+            logging.error(f"Error processing document {self._jobs[document_id].filename}: {error}")
+            self._failed[document_id] = error
+
+    async def _complete_if_stored(self, document_id: str):
+        """Mark a document processed once it is fully extracted and every chunk is stored"""
+        if document_id in self._completed:
+            return
+        total = self._totals.get(document_id)
+        if total is None or self._unstored.get(document_id) or document_id in self._failed:
+            return
+        job = self._jobs[document_id]
+        self._completed.add(document_id)
+        await db.documents.update_one({'id': document_id}, {'$set': {'total_chunks': total, 'processed': True}})
+        await self.update_job(job.id, status='completed', stage='done', progress=1.0, total_chunks=total,
+                              reused_chunks=self._reused[document_id])
+        logging.info(f"Processed document {job.filename}: {total} chunks")
+
+    async def _extract_all(self):
+        semaphore = asyncio.Semaphore(BULK_EXTRACTION_CONCURRENCY)
+
+        async def extract(job: DocumentJob, file_path: Path):
+            async with semaphore:
+                await self._extract(job, file_path)
+
+        await asyncio.gather(*[extract(job, file_path) for job, file_path in self.entries])
+        await self._chunks.put(None)
+
+    async def _extract(self, job: DocumentJob, file_path: Path):
+        await self.update_job(job.id, status='processing', stage='extracting', progress=0.05)
+        total = 0
+        try:
+            async for chunk, progress, page_number, section_title in iter_document_chunks(file_path, job.filename):
+                if job.document_id in self._failed:
+                    return
+                self._unstored[job.document_id] = self._unstored.get(job.document_id, 0) + 1
+                await self._chunks.put(PendingChunk(job.document_id, job.filename, total, chunk,
+                                                    page_number, section_title))
+                total += 1
+        except Exception as e:
+            self._fail(job.document_id, e.detail if isinstance(e, HTTPException) else str(e))
+            return
+        if total == 0:
+            self._fail(job.document_id, "No text could be extracted from file")
+            return
+        await self.update_job(job.id, stage='embedding', progress=0.5)
+        self._totals[job.document_id] = total
+        await self._complete_if_stored(job.document_id)
+
+    async def _next_batch(self) -> Tuple[List[PendingChunk], bool]:
+        """Up to BULK_EMBED_BATCH_SIZE chunks, waiting briefly for more; and whether input is exhausted"""
+        batch = []
+        while len(batch) < BULK_EMBED_BATCH_SIZE:
+            try:
+                chunk = await asyncio.wait_for(self._chunks.get(), BULK_BATCH_WAIT_SECONDS if batch else None)
+            except asyncio.TimeoutError:
+                return batch, False
+            if chunk is None:
+                return batch, True
+            if chunk.document_id not in self._failed:
+                batch.append(chunk)
+        return batch, False
+
+    async def _embed(self):
+        done = False
+        while not done:
+            batch, done = await self._next_batch()
+            if not batch:
+                continue
+            text_hashes = [hash_text(chunk.text) for chunk in batch]
+            try:
+                embeddings, reused = await embed_chunks([chunk.text for chunk in batch], text_hashes)
+            except Exception as e:
+                for document_id in {chunk.document_id for chunk in batch}:
+                    self._fail(document_id, f"Embedding failed: {e}")
+                continue
+            self._reused.update(chunk.document_id for chunk, was_reused in zip(batch, reused) if was_reused)
+            await self._embedded.put((batch, text_hashes, embeddings))
+        await self._embedded.put(None)
+
+    async def _write(self):
+        while True:
+            item = await self._embedded.get()
+            if item is None:
+                return
+            batch, text_hashes, embeddings = item
+            keep = [i for i, chunk in enumerate(batch) if chunk.document_id not in self._failed]
+            document_ids = {chunk.document_id for chunk in batch}
+            if keep:
+                try:
+                    await write_chunk_batch([batch[i] for i in keep], [text_hashes[i] for i in keep],
+                                            embeddings[keep], ordered=False)
+                except Exception as e:
+                    for document_id in document_ids:
+                        self._fail(document_id, f"Storing chunks failed: {e}")
+            for chunk in batch:
+                self._unstored[chunk.document_id] -= 1
+            for document_id in document_ids:
+                await self._complete_if_stored(document_id)
+
+class IngestionQueue:
+    """Bounded queue of uploaded documents processed by a fixed pool of workers.
+
+    Each entry is a single document or a bulk batch, which runs through
+    BulkIngestion. Job state and per-stage progress are kept in the
+    ``document_jobs`` collection so clients can poll for completion. Jobs
+    are owned by the process that queued them: it keeps their heartbeat
+    fresh, and fails the jobs of processes whose heartbeat has lapsed.
+    """
+
+    def __init__(self, concurrency: int, maxsize: int):
+        self.concurrency = concurrency
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._workers = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._workers.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, job: DocumentJob, file_path: Path):
+        """Queue a job for a spooled upload; raises asyncio.QueueFull when the backlog is full
+        
+        The queue takes ownership of the spool file and deletes it once the job ends.
+        """
+        self._queue.put_nowait([(job, file_path)])
+
+    def submit_batch(self, entries: List[Tuple[DocumentJob, Path]]):
+        """Queue a bulk batch of jobs as one entry; same ownership rules as submit()"""
+        self._queue.put_nowait(entries)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def _update_job(self, job_id: str, **fields):
+        fields['updated_at'] = datetime.now(timezone.utc).isoformat()
+        await db.document_jobs.update_one({'id': job_id}, {'$set': fields})
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await db.document_jobs.update_many(
+                    {'owner': INSTANCE_ID, 'status': {'$in': ['queued', 'processing']}},
+                    {'$set': {'heartbeat_at': datetime.now(timezone.utc).isoformat()}}
+                )
+                await fail_interrupted_jobs()
+                await asyncio.to_thread(touch_upload_spool)
+                await asyncio.to_thread(clear_upload_spool)
+            except Exception as e:
+                logging.error(f"Ingestion job heartbeat error: {e}")
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+
+    async def _worker(self):
+        while True:
+            entries = await self._queue.get()
+            try:
+                if len(entries) == 1:
+                    await self._run(*entries[0])
+                else:
+                    await BulkIngestion(entries, self._update_job).run()
+            except Exception as e:
+                logging.error(f"Ingestion worker error for jobs {[job.id for job, _ in entries]}: {e}")
+            finally:
+                for _, file_path in entries:
+                    file_path.unlink(missing_ok=True)
+                self._queue.task_done()
+
+    async def _run(self, job: DocumentJob, file_path: Path):
+        async def report(stage: str, progress: float):
+            await self._update_job(job.id, status='processing', stage=stage, progress=progress)
+
+        try:
+            chunks_count, reused = await process_document(file_path, job.filename, job.document_id, report)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logging.error(f"Error processing document {job.filename}: {detail}")
+            await discard_document(job.document_id)
+            await self._update_job(job.id, status='failed', error=detail)
+            return
+
+        logging.info(f"Processed document {job.filename}: {chunks_count} chunks")
+        await self._update_job(job.id, status='completed', stage='done', progress=1.0, total_chunks=chunks_count,
+                               reused_chunks=reused)
+
+ingestion_queue = IngestionQueue(INGESTION_CONCURRENCY, INGESTION_QUEUE_SIZE)
+
+async def discard_document(document_id: str):
+    """Remove a document, its chunks and its vectors"""
+    await db.documents.delete_one({'id': document_id})
+    await db.document_chunks.delete_many({'document_id': document_id})
+    await index_manager.remove_document(document_id)
+
+async def fail_interrupted_jobs():
+    """Fail the queued or running jobs whose owning process is gone; they cannot resume
+
+    A job is orphaned once its heartbeat is older than JOB_LEASE_SECONDS
+    (jobs from before heartbeats existed have none). Jobs of other live
+    processes sharing the database are left alone.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=JOB_LEASE_SECONDS)).isoformat()
+    active = ['queued', 'processing']
+    orphaned = db.document_jobs.find({
+        'status': {'$in': active},
+        'owner': {'$ne': INSTANCE_ID},
+        '$or': [{'heartbeat_at': {'$lt': cutoff}}, {'heartbeat_at': {'$exists': False}}]
+    }, {'_id': 0, 'id': 1, 'document_id': 1})
+    async for job in orphaned:
+        # Claim the job first, so concurrent processes don't both discard it
+        claimed = await db.document_jobs.update_one(
+            {'id': job['id'], 'status': {'$in': active}},
+            {'$set': {
+                'status': 'failed',
+                'error': 'Interrupted by a server restart, please upload again',
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        if claimed.modified_count:
+            await discard_document(job['document_id'])
+
+# Chunks less similar to the query than this (cosine, -1..1) are not retrieved
+RETRIEVAL_MIN_SIMILARITY = float(os.environ.get('RETRIEVAL_MIN_SIMILARITY', '0.2'))
+# Optional cross-encoder reranking, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (empty = off)
+RERANK_MODEL = os.environ.get('RERANK_MODEL', '')
+RERANK_CANDIDATE_FACTOR = int(os.environ.get('RERANK_CANDIDATE_FACTOR', '3'))
+RERANK_BATCH_SIZE = int(os.environ.get('RERANK_BATCH_SIZE', '16'))
+RERANK_BUDGET_MS = float(os.environ.get('RERANK_BUDGET_MS', '150'))
+
+class Reranker:
+    """Reorders retrieval candidates with a cross-encoder on CPU.
+
+    Candidates are scored in batches on a dedicated thread. Once
+    RERANK_BUDGET_MS has been spent no further batch is started, and the
+    candidates left unscored keep their retrieval order behind the scored
+    ones. The model is loaded on first use; if it cannot be loaded,
+    reranking is switched off.
+    """
+
+    def __init__(self, model_name: str, batch_size: int, budget_ms: float):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self._model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rerank')
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.model_name)
+
+    def candidates(self, top_k: int) -> int:
+        """How many retrieval candidates to fetch for a final top_k"""
+        return top_k * RERANK_CANDIDATE_FACTOR if self.enabled else top_k
+
+    def _score(self, query: str, texts: List[str]) -> List[float]:
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device='cpu')
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        scores = []
+        for start in range(0, len(texts), self.batch_size):
+            if scores and time.perf_counter() >= deadline:
+                break
+            pairs = [(query, text) for text in texts[start:start + self.batch_size]]
+            scores.extend(self._model.predict(pairs, batch_size=len(pairs), show_progress_bar=False).tolist())
+        return scores
+
+    async def rerank(self, query: str, results: List[Dict]) -> List[Dict]:
+        """Results reordered by cross-encoder score (``rerank_score``), best first"""
+        if not self.enabled or len(results) < 2:
+            return results
+        loop = asyncio.get_running_loop()
+        try:
+            scores = await loop.run_in_executor(self._executor, self._score, query, [r['text'] for r in results])
+        except Exception as e:
+            if self._model is None:
+                logging.error(f"Could not load reranking model {self.model_name}, reranking disabled: {e}")
+                self.model_name = ''
+            else:
+                logging.error(f"Reranking error: {e}")
+            return results
+        if len(scores) < len(results):
+            logging.warning(f"Reranking budget of {self.budget_ms:g}ms spent after {len(scores)}/{len(results)} candidates")
+        for result, score in zip(results, scores):
+            result['rerank_score'] = score
+        scored = sorted(results[:len(scores)], key=lambda r: r['rerank_score'], reverse=True)
+        return scored + results[len(scores):]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+reranker = Reranker(RERANK_MODEL, RERANK_BATCH_SIZE, RERANK_BUDGET_MS)
+
+def chunk_result(chunk_id: str, meta: Dict, cosine: float) -> Dict:
+    """Retrieval result for an indexed chunk at the given cosine similarity to the query"""
+    similarity = max(cosine, 0.0)
+    
+    # Calculate quality score (0-1)
+    quality_score = min(similarity * (1.0 if len(meta['text']) > 100 else 0.8), 1.0)
     
-    return len(chunks)
+    return {
+        'chunk_id': chunk_id,
+        'document_id': meta['document_id'],
+        'document_name': meta['document_name'],
+        'text': meta['text'],
+        'chunk_index': meta.get('chunk_index'),
+        'similarity': float(similarity),
+        'distance': float(1.0 - cosine),  # Cosine distance
+        'page_number': meta.get('page_number'),
+        'section_title': meta.get('section_title'),
+        'quality_score': float(quality_score)
+    }
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = HYBRID_RRF_K) -> Dict[int, float]:
+    """RRF score of every ID appearing in any of the best-first rankings"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
 
-async def retrieve_relevant_chunks(query: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
-    """Retrieve relevant chunks using FAISS"""
-    global faiss_index, chunk_metadata, metadata_index_map
+async def retrieve_relevant_chunks(query: str, top_k: int = 5, document_ids: Optional[List[str]] = None,
+                                   retrieval: str = 'dense') -> List[Dict]:
+    """Retrieve relevant chunks using FAISS.
+
+    With ``retrieval='hybrid'`` the dense candidates are fused with BM25
+    matches from the lexical index by reciprocal-rank fusion, so exact
+    identifiers and codes are found even when their embeddings are not close.
+    When a reranking model is configured, a deeper candidate list is
+    reordered by the cross-encoder before the top_k are kept.
+    """
+    return (await retrieve_relevant_chunks_batch([query], top_k, document_ids, retrieval))[0]
+
+async def retrieve_relevant_chunks_batch(queries: List[str], top_k: int = 5, document_ids: Optional[List[str]] = None,
+                                         retrieval: str = 'dense') -> List[List[Dict]]:
+    """Retrieve chunks for several queries, in order, like ``retrieve_relevant_chunks``.
+
+    Queries not in the retrieval cache are embedded in one encode call and
+    searched as a single (n, d) matrix in one FAISS call.
+    """
+    faiss_index = index_manager.index
+    chunk_metadata = index_manager.chunk_metadata
     
     if faiss_index is None or len(chunk_metadata) == 0:
-        return []
+        return [[] for _ in queries]
+    
+    # Embed queries
+    query_embeddings = await embed_queries_cached(queries)
     
-    # Embed query
-    query_embedding = embedding_model.encode([query], convert_to_numpy=True).astype('float32')
+    # Identical searches against an unchanged index reuse earlier results
+    hybrid = retrieval == 'hybrid'
+    scope = tuple(sorted(document_ids)) if document_ids else None
+    results = [None] * len(queries)
+    cache_keys = []
+    misses = []
+    for i, query in enumerate(queries):
+        cache_key = (query_embeddings[i].tobytes(), top_k, scope)
+        if hybrid or reranker.enabled:
+            # Lexical matches and cross-encoder scores depend on the wording, not just the embedding
+            cache_key += (retrieval, normalize_query(query))
+        cache_keys.append(cache_key)
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            results[i] = [dict(result) for result in cached]
+        else:
+            misses.append(i)
+    if not misses:
+        return results
+    
+    # Reranking needs more candidates than it keeps; hybrid fuses deeper lists from both retrievers
+    candidates = reranker.candidates(top_k)
+    depth = candidates * HYBRID_CANDIDATE_FACTOR if hybrid else candidates
     
-    # Search FAISS with adjusted k
-    k = min(top_k * 3, len(chunk_metadata))  # Get more for filtering
-    distances, indices = faiss_index.search(query_embedding, k)
+    # Search FAISS, filtering to the requested documents inside the search itself
+    matrix = query_embeddings[misses]
+    if document_ids:
+        similarities, vector_ids = index_manager.search_scoped(matrix, depth, document_ids)
+    else:
+        similarities, vector_ids = index_manager.search(matrix, min(depth, len(chunk_metadata)))
+    
+    for row, i in enumerate(misses):
+        ranked = rank_candidates(queries[i], query_embeddings[i], similarities[row], vector_ids[row],
+                                 candidates, document_ids, hybrid)
+        ranked = (await reranker.rerank(queries[i], ranked))[:top_k]
+        retrieval_cache.set(cache_keys[i], [dict(result) for result in ranked])
+        results[i] = ranked
+    return results
+
+def rank_candidates(query: str, query_embedding: np.ndarray, similarities: np.ndarray, vector_ids: np.ndarray,
+                    candidates: int, document_ids: Optional[List[str]], hybrid: bool) -> List[Dict]:
+    """Best ``candidates`` results of one query's FAISS hits, fused with BM25 matches if hybrid"""
+    faiss_index = index_manager.index
+    chunk_metadata = index_manager.chunk_metadata
+    id_to_chunk = index_manager.id_to_chunk
     
     # Get chunks with metadata - use dict lookup for O(1) performance
-    results = []
-    for idx, distance in zip(indices[0], distances[0]):
-        if idx < len(metadata_index_map):
-            chunk_id = metadata_index_map[idx]
+    results = {}
+    for vector_id, cosine in zip(vector_ids.tolist(), similarities.tolist()):
+        if vector_id >= 0:
+            chunk_id = id_to_chunk.get(vector_id)
             meta = chunk_metadata.get(chunk_id)
             
             if not meta:
                 continue
             
-            # Filter by document_ids if provided
-            if document_ids and meta['document_id'] not in document_ids:
+            # Skip poor matches
+            if cosine < RETRIEVAL_MIN_SIMILARITY:
                 continue
             
-            # Skip if distance is too high (poor match)
-            if distance > 2.0:
-                continue
-            
-            similarity = 1.0 / (1.0 + distance)  # Convert distance to similarity
-            
-            # Calculate quality score (0-1)
-            quality_score = min(similarity * (1.0 if len(meta['text']) > 100 else 0.8), 1.0)
-            
-            results.append({
-                'chunk_id': chunk_id,
-                'document_id': meta['document_id'],
-                'document_name': meta['document_name'],
-                'text': meta['text'],
-                'similarity': float(similarity),
-                'distance': float(distance),
-                'page_number': meta.get('page_number'),
-                'section_title': meta.get('section_title'),
-                'quality_score': float(quality_score)
-            })
+            results[vector_id] = chunk_result(chunk_id, meta, cosine)
+    
+    if not hybrid:
+        # Sort by similarity
+        return sorted(results.values(), key=lambda x: x['similarity'], reverse=True)[:candidates]
     
-    # Sort by similarity and return top_k
-    results.sort(key=lambda x: x['similarity'], reverse=True)
-    return results[:top_k]
+    lexical_ids, lexical_scores = index_manager.lexical.search(
+        query, candidates * HYBRID_CANDIDATE_FACTOR, index_manager.scope_vector_ids(document_ids) if document_ids else None
+    )
+    fused = reciprocal_rank_fusion([list(results), lexical_ids.tolist()])
+    best = sorted(fused, key=fused.get, reverse=True)[:candidates]
+    
+    # Lexical-only matches bypass the similarity cutoff but still report their cosine similarity
+    missing = [v for v in best if v not in results and id_to_chunk.get(v) in chunk_metadata]
+    if missing:
+        vectors = faiss_index.reconstruct_batch(np.array(missing, dtype='int64'))
+        for vector_id, cosine in zip(missing, (vectors @ query_embedding).tolist()):
+            chunk_id = id_to_chunk[vector_id]
+            results[vector_id] = chunk_result(chunk_id, chunk_metadata[chunk_id], cosine)
+    
+    bm25 = dict(zip(lexical_ids.tolist(), lexical_scores.tolist()))
+    ranked = []
+    for vector_id in best:
+        result = results.get(vector_id)
+        if result is None:
+            continue
+        result['rrf_score'] = fused[vector_id]
+        result['bm25_score'] = bm25.get(vector_id, 0.0)
+        ranked.append(result)
+    return ranked
 
 def calculate_faithfulness_score(answer: str, citations: List[Citation]) -> float:
     """Calculate faithfulness score based on citation usage"""
@@ -451,8 +2503,171 @@ def calculate_faithfulness_score(answer: str, citations: List[Citation]) -> floa
     score = (avg_similarity * 0.7) + (0.3 if has_citations else 0.0)
     return min(score, 1.0)
 
-async def generate_answer_with_llm(query: str, context_chunks: List[Dict], mode: str) -> str:
-    """Generate answer using LLM with RAG context"""
+# LLM client: one long-lived async client whose HTTP connection pool is reused.
+# Setting LLM_BASE_URL points it at any OpenAI-compatible server instead of
+# Azure, e.g. the local mock in mock_llm_server.py for tests.
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', '100'))
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '120'))
+_llm_client = None
+
+def get_llm_client():
+    """Return the shared async LLM client, creating it on first use"""
+    global _llm_client
+    if _llm_client is None:
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            timeout=LLM_TIMEOUT_SECONDS
+        )
+        if os.environ.get('LLM_BASE_URL'):
+            _llm_client = AsyncOpenAI(
+                base_url=os.environ['LLM_BASE_URL'],
+                api_key=os.environ.get('LLM_API_KEY', 'mock'),
+                http_client=http_client
+            )
+        else:
+            _llm_client = AsyncAzureOpenAI(
+                api_key=os.environ.get('AZURE_OPENAI_API_KEY'),
+                api_version="2024-08-01-preview",
+                azure_endpoint=os.environ.get('AZURE_OPENAI_ENDPOINT'),
+                http_client=http_client
+            )
+    return _llm_client
+
+async def close_llm_client():
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.close()
+        _llm_client = None
+
+# Context assembly: retrieved chunks are merged, deduplicated and fitted to a per-mode token budget
+CONTEXT_TOKENIZER = os.environ.get('CONTEXT_TOKENIZER', 'o200k_base')
+CONTEXT_TOKEN_BUDGETS = {
+    'concise': int(os.environ.get('CONTEXT_TOKENS_CONCISE', '1000')),
+    'detailed': int(os.environ.get('CONTEXT_TOKENS_DETAILED', '2000')),
+    'research': int(os.environ.get('CONTEXT_TOKENS_RESEARCH', '3000'))
+}
+# Word-trigram Jaccard similarity at which a source is dropped as a near-duplicate
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+_tokenizer = None
+
+def get_tokenizer():
+    """Return the shared tiktoken encoding, loading it on first use (None if unavailable)"""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            _tokenizer = tiktoken.get_encoding(CONTEXT_TOKENIZER)
+        except Exception as e:
+            # The encoding file is downloaded on first use; offline hosts need it in TIKTOKEN_CACHE_DIR
+            logging.warning(f"Could not load tokenizer {CONTEXT_TOKENIZER}, estimating 4 characters per token: {e}")
+            _tokenizer = False
+    return _tokenizer or None
+
+def count_tokens(text: str) -> int:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return (len(text) + 3) // 4
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens * 4]
+    return tokenizer.decode(tokenizer.encode(text, disallowed_special=())[:max_tokens])
+
+def join_overlapping(first: str, second: str) -> str:
+    """Concatenate consecutive chunks, dropping the text the splitter repeated in both"""
+    probe = second[:32]
+    start = first.find(probe, max(0, len(first) - 2 * CHUNK_OVERLAP)) if probe else -1
+    while start != -1:
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+        start = first.find(probe, start + 1)
+    return first + "\n" + second
+
+def merge_adjacent_chunks(chunks: List[Dict]) -> List[Dict]:
+    """Merge chunks that are consecutive within a document into one source.
+
+    A merged source takes the place, scores, page and section of its
+    best-ranked member, and keeps that member's own text as
+    ``citation_text``.
+    """
+    runs = {}  # id of the run's best member -> members in document order
+    by_document = {}
+    for rank, chunk in enumerate(chunks):
+        by_document.setdefault(chunk['document_id'], []).append((rank, chunk))
+    for members in by_document.values():
+        members.sort(key=lambda m: m[1].get('chunk_index', 0))
+        run = [members[0]]
+        for member in members[1:]:
+            previous = run[-1][1]
+            if previous.get('chunk_index') is not None and member[1].get('chunk_index') == previous['chunk_index'] + 1:
+                run.append(member)
+                continue
+            runs[min(run)[0]] = run
+            run = [member]
+        runs[min(run)[0]] = run
+
+    merged = []
+    for rank in sorted(runs):
+        run = [chunk for _, chunk in runs[rank]]
+        source = dict(chunks[rank])
+        if len(run) > 1:
+            text = run[0]['text']
+            for chunk in run[1:]:
+                text = join_overlapping(text, chunk['text'])
+            source['text'] = text
+            source['citation_text'] = chunks[rank]['text']
+            source['chunk_ids'] = [chunk['chunk_id'] for chunk in run]
+        merged.append(source)
+    return merged
+
+def text_shingles(text: str) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+def source_tokens(source: Dict) -> int:
+    """Tokens a source takes in the prompt, its "[Source n - name]" header included"""
+    return count_tokens(source['document_name']) + 8 + count_tokens(source['text'])
+
+def assemble_context(chunks: List[Dict], mode: str) -> List[Dict]:
+    """Sources for the prompt: near-duplicates dropped, within the mode's token budget, then merged.
+
+    The budget is applied to individual chunks in retrieval order, so the
+    most relevant text is always the first to be kept; a chunk that does
+    not fit is skipped so a later, shorter one can still use the remaining
+    budget. The best chunk is always kept, truncated if it alone exceeds
+    the budget. Only the selected chunks are then merged with their
+    neighbours, which can only shrink the total. Each source records its
+    ``tokens``.
+    """
+    budget = CONTEXT_TOKEN_BUDGETS.get(mode, CONTEXT_TOKEN_BUDGETS['detailed'])
+    selected = []
+    selected_shingles = []
+    used = 0
+    for chunk in chunks:
+        shingles = text_shingles(chunk['text'])
+        if any(len(shingles & kept) / len(shingles | kept) >= CONTEXT_DUPLICATE_THRESHOLD
+               for kept in selected_shingles):
+            continue
+        tokens = source_tokens(chunk)
+        if used + tokens > budget:
+            if selected:
+                continue
+            chunk = dict(chunk)
+            chunk['text'] = truncate_to_tokens(chunk['text'], max(budget - (tokens - count_tokens(chunk['text'])), 1))
+            tokens = source_tokens(chunk)
+        selected.append(chunk)
+        selected_shingles.append(shingles)
+        used += tokens
+
+    sources = merge_adjacent_chunks(selected)
+    for source in sources:
+        source['tokens'] = source_tokens(source)
+    return sources
+
+def build_llm_messages(query: str, context_chunks: List[Dict], mode: str) -> List[Dict[str, str]]:
+    """Build the system and user messages for a RAG answer"""
     
     # Build context from chunks
     context = "\n\n".join([
@@ -520,21 +2735,58 @@ Question: {query}
 
 Answer:"""
     
-    try:
-        # Initialize Azure OpenAI client
-        client = AzureOpenAI(
-            api_key=os.environ.get('AZURE_OPENAI_API_KEY'),
-            api_version="2024-08-01-preview",
-            azure_endpoint=os.environ.get('AZURE_OPENAI_ENDPOINT')
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_prompt}
+    ]
+
+NO_CHAT_CONTEXT_ANSWER = "I don't have any relevant information in the uploaded documents to answer your question. Could you please upload relevant documents first?"
+
+def is_refusal(answer: str) -> bool:
+    """Check if the LLM refused to answer"""
+    return "cannot answer" in answer.lower() or "don't have" in answer.lower()
+
+def build_citations(chunks: List[Dict]) -> List[Citation]:
+    """Create citations with page numbers and quality scores"""
+    def excerpt(text: str) -> str:
+        return text[:300] + "..." if len(text) > 300 else text
+    
+    return [
+        Citation(
+            chunk_id=chunk['chunk_id'],
+            document_id=chunk['document_id'],
+            document_name=chunk['document_name'],
+            text=excerpt(chunk.get('citation_text', chunk['text'])),
+            similarity=chunk['similarity'],
+            page_number=chunk.get('page_number'),
+            section=chunk.get('section_title'),
+            quality_score=chunk.get('quality_score'),
+            confidence_level='high' if chunk.get('quality_score', 0) > 0.8 else 'medium' if chunk.get('quality_score', 0) > 0.5 else 'low'
         )
-        
-        # Generate answer
-        response = client.chat.completions.create(
+        for chunk in chunks
+    ]
+
+def build_retrieval_details(chunks: List[Dict]) -> Dict[str, Any]:
+    """Retrieval details for debug panel"""
+    return {
+        'retrieved_chunks': len(chunks),
+        'context_tokens': sum(chunk.get('tokens', 0) for chunk in chunks),
+        'chunks': [
+            {
+                'document': chunk['document_name'],
+                'similarity': chunk['similarity'],
+                'distance': chunk['distance']
+            }
+            for chunk in chunks
+        ]
+    }
+
+async def generate_answer_with_llm(query: str, context_chunks: List[Dict], mode: str) -> str:
+    """Generate answer using LLM with RAG context"""
+    try:
+        response = await get_llm_client().chat.completions.create(
             model=os.environ.get('AZURE_OPENAI_DEPLOYMENT', 'gpt-5.2-chat'),
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_prompt}
-            ]
+            messages=build_llm_messages(query, context_chunks, mode)
         )
         
         return response.choices[0].message.content
@@ -542,54 +2794,273 @@ Answer:"""
         logging.error(f"LLM error: {e}")
         raise HTTPException(status_code=500, detail="Error generating answer")
 
+async def stream_answer_with_llm(query: str, context_chunks: List[Dict], mode: str):
+    """Yield answer tokens from the LLM as they are generated"""
+    stream = await get_llm_client().chat.completions.create(
+        model=os.environ.get('AZURE_OPENAI_DEPLOYMENT', 'gpt-5.2-chat'),
+        messages=build_llm_messages(query, context_chunks, mode),
+        stream=True
+    )
+    async for event in stream:
+        # Azure sends content-filter events with no choices
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+
+# Semantic answer cache: reuse an answer when a similar question retrieved the same context
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', '0.95'))  # Cosine
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '1024'))  # Context sets held in process
+ANSWER_CACHE_MAX_VARIANTS = int(os.environ.get('ANSWER_CACHE_MAX_VARIANTS', '8'))  # Questions kept per context set
+
+class AnswerCache:
+    """Semantic cache of LLM answers.
+
+    An answer is reused when a question retrieved exactly the same chunk
+    set, in the same mode, against the same index version, and its
+    embedding is within ANSWER_CACHE_SIMILARITY (cosine) of a question
+    already answered from that context. Entries are stored in the
+    ``answer_cache`` collection, so they survive restarts and are shared
+    between workers; an in-process LRU of recently used context sets sits
+    in front of it. Entries of older index versions are never matched and
+    are purged once the version has moved on.
+    """
+
+    def __init__(self):
+        self._front = CountingCache(ANSWER_CACHE_SIZE, QUERY_CACHE_TTL, versioned=True)
+        self._purged_version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context_key(chunks: List[Dict], mode: str) -> str:
+        chunk_ids = sorted(chunk_id for chunk in chunks for chunk_id in chunk.get('chunk_ids', [chunk['chunk_id']]))
+        return hash_text(f"{mode}|{','.join(chunk_ids)}")
+
+    async def _entries(self, key: str, version: int) -> List[Tuple[np.ndarray, str]]:
+        """(question embedding, answer) pairs for a context set, newest first"""
+        entries = self._front.get(key)
+        if entries is None:
+            docs = await db.answer_cache.find(
+                {'key': key, 'index_version': version},
+                {'_id': 0, 'embedding': 1, 'embedding_dtype': 1, 'answer': 1}
+            ).sort('created_at', -1).limit(ANSWER_CACHE_MAX_VARIANTS).to_list(None)
+            entries = [(decode_embedding(d['embedding'], d.get('embedding_dtype')), d['answer']) for d in docs]
+            # A miss is not remembered, so answers other workers store later are still found
+            if entries:
+                self._front.set(key, entries)
+        return entries
+
+    async def answer(self, query: str, chunks: List[Dict], mode: str, generate) -> str:
+        """The cached answer for this question and context, else ``await generate()``, stored for reuse"""
+        if not ANSWER_CACHE_ENABLED or not chunks:
+            return await generate()
+        version = index_manager.version
+        key = self.context_key(chunks, mode)
+        embedding = (await embed_queries_cached([query]))[0]
+        entries = await self._entries(key, version)
+        for cached_embedding, answer in entries:
+            if float(cached_embedding @ embedding) >= ANSWER_CACHE_SIMILARITY:
+                self.hits += 1
+                return answer
+        self.misses += 1
+
+        answer = await generate()
+        if version == index_manager.version:
+            self._front.set(key, [(embedding, answer)] + entries[:ANSWER_CACHE_MAX_VARIANTS - 1])
+        try:
+            await db.answer_cache.insert_one({
+                'key': key,
+                'mode': mode,
+                'query': query,
+                'embedding': encode_embedding(embedding),
+                'embedding_dtype': EMBEDDING_STORAGE_DTYPE,
+                'answer': answer,
+                'index_version': version,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            })
+            if self._purged_version != version:
+                await db.answer_cache.delete_many({'index_version': {'$lt': version}})
+                self._purged_version = version
+        except Exception as e:
+            # The answer is still returned; it just will not be reused
+            logging.error(f"Error storing cached answer: {e}")
+        return answer
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'front': self._front.stats()
+        }
+
+answer_cache = AnswerCache()
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "NeuroQuery RAG API"}
 
-@api_router.post("/documents/upload", response_model=Document)
-async def upload_document(file: UploadFile = File(...)):
-    """Upload and process a document"""
+@api_router.post("/documents/upload", response_model=Document, status_code=202)
+async def upload_document(response: Response, file: UploadFile = File(...)):
+    """Upload a document and queue it for background processing
     
-    # Create document record
-    doc = Document(
-        filename=file.filename,
-        file_type=file.filename.split('.')[-1].lower()
-    )
+    Returns 202 with the (unprocessed) document; poll
+    ``/documents/jobs/{job_id}`` for progress. Re-uploading a file that is
+    already stored returns 200 with the existing document instead.
+    """
+    file_type = file.filename.split('.')[-1].lower()
+    if file_type not in SUPPORTED_FILE_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    
+    file_path, content_hash = await spool_upload(file)
+    
+    existing = await db.documents.find_one({'content_hash': content_hash}, {'_id': 0})
+    if existing:
+        file_path.unlink(missing_ok=True)
+        logging.info(f"Upload of {file.filename} matches stored document {existing['id']}")
+        response.status_code = 200
+        return Document(**existing)
+    
+    # Create document and job records
+    doc = Document(filename=file.filename, file_type=file_type, content_hash=content_hash)
+    job = DocumentJob(document_id=doc.id, filename=file.filename)
+    doc.job_id = job.id
     
     doc_dict = doc.model_dump()
     doc_dict['upload_date'] = doc_dict['upload_date'].isoformat()
+    job_dict = job.model_dump()
+    job_dict['created_at'] = job_dict['created_at'].isoformat()
+    job_dict['updated_at'] = job_dict['updated_at'].isoformat()
+    job_dict['heartbeat_at'] = job_dict['heartbeat_at'].isoformat()
     await db.documents.insert_one(doc_dict)
+    await db.document_jobs.insert_one(job_dict)
     
-    # Process document in background
     try:
-        chunks_count = await process_document(file, doc.id)
-        logging.info(f"Processed document {file.filename}: {chunks_count} chunks")
-    except Exception as e:
-        logging.error(f"Error processing document: {e}")
+        ingestion_queue.submit(job, file_path)
+    except asyncio.QueueFull:
+        file_path.unlink(missing_ok=True)
         await db.documents.delete_one({'id': doc.id})
-        raise HTTPException(status_code=500, detail=str(e))
+        await db.document_jobs.delete_one({'id': job.id})
+        raise HTTPException(status_code=503, detail="Ingestion queue is full, please retry later")
     
     return doc
 
+@api_router.post("/documents/upload/bulk", response_model=List[BulkUploadResult], status_code=202)
+async def upload_documents_bulk(files: List[UploadFile] = File(...)):
+    """Upload many documents, or zip archives of them, for batched background processing
+    
+    Accepted files are queued together as one bulk batch (see BulkIngestion);
+    poll each document's ``/documents/jobs/{job_id}`` for progress.
+    """
+    spooled = []
+    results = []
+    try:
+        for file in files:
+            file_type = file.filename.split('.')[-1].lower()
+            if file_type == 'zip':
+                zip_path, _ = await spool_upload(file, BULK_MAX_ARCHIVE_SIZE_MB)
+                max_files = BULK_MAX_FILES - sum(1 for item in spooled if item.path)
+                try:
+                    spooled.extend(await asyncio.to_thread(spool_archive, zip_path, max_files))
+                except zipfile.BadZipFile:
+                    spooled.append(SpooledFile(file.filename, None, None, "Not a valid zip archive"))
+                finally:
+                    zip_path.unlink(missing_ok=True)
+            elif file_type not in SUPPORTED_FILE_TYPES:
+                spooled.append(SpooledFile(file.filename, None, None, "Unsupported file type"))
+            else:
+                try:
+                    file_path, content_hash = await spool_upload(file)
+                except HTTPException as e:
+                    spooled.append(SpooledFile(file.filename, None, None, e.detail))
+                    continue
+                spooled.append(SpooledFile(file.filename, file_path, content_hash))
+    except BaseException:
+        for item in spooled:
+            if item.path:
+                item.path.unlink(missing_ok=True)
+        raise
+    
+    entries = []
+    docs = []
+    seen = {}  # content hash -> document, to catch duplicates within this upload
+    for item in spooled:
+        if item.path is None:
+            results.append(BulkUploadResult(filename=item.filename, status='rejected', error=item.error))
+            continue
+        if len(entries) >= BULK_MAX_FILES:
+            item.path.unlink(missing_ok=True)
+            results.append(BulkUploadResult(filename=item.filename, status='rejected',
+                                            error=f"More than {BULK_MAX_FILES} files in one upload"))
+            continue
+        existing = seen.get(item.content_hash)
+        if existing is None:
+            stored = await db.documents.find_one({'content_hash': item.content_hash}, {'_id': 0})
+            existing = Document(**stored) if stored else None
+        if existing:
+            item.path.unlink(missing_ok=True)
+            results.append(BulkUploadResult(filename=item.filename, status='duplicate', document=existing))
+            continue
+        
+        doc = Document(filename=item.filename, file_type=item.filename.split('.')[-1].lower(),
+                       content_hash=item.content_hash)
+        job = DocumentJob(document_id=doc.id, filename=item.filename)
+        doc.job_id = job.id
+        seen[item.content_hash] = doc
+        docs.append(doc)
+        entries.append((job, item.path))
+        results.append(BulkUploadResult(filename=item.filename, status='queued', document=doc))
+    
+    if not entries:
+        return results
+    
+    doc_dicts = []
+    for doc in docs:
+        doc_dict = doc.model_dump()
+        doc_dict['upload_date'] = doc_dict['upload_date'].isoformat()
+        doc_dicts.append(doc_dict)
+    job_dicts = []
+    for job, _ in entries:
+        job_dict = job.model_dump()
+        job_dict['created_at'] = job_dict['created_at'].isoformat()
+        job_dict['updated_at'] = job_dict['updated_at'].isoformat()
+        job_dict['heartbeat_at'] = job_dict['heartbeat_at'].isoformat()
+        job_dicts.append(job_dict)
+    await db.documents.insert_many(doc_dicts)
+    await db.document_jobs.insert_many(job_dicts)
+    
+    try:
+        ingestion_queue.submit_batch(entries)
+    except asyncio.QueueFull:
+        for _, file_path in entries:
+            file_path.unlink(missing_ok=True)
+        await db.documents.delete_many({'id': {'$in': [doc.id for doc in docs]}})
+        await db.document_jobs.delete_many({'id': {'$in': [job.id for job, _ in entries]}})
+        raise HTTPException(status_code=503, detail="Ingestion queue is full, please retry later")
+    
+    logging.info(f"Queued bulk upload of {len(entries)} documents")
+    return results
+
+@api_router.get("/documents/jobs/{job_id}", response_model=DocumentJob)
+async def get_document_job(job_id: str):
+    """Get the status and progress of a document ingestion job"""
+    job = await db.document_jobs.find_one({'id': job_id}, {'_id': 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @api_router.post("/documents/preview")
 async def preview_document(file: UploadFile = File(...)):
     """Preview document content before uploading"""
     try:
-        file_bytes = await file.read()
         file_type = file.filename.split('.')[-1].lower()
-        
-        # Extract text based on file type
-        text = ""
-        if file_type == 'pdf':
-            text = extract_text_from_pdf(file_bytes)
-        elif file_type in ['docx', 'doc']:
-            text = extract_text_from_docx(file_bytes)
-        elif file_type in ['txt', 'md']:
-            text = file_bytes.decode('utf-8')
-        elif file_type in ['png', 'jpg', 'jpeg', 'bmp', 'gif']:
-            text = extract_text_from_image(file_bytes)
-        else:
+        if file_type not in SUPPORTED_FILE_TYPES:
             return {
                 "filename": file.filename,
                 "file_type": file_type,
@@ -597,16 +3068,33 @@ async def preview_document(file: UploadFile = File(...)):
                 "total_length": 0
             }
         
-        # Return first 500 characters as preview
-        preview_text = text[:500] if text else "[No content extracted]"
+        # Extract text based on file type, keeping only the first 500 characters
+        file_path, _ = await spool_upload(file)
+        preview_text = ""
+        total_length = 0
+        try:
+            if file_type in ['txt', 'md']:
+                pieces = iter_plain_text(file_path)
+            else:
+                pieces = extraction_pool.iter_text(str(file_path), file_type)
+            async for piece in pieces:
+                preview_text += piece.text[:500 - len(preview_text)]
+                total_length += len(piece.text)
+        except HTTPException as e:
+            if e.status_code != 400:
+                raise
+        finally:
+            file_path.unlink(missing_ok=True)
         
         return {
             "filename": file.filename,
             "file_type": file_type,
-            "preview": preview_text,
-            "total_length": len(text),
-            "is_complete": len(text) <= 500
+            "preview": preview_text or "[No content extracted]",
+            "total_length": total_length,
+            "is_complete": total_length <= 500
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error previewing document: {e}")
         raise HTTPException(status_code=400, detail=f"Error previewing file: {str(e)}")
@@ -677,38 +3165,21 @@ async def get_documents_stats():
 @api_router.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
     """Delete a document and its chunks"""
-    global chunk_metadata, metadata_index_map
-    
     # Delete from database
     await db.documents.delete_one({'id': document_id})
     await db.document_chunks.delete_many({'document_id': document_id})
     
-    # Remove from metadata - filter dict keys
-    chunk_ids_to_remove = [cid for cid, meta in chunk_metadata.items() 
-                          if meta['document_id'] == document_id]
-    for chunk_id in chunk_ids_to_remove:
-        del chunk_metadata[chunk_id]
-    
-    # Update metadata_index_map
-    metadata_index_map = [cid for cid in metadata_index_map if cid not in chunk_ids_to_remove]
+    # Remove the document's vectors and metadata from the live index
+    await index_manager.remove_document(document_id)
     
     return {"message": "Document deleted"}
 
-@api_router.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
-    """Query documents using RAG"""
-    
-    if not request.query.strip():
-        raise HTTPException(status_code=400, detail="Query cannot be empty")
-    
-    # Retrieve relevant chunks
-    top_k = 5 if request.mode == "concise" else 8
-    chunks = await retrieve_relevant_chunks(
-        request.query,
-        top_k=top_k,
-        document_ids=request.document_ids
-    )
-    
+def check_retrieval_mode(retrieval: str):
+    if retrieval not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+
+async def answer_query(query: str, chunks: List[Dict], mode: str) -> QueryResponse:
+    """Answer a query from its retrieved chunks, with citations and a faithfulness score"""
     if not chunks:
         return QueryResponse(
             answer="No relevant information found in the uploaded documents.",
@@ -717,101 +3188,239 @@ async def query_documents(request: QueryRequest):
             refused=True
         )
     
-    # Generate answer
-    answer = await generate_answer_with_llm(request.query, chunks, request.mode)
+    # Generate answer, reusing one given for a similar question with the same context
+    answer = await answer_cache.answer(query, chunks, mode, lambda: generate_answer_with_llm(query, chunks, mode))
     
     # Check if LLM refused to answer
-    refused = "cannot answer" in answer.lower() or "don't have" in answer.lower()
+    refused = is_refusal(answer)
     
     # Create citations with page numbers and quality scores
-    citations = [
-        Citation(
-            chunk_id=chunk['chunk_id'],
-            document_id=chunk['document_id'],
-            document_name=chunk['document_name'],
-            text=chunk['text'][:300] + "..." if len(chunk['text']) > 300 else chunk['text'],
-            similarity=chunk['similarity'],
-            page_number=chunk.get('page_number'),
-            section=chunk.get('section_title'),
-            quality_score=chunk.get('quality_score'),
-            confidence_level='high' if chunk.get('quality_score', 0) > 0.8 else 'medium' if chunk.get('quality_score', 0) > 0.5 else 'low'
-        )
-        for chunk in chunks
-    ]
+    citations = build_citations(chunks)
     
     # Calculate faithfulness score
     faithfulness_score = calculate_faithfulness_score(answer, citations)
     if refused:
         faithfulness_score = 0.0
     
-    # Retrieval details for debug panel
-    retrieval_details = {
-        'retrieved_chunks': len(chunks),
-        'chunks': [
-            {
-                'document': chunk['document_name'],
-                'similarity': chunk['similarity'],
-                'distance': chunk['distance']
-            }
-            for chunk in chunks
-        ]
-    }
-    
     return QueryResponse(
         answer=answer,
         citations=citations,
         faithfulness_score=faithfulness_score,
-        retrieval_details=retrieval_details,
+        retrieval_details=build_retrieval_details(chunks),
         refused=refused
     )
 
+@api_router.post("/query", response_model=QueryResponse)
+async def query_documents(request: QueryRequest):
+    """Query documents using RAG"""
+    
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    check_retrieval_mode(request.retrieval)
+    
+    # Retrieve relevant chunks
+    top_k = 5 if request.mode == "concise" else 8
+    chunks = await retrieve_relevant_chunks(
+        request.query,
+        top_k=top_k,
+        document_ids=request.document_ids,
+        retrieval=request.retrieval
+    )
+    chunks = assemble_context(chunks, request.mode)
+    
+    return await answer_query(request.query, chunks, request.mode)
+
+QUERY_BATCH_MAX_QUERIES = int(os.environ.get('QUERY_BATCH_MAX_QUERIES', '256'))
+QUERY_BATCH_LLM_CONCURRENCY = int(os.environ.get('QUERY_BATCH_LLM_CONCURRENCY', '8'))
+
+@api_router.post("/query/batch", response_model=List[BatchQueryResult])
+async def query_documents_batch(request: BatchQueryRequest):
+    """Run many queries at once (evaluation runs, cache pre-warming); results are in request order.
+
+    Retrieval for the whole batch is one encode call and one FAISS search.
+    With ``generate_answers`` every query is also answered, with at most
+    QUERY_BATCH_LLM_CONCURRENCY LLM calls in flight; a failed answer is
+    reported in that result's ``error`` instead of failing the batch.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(request.queries) > QUERY_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {QUERY_BATCH_MAX_QUERIES} queries per batch")
+    if any(not query.strip() for query in request.queries):
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    check_retrieval_mode(request.retrieval)
+    
+    top_k = 5 if request.mode == "concise" else 8
+    batch_chunks = await retrieve_relevant_chunks_batch(
+        request.queries,
+        top_k=top_k,
+        document_ids=request.document_ids,
+        retrieval=request.retrieval
+    )
+    batch_chunks = [assemble_context(chunks, request.mode) for chunks in batch_chunks]
+    
+    def retrieval_only(query: str, chunks: List[Dict], error: Optional[str] = None) -> BatchQueryResult:
+        return BatchQueryResult(
+            query=query,
+            citations=build_citations(chunks),
+            retrieval_details=build_retrieval_details(chunks),
+            error=error
+        )
+    
+    if not request.generate_answers:
+        return [retrieval_only(query, chunks) for query, chunks in zip(request.queries, batch_chunks)]
+    
+    llm_slots = asyncio.Semaphore(QUERY_BATCH_LLM_CONCURRENCY)
+    
+    async def answer(query: str, chunks: List[Dict]) -> BatchQueryResult:
+        async with llm_slots:
+            try:
+                response = await answer_query(query, chunks, request.mode)
+            except HTTPException as e:
+                return retrieval_only(query, chunks, e.detail)
+        return BatchQueryResult(query=query, **response.model_dump())
+    
+    return await asyncio.gather(*(answer(query, chunks) for query, chunks in zip(request.queries, batch_chunks)))
+
+@api_router.post("/query/stream")
+async def query_documents_stream(request: QueryRequest):
+    """Query documents using RAG, streaming the answer as server-sent events.
+
+    Events: ``citations`` (sent first), ``token`` (answer text deltas),
+    ``done`` (faithfulness score and refusal flag) or ``error``.
+    """
+    
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    check_retrieval_mode(request.retrieval)
+    
+    top_k = 5 if request.mode == "concise" else 8
+    chunks = await retrieve_relevant_chunks(
+        request.query,
+        top_k=top_k,
+        document_ids=request.document_ids,
+        retrieval=request.retrieval
+    )
+    chunks = assemble_context(chunks, request.mode)
+    citations = build_citations(chunks)
+    
+    async def events():
+        yield sse_event('citations', {
+            'citations': [c.model_dump() for c in citations],
+            'retrieval_details': build_retrieval_details(chunks)
+        })
+        if not chunks:
+            yield sse_event('token', {'text': "No relevant information found in the uploaded documents."})
+            yield sse_event('done', {'faithfulness_score': 0.0, 'refused': True})
+            return
+        
+        parts = []
+        try:
+            async for token in stream_answer_with_llm(request.query, chunks, request.mode):
+                parts.append(token)
+                yield sse_event('token', {'text': token})
+        except Exception as e:
+            logging.error(f"LLM streaming error: {e}")
+            yield sse_event('error', {'detail': "Error generating answer"})
+            return
+        
+        answer = "".join(parts)
+        refused = is_refusal(answer)
+        faithfulness_score = 0.0 if refused else calculate_faithfulness_score(answer, citations)
+        yield sse_event('done', {'faithfulness_score': faithfulness_score, 'refused': refused})
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @api_router.get("/documents/{document_id}/chunks")
 async def get_document_chunks(document_id: str, skip: int = 0, limit: int = 100):
     """Get all chunks for a document with pagination"""
     chunks = await db.document_chunks.find(
         {'document_id': document_id},
         {'_id': 0, 'embedding': 0}  # Exclude embeddings
-    ).skip(skip).limit(limit).to_list(None)
+    ).sort('chunk_index', 1).skip(skip).limit(limit).to_list(None)
     return chunks
 
 # Chat Routes
+# Messages live in chat_messages, one document each, ordered by seq within a chat
+CHAT_RECENT_MESSAGES = int(os.environ.get('CHAT_RECENT_MESSAGES', '50'))
+CHAT_MAX_MESSAGES_PAGE = int(os.environ.get('CHAT_MAX_MESSAGES_PAGE', '200'))
+CHAT_LIST_PAGE_SIZE = int(os.environ.get('CHAT_LIST_PAGE_SIZE', '30'))
+CHAT_LIST_MAX_PAGE_SIZE = int(os.environ.get('CHAT_LIST_MAX_PAGE_SIZE', '100'))
+
+async def migrate_chat_messages():
+    """Move messages embedded in chat_sessions (the old layout) into chat_messages
+    
+    Upserts by message id, so an interrupted migration can simply run again.
+    """
+    migrated = 0
+    async for chat in db.chat_sessions.find({'messages': {'$exists': True}}, {'_id': 0, 'id': 1, 'messages': 1}):
+        messages = chat.get('messages') or []
+        if messages:
+            await db.chat_messages.bulk_write([
+                UpdateOne({'id': msg['id']}, {'$setOnInsert': {**msg, 'chat_id': chat['id'], 'seq': seq}}, upsert=True)
+                for seq, msg in enumerate(messages)
+            ], ordered=False)
+        await db.chat_sessions.update_one(
+            {'id': chat['id']},
+            {'$unset': {'messages': ''}, '$set': {'message_count': len(messages)}}
+        )
+        migrated += 1
+    if migrated:
+        logging.info(f"Moved messages of {migrated} chats to chat_messages")
+
 @api_router.post("/chats", response_model=ChatSession)
 async def create_chat(document_ids: Optional[List[str]] = None):
     """Create a new chat session"""
     chat = ChatSession(
         document_ids=document_ids or []
     )
-    chat_dict = chat.model_dump()
+    chat_dict = chat.model_dump(exclude={'messages', 'has_more_messages'})
     chat_dict['created_at'] = chat_dict['created_at'].isoformat()
     chat_dict['updated_at'] = chat_dict['updated_at'].isoformat()
     await db.chat_sessions.insert_one(chat_dict)
     return chat
 
+async def load_chat_messages(chat_id: str, before: Optional[int] = None, limit: int = CHAT_RECENT_MESSAGES) -> List[Dict]:
+    """Up to ``limit`` messages of a chat preceding position ``before`` (default: the latest), oldest first"""
+    query = {'chat_id': chat_id}
+    if before is not None:
+        query['seq'] = {'$lt': before}
+    messages = await db.chat_messages.find(query, {'_id': 0, 'chat_id': 0}).sort('seq', -1).limit(limit).to_list(None)
+    messages.reverse()
+    return messages
+
 @api_router.get("/chats/{chat_id}", response_model=ChatSession)
 async def get_chat(chat_id: str):
-    """Get a chat session with all messages"""
-    chat = await db.chat_sessions.find_one({'id': chat_id})
+    """Get a chat session with its most recent messages
+    
+    Older messages are paged in with ``GET /chats/{chat_id}/messages``.
+    """
+    chat = await db.chat_sessions.find_one({'id': chat_id}, {'_id': 0})
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
+    chat['messages'] = await load_chat_messages(chat_id)
+    chat['has_more_messages'] = bool(chat['messages']) and chat['messages'][0]['seq'] > 0
     return chat
 
+@api_router.get("/chats/{chat_id}/messages", response_model=List[ChatMessage])
+async def list_chat_messages(chat_id: str, before: Optional[int] = None, limit: int = CHAT_RECENT_MESSAGES):
+    """Page backwards through a chat: messages before position ``before``, oldest first"""
+    limit = max(1, min(limit, CHAT_MAX_MESSAGES_PAGE))
+    return await load_chat_messages(chat_id, before, limit)
+
 @api_router.post("/chats/{chat_id}/messages")
 async def send_message(chat_id: str, message: str, mode: str = "detailed"):
     """Send a message in a chat session and get AI response"""
     
     # Get chat session
-    chat = await db.chat_sessions.find_one({'id': chat_id})
+    chat = await db.chat_sessions.find_one({'id': chat_id}, {'_id': 0, 'id': 1, 'document_ids': 1})
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
     if not message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     
-    # Add user message
-    user_msg = ChatMessage(role="user", content=message)
-    user_msg_dict = user_msg.model_dump()
-    user_msg_dict['timestamp'] = user_msg_dict['timestamp'].isoformat()
-    
     # Retrieve relevant chunks
     document_ids = chat.get('document_ids') or None
     top_k = 5 if mode == "concise" else 8
@@ -820,53 +3429,113 @@ async def send_message(chat_id: str, message: str, mode: str = "detailed"):
         top_k=top_k,
         document_ids=document_ids
     )
+    chunks = assemble_context(chunks, mode)
     
     if not chunks:
-        answer = "I don't have any relevant information in the uploaded documents to answer your question. Could you please upload relevant documents first?"
+        answer = NO_CHAT_CONTEXT_ANSWER
         citations = []
     else:
-        # Generate answer
-        answer = await generate_answer_with_llm(message, chunks, mode)
+        # Generate answer, reusing one given for a similar question with the same context
+        answer = await answer_cache.answer(message, chunks, mode, lambda: generate_answer_with_llm(message, chunks, mode))
         
         # Create citations with page numbers and quality scores
-        citations = [
-            {
-                "chunk_id": chunk['chunk_id'],
-                "document_id": chunk['document_id'],
-                "document_name": chunk['document_name'],
-                "text": chunk['text'][:300] + "..." if len(chunk['text']) > 300 else chunk['text'],
-                "similarity": chunk['similarity'],
-                "page_number": chunk.get('page_number'),
-                "section": chunk.get('section_title'),
-                "quality_score": chunk.get('quality_score'),
-                "confidence_level": 'high' if chunk.get('quality_score', 0) > 0.8 else 'medium' if chunk.get('quality_score', 0) > 0.5 else 'low'
-            }
-            for chunk in chunks
-        ]
+        citations = [c.model_dump() for c in build_citations(chunks)]
+    
+    user_msg, assistant_msg = await save_chat_exchange(chat, message, answer, citations, len(chunks))
     
-    # Add assistant message
-    assistant_msg = ChatMessage(role="assistant", content=answer, citations=citations)
-    assistant_msg_dict = assistant_msg.model_dump()
-    assistant_msg_dict['timestamp'] = assistant_msg_dict['timestamp'].isoformat()
+    return {
+        "user_message": user_msg,
+        "assistant_message": assistant_msg,
+        "citations": citations
+    }
+
+@api_router.post("/chats/{chat_id}/messages/stream")
+async def send_message_stream(chat_id: str, message: str, mode: str = "detailed"):
+    """Send a message in a chat session, streaming the AI response as server-sent events.
+
+    Events: ``citations`` (sent first), ``token`` (answer text deltas),
+    ``done`` (the stored user and assistant messages) or ``error``.
+    """
     
-    # Update chat with both messages
-    messages = chat.get('messages', [])
-    messages.append(user_msg_dict)
-    messages.append(assistant_msg_dict)
+    chat = await db.chat_sessions.find_one({'id': chat_id}, {'_id': 0, 'id': 1, 'document_ids': 1})
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
     
-    # Update title if first message
-    title = chat.get('title', 'New Chat')
-    if len(messages) == 2:  # First exchange
-        title = message[:50] + "..." if len(message) > 50 else message
+    if not message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    document_ids = chat.get('document_ids') or None
+    top_k = 5 if mode == "concise" else 8
+    chunks = await retrieve_relevant_chunks(
+        message,
+        top_k=top_k,
+        document_ids=document_ids
+    )
+    chunks = assemble_context(chunks, mode)
+    citations = [c.model_dump() for c in build_citations(chunks)]
+    
+    async def events():
+        yield sse_event('citations', {'citations': citations})
+        if not chunks:
+            answer = NO_CHAT_CONTEXT_ANSWER
+            yield sse_event('token', {'text': answer})
+        else:
+            parts = []
+            try:
+                async for token in stream_answer_with_llm(message, chunks, mode):
+                    parts.append(token)
+                    yield sse_event('token', {'text': token})
+            except Exception as e:
+                logging.error(f"LLM streaming error: {e}")
+                yield sse_event('error', {'detail': "Error generating answer"})
+                return
+            answer = "".join(parts)
+        
+        user_msg, assistant_msg = await save_chat_exchange(chat, message, answer, citations, len(chunks))
+        yield sse_event('done', {
+            'user_message': user_msg.model_dump(),
+            'assistant_message': assistant_msg.model_dump()
+        })
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def save_chat_exchange(chat: Dict, message: str, answer: str, citations: List[Dict], result_count: int):
+    """Append a user/assistant message pair to a chat and log the search
+    
+    The pair's positions are reserved with an atomic ``$inc`` on the session,
+    so concurrent sends to the same chat never collide or overwrite each other.
+    """
+    chat_id = chat['id']
+    document_ids = chat.get('document_ids') or None
     
-    await db.chat_sessions.update_one(
+    session = await db.chat_sessions.find_one_and_update(
         {'id': chat_id},
-        {'$set': {
-            'messages': messages,
-            'title': title,
-            'updated_at': datetime.now(timezone.utc).isoformat()
-        }}
+        {
+            '$inc': {'message_count': 2},
+            '$set': {'updated_at': datetime.now(timezone.utc).isoformat()}
+        },
+        projection={'_id': 0, 'message_count': 1},
+        return_document=ReturnDocument.AFTER
     )
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    seq = session['message_count'] - 2
+    
+    user_msg = ChatMessage(role="user", content=message, seq=seq)
+    assistant_msg = ChatMessage(role="assistant", content=answer, citations=citations, seq=seq + 1)
+    message_docs = []
+    for msg in (user_msg, assistant_msg):
+        msg_dict = msg.model_dump()
+        msg_dict['timestamp'] = msg_dict['timestamp'].isoformat()
+        msg_dict['chat_id'] = chat_id
+        message_docs.append(msg_dict)
+    await db.chat_messages.insert_many(message_docs)
+    
+    # Update title if first message
+    if seq == 0:
+        title = message[:50] + "..." if len(message) > 50 else message
+        await db.chat_sessions.update_one({'id': chat_id}, {'$set': {'title': title}})
     
     # Log search query to history (async, non-blocking)
     try:
@@ -874,30 +3543,54 @@ async def send_message(chat_id: str, message: str, mode: str = "detailed"):
             "query": message,
             "document_ids": document_ids or [],
             "timestamp": datetime.now(timezone.utc).isoformat(),
-            "result_count": len(chunks),
+            "result_count": result_count,
             "helpful": None  # Will be updated when user provides feedback
         }
         await db.search_queries.insert_one(search_log)
     except Exception as e:
         logging.warning(f"Failed to log search query: {e}")  # Non-critical
     
-    
-    return {
-        "user_message": user_msg,
-        "assistant_message": assistant_msg,
-        "citations": citations
-    }
+    return user_msg, assistant_msg
+
+def encode_chat_cursor(chat: Dict) -> str:
+    return base64.urlsafe_b64encode(f"{chat['updated_at']}|{chat['id']}".encode()).decode()
+
+def decode_chat_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        updated_at, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return updated_at, chat_id
 
-@api_router.get("/chats")
-async def list_chats():
-    """List all chat sessions"""
-    chats = await db.chat_sessions.find({}, {"_id": 0}).sort('updated_at', -1).to_list(100)
-    return chats
+@api_router.get("/chats", response_model=ChatSummaryPage)
+async def list_chats(cursor: Optional[str] = None, limit: int = CHAT_LIST_PAGE_SIZE):
+    """List chat summaries, most recently updated first
+    
+    Keyset pagination on (updated_at, id): pass ``next_cursor`` back as
+    ``cursor`` for the next page. Each page costs the same however many
+    chats exist.
+    """
+    limit = max(1, min(limit, CHAT_LIST_MAX_PAGE_SIZE))
+    query = {}
+    if cursor:
+        updated_at, chat_id = decode_chat_cursor(cursor)
+        query = {'$or': [
+            {'updated_at': {'$lt': updated_at}},
+            {'updated_at': updated_at, 'id': {'$lt': chat_id}}
+        ]}
+    chats = await db.chat_sessions.find(
+        query,
+        {'_id': 0, 'id': 1, 'title': 1, 'updated_at': 1, 'message_count': 1}
+    ).sort([('updated_at', -1), ('id', -1)]).limit(limit + 1).to_list(None)
+    
+    next_cursor = encode_chat_cursor(chats[limit - 1]) if len(chats) > limit else None
+    return ChatSummaryPage(chats=chats[:limit], next_cursor=next_cursor)
 
 @api_router.delete("/chats/{chat_id}")
 async def delete_chat(chat_id: str):
     """Delete a chat session"""
     await db.chat_sessions.delete_one({'id': chat_id})
+    await db.chat_messages.delete_many({'chat_id': chat_id})
     return {"message": "Chat deleted"}
 
 # Feedback Routes
@@ -917,9 +3610,9 @@ async def submit_feedback(message_id: str, chat_id: str, helpful: bool, feedback
         await db.message_feedback.insert_one(feedback)
         
         # Also update the message in chat with feedback flag
-        await db.chat_sessions.update_one(
-            {"id": chat_id, "messages.id": message_id},
-            {"$set": {"messages.$.feedback_helpful": helpful}}
+        await db.chat_messages.update_one(
+            {"id": message_id, "chat_id": chat_id},
+            {"$set": {"feedback_helpful": helpful}}
         )
         
         return {"status": "feedback received"}
@@ -962,6 +3655,43 @@ async def log_search_query(query: str, document_ids: Optional[List[str]] = None,
         # Don't fail if logging fails
         return {"status": "logged", "warning": "logging failed"}
 
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters for the query and answer caches, for sizing them"""
+    return {
+        'index_version': index_manager.version,
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'retrieval_cache': retrieval_cache.stats(),
+        'answer_cache': answer_cache.stats()
+    }
+
+# Admin Routes
+@api_router.post("/admin/index/rebuild")
+async def admin_rebuild_index():
+    """Rebuild the FAISS index from MongoDB (repair operation)"""
+    await rebuild_faiss_index()
+    return {"status": "rebuilt", "total_chunks": index_manager.size}
+
+@api_router.post("/admin/index/compact")
+async def admin_compact_index(index_type: Optional[str] = None):
+    """Compact FAISS storage after deletes, optionally pinning a backend ('auto' unpins it) (repair operation)"""
+    if index_type is not None and index_type not in INDEX_TYPES + ('auto',):
+        raise HTTPException(status_code=400, detail=f"index_type must be one of {', '.join(INDEX_TYPES + ('auto',))}")
+    await index_manager.compact(index_type)
+    return {"status": "compacted", "index_type": index_manager.index_type,
+            "index_type_override": index_manager.index_type_override, "total_chunks": index_manager.size}
+
+@api_router.get("/admin/index/evaluate")
+async def admin_evaluate_index(k: int = 10, num_queries: int = 200):
+    """Compare recall@k and latency of every index backend against exact search"""
+    return await evaluate_index_types(k=k, num_queries=num_queries)
+
+@api_router.get("/admin/db/explain")
+async def admin_explain_queries():
+    """Query plans of the hot MongoDB queries; any with ``collscan`` needs an index"""
+    report = await explain_hot_queries()
+    return {"collscans": sum(entry['collscan'] for entry in report), "queries": report}
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -982,13 +3712,22 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await index_manager.save_snapshot()
+    await ingestion_queue.stop()
+    embedding_service.shutdown()
+    extraction_pool.shutdown()
+    reranker.shutdown()
+    await close_llm_client()
     client.close()
 
 @app.on_event("startup")
 async def startup_db_client():
-    """Rebuild FAISS index from MongoDB on startup"""
-    await rebuild_faiss_index()
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    """Load the embedding model and FAISS index (from the local snapshot or MongoDB) and start ingestion workers"""
+    await asyncio.to_thread(embedding_service.load)
+    await ensure_indexes()
+    if MONGO_EXPLAIN_ON_STARTUP:
+        await check_query_plans()
+    await migrate_chat_messages()
+    await load_faiss_index()
+    # Its heartbeat also fails the jobs and clears the spools left behind by processes that are gone
+    ingestion_queue.start()
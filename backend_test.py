@@ -5,6 +5,23 @@ import time
 from datetime import datetime
 from pathlib import Path
 import tempfile
+from urllib.parse import quote
+
+TEST_DOCUMENT = """
+        NeuroQuery Test Document
+        
+        This is a test document for the NeuroQuery RAG system.
+        It contains information about artificial intelligence and machine learning.
+        
+        Key concepts:
+        - Natural Language Processing (NLP)
+        - Vector embeddings
+        - Retrieval-Augmented Generation (RAG)
+        - Semantic search
+        
+        The system should be able to answer questions about these topics
+        based on this document content.
+        """
 
 class NeuroQueryAPITester:
     def __init__(self, base_url="http://localhost:3000"):
@@ -65,26 +82,9 @@ class NeuroQueryAPITester:
 
     def test_document_upload(self):
         """Test document upload with a small text file"""
-        # Create a small test text file
-        test_content = """
-        NeuroQuery Test Document
-        
-        This is a test document for the NeuroQuery RAG system.
-        It contains information about artificial intelligence and machine learning.
-        
-        Key concepts:
-        - Natural Language Processing (NLP)
-        - Vector embeddings
-        - Retrieval-Augmented Generation (RAG)
-        - Semantic search
-        
-        The system should be able to answer questions about these topics
-        based on this document content.
-        """
-        
         # Create temporary file
         with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            f.write(test_content)
+            f.write(TEST_DOCUMENT)
             temp_file_path = f.name
         
         try:
@@ -94,19 +94,74 @@ class NeuroQueryAPITester:
                     "Document Upload", 
                     "POST", 
                     "documents/upload", 
-                    200, 
+                    202, 
                     files=files
                 )
                 
                 if success and 'id' in response:
                     self.uploaded_doc_id = response['id']
                     print(f"   Document ID: {self.uploaded_doc_id}")
-                    return True
+                    return self.wait_for_job(response.get('job_id'))
                 return False
         finally:
             # Clean up temp file
             Path(temp_file_path).unlink(missing_ok=True)
 
+    def test_duplicate_upload(self):
+        """Test that re-uploading the same content returns the stored document"""
+        if not self.uploaded_doc_id:
+            print("❌ Skipping duplicate upload test - no uploaded document")
+            return False
+
+        files = {'file': ('test_document_copy.txt', TEST_DOCUMENT.encode(), 'text/plain')}
+        success, response = self.run_test("Duplicate Upload", "POST", "documents/upload", 200, files=files)
+        if success:
+            same = response.get('id') == self.uploaded_doc_id
+            print(f"   Same document returned: {same}")
+            return same
+        return False
+
+    def test_reupload_same_text(self):
+        """Test a copy differing only in trailing whitespace: a new document whose chunks reuse stored embeddings"""
+        if not self.uploaded_doc_id:
+            print("❌ Skipping same-text upload test - no uploaded document")
+            return False
+
+        files = {'file': ('test_document_spaced.txt', (TEST_DOCUMENT + "\n\n").encode(), 'text/plain')}
+        success, response = self.run_test("Same-Text Upload", "POST", "documents/upload", 202, files=files)
+        if not (success and 'id' in response):
+            return False
+        copy_id = response['id']
+        reused = False
+        if self.wait_for_job(response.get('job_id')):
+            original = requests.get(f"{self.api_url}/documents/{self.uploaded_doc_id}/chunks").json()
+            copy = requests.get(f"{self.api_url}/documents/{copy_id}/chunks").json()
+            same_text = [c.get('text_hash') for c in copy] == [c.get('text_hash') for c in original]
+            print(f"   Chunk text hashes match the original: {same_text}")
+            job = requests.get(f"{self.api_url}/documents/jobs/{response['job_id']}").json()
+            print(f"   Reused embeddings: {job.get('reused_chunks')} of {job.get('total_chunks')} chunks")
+            reused = same_text and 0 < job.get('reused_chunks', 0) == job.get('total_chunks')
+        deleted, _ = self.run_test("Delete Same-Text Document", "DELETE", f"documents/{copy_id}", 200)
+        return reused and deleted
+
+    def wait_for_job(self, job_id, timeout=120):
+        """Poll an ingestion job until it completes"""
+        if not job_id:
+            return True
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = requests.get(f"{self.api_url}/documents/jobs/{job_id}")
+            job = response.json()
+            print(f"   Job {job.get('status')} - {job.get('stage')} ({job.get('progress', 0):.0%})")
+            if job.get('status') == 'completed':
+                return True
+            if job.get('status') == 'failed':
+                print(f"❌ Ingestion failed: {job.get('error')}")
+                return False
+            time.sleep(1)
+        print("❌ Ingestion job timed out")
+        return False
+
     def test_get_documents(self):
         """Test getting all documents"""
         success, response = self.run_test("Get Documents", "GET", "documents", 200)
@@ -176,6 +231,133 @@ class NeuroQueryAPITester:
             return True
         return False
 
+    def test_query_batch(self):
+        """Test batched queries (retrieval only)"""
+        if not self.uploaded_doc_id:
+            print("❌ Skipping batch query test - no uploaded document")
+            return False
+
+        query_data = {
+            "queries": ["What is RAG?", "What is NLP?", "What are the key concepts mentioned?"],
+            "mode": "concise"
+        }
+
+        success, response = self.run_test("Batch Query", "POST", "query/batch", 200, data=query_data)
+        if success:
+            in_order = [r.get('query') for r in response] == query_data["queries"]
+            print(f"   Results in order: {in_order}")
+            print(f"   Citations per query: {[len(r.get('citations', [])) for r in response]}")
+            return in_order
+        return False
+
+    def test_query_stream(self):
+        """Test streaming query (server-sent events)"""
+        if not self.uploaded_doc_id:
+            print("❌ Skipping streaming query test - no uploaded document")
+            return False
+
+        self.tests_run += 1
+        print("\n🔍 Testing Streaming Query...")
+        try:
+            response = requests.post(
+                f"{self.api_url}/query/stream",
+                json={"query": "What is RAG?", "mode": "concise"},
+                stream=True
+            )
+            events = [line[len("event: "):] for line in response.iter_lines(decode_unicode=True)
+                      if line and line.startswith("event: ")]
+            success = response.status_code == 200 and events[:1] == ["citations"] and events[-1:] == ["done"]
+            if success:
+                self.tests_passed += 1
+                print(f"✅ Passed - {events.count('token')} tokens streamed")
+            else:
+                print(f"❌ Failed - Status: {response.status_code}, events: {events[:5]}")
+            return success
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False
+
+    def test_bulk_upload(self):
+        """Test bulk upload result statuses: a new file, a duplicate and an unsupported type"""
+        if not self.uploaded_doc_id:
+            print("❌ Skipping bulk upload test - no uploaded document")
+            return False
+
+        files = [
+            ('files', ('bulk_new.txt', b"Bulk upload test document about keyset pagination.", 'text/plain')),
+            ('files', ('bulk_duplicate.txt', TEST_DOCUMENT.encode(), 'text/plain')),
+            ('files', ('bulk_unsupported.xyz', b"Not a supported document", 'application/octet-stream')),
+        ]
+        success, response = self.run_test("Bulk Upload", "POST", "documents/upload/bulk", 202, files=files)
+        if not success:
+            return False
+        statuses = [r.get('status') for r in response]
+        print(f"   Statuses: {statuses}")
+        passed = (statuses == ['queued', 'duplicate', 'rejected']
+                  and (response[1].get('document') or {}).get('id') == self.uploaded_doc_id)
+        queued = response[0].get('document') or {}
+        if queued.get('id'):
+            completed = self.wait_for_job(queued.get('job_id'))
+            deleted, _ = self.run_test("Delete Bulk Document", "DELETE", f"documents/{queued['id']}", 200)
+            passed = passed and completed and deleted
+        return passed
+
+    def test_chat_list_paging(self):
+        """Test cursor paging of the chat list"""
+        chat_ids = []
+        for i in range(3):
+            success, response = self.run_test(f"Create Chat {i + 1}", "POST", "chats", 200)
+            if not success:
+                return False
+            chat_ids.append(response['id'])
+
+        passed = False
+        success, first = self.run_test("List Chats (page 1)", "GET", "chats?limit=2", 200)
+        if success and len(first.get('chats', [])) == 2 and first.get('next_cursor'):
+            success, second = self.run_test(
+                "List Chats (page 2)", "GET", f"chats?limit=2&cursor={quote(first['next_cursor'])}", 200
+            )
+            first_ids = {c['id'] for c in first['chats']}
+            second_ids = {c['id'] for c in second.get('chats', [])}
+            # Newest first, so the three new chats span both pages
+            passed = success and not first_ids & second_ids and set(chat_ids) <= first_ids | second_ids
+            print(f"   Pages disjoint and contiguous: {passed}")
+
+        for chat_id in chat_ids:
+            requests.delete(f"{self.api_url}/chats/{chat_id}")
+        return passed
+
+    def test_chat_message_paging(self):
+        """Test paging backwards through a chat's messages with ``before``"""
+        if not self.uploaded_doc_id:
+            print("❌ Skipping message paging test - no uploaded document")
+            return False
+
+        success, chat = self.run_test("Create Chat", "POST", "chats", 200)
+        if not success:
+            return False
+        chat_id = chat['id']
+
+        passed = False
+        sent = all(
+            self.run_test(f"Send Message {i + 1}", "POST",
+                          f"chats/{chat_id}/messages?message={quote(question)}&mode=concise", 200)[0]
+            for i, question in enumerate(["What is RAG?", "What is NLP?"])
+        )
+        if sent:
+            success, latest = self.run_test("Latest Messages", "GET", f"chats/{chat_id}/messages?limit=2", 200)
+            if success and len(latest) == 2:
+                before = latest[0]['seq']
+                success, older = self.run_test(
+                    "Older Messages", "GET", f"chats/{chat_id}/messages?before={before}&limit=2", 200
+                )
+                seqs = [m['seq'] for m in older + latest] if success else []
+                passed = seqs == list(range(4))
+                print(f"   Message positions across pages: {seqs}")
+
+        requests.delete(f"{self.api_url}/chats/{chat_id}")
+        return passed
+
     def test_get_document_chunks(self):
         """Test getting document chunks"""
         if not self.uploaded_doc_id:
@@ -231,10 +413,17 @@ def main():
     tests = [
         tester.test_api_root,
         tester.test_document_upload,
+        tester.test_duplicate_upload,
+        tester.test_reupload_same_text,
         tester.test_get_documents,
         tester.test_query_simple,
         tester.test_query_modes,
         tester.test_query_with_document_filter,
+        tester.test_query_batch,
+        tester.test_query_stream,
+        tester.test_bulk_upload,
+        tester.test_chat_list_paging,
+        tester.test_chat_message_paging,
         tester.test_get_document_chunks,
         tester.test_error_cases,
         tester.test_delete_document,  # Delete last to clean up
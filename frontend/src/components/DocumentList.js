@@ -1,11 +1,44 @@
-import React, { useState, useMemo } from 'react';
-import { FileText, Trash2, Check, Filter, X } from 'lucide-react';
+import React, { useState, useMemo, useEffect } from 'react';
+import axios from 'axios';
+import { FileText, Trash2, Check, Filter, X, Loader2 } from 'lucide-react';
 import { format } from 'date-fns';
+import { toast } from 'sonner';
 
-const DocumentList = ({ documents, selectedDocs, onSelectDoc, onDeleteDocument }) => {
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+const JOB_POLL_INTERVAL_MS = 2000;
+
+const DocumentList = ({ documents, selectedDocs, onSelectDoc, onDeleteDocument, onDocumentProcessed, onDocumentFailed }) => {
   const [filterType, setFilterType] = useState('');
   const [searchTerm, setSearchTerm] = useState('');
   const [showFilters, setShowFilters] = useState(false);
+  const [jobProgress, setJobProgress] = useState({});
+
+  // Poll ingestion jobs for documents that are still being processed
+  useEffect(() => {
+    const pending = documents.filter(doc => !doc.processed && doc.job_id);
+    if (pending.length === 0) return undefined;
+
+    const timer = setInterval(async () => {
+      for (const doc of pending) {
+        try {
+          const { data: job } = await axios.get(`${API}/documents/jobs/${doc.job_id}`);
+          if (job.status === 'completed') {
+            onDocumentProcessed?.({ ...doc, processed: true, total_chunks: job.total_chunks });
+          } else if (job.status === 'failed') {
+            toast.error(`Failed to process ${doc.filename}: ${job.error}`);
+            onDocumentFailed?.(doc.id);
+          } else {
+            setJobProgress(prev => ({ ...prev, [doc.id]: job }));
+          }
+        } catch (error) {
+          console.error('Error polling ingestion job:', error);
+        }
+      }
+    }, JOB_POLL_INTERVAL_MS);
+
+    return () => clearInterval(timer);
+  }, [documents, onDocumentProcessed, onDocumentFailed]);
 
   // Filter documents based on type and search
   const filteredDocuments = useMemo(() => {
@@ -157,9 +190,18 @@ const DocumentList = ({ documents, selectedDocs, onSelectDoc, onDeleteDocument }
                       <span className="text-xs bg-slate-100 text-slate-700 px-2 py-0.5 rounded">
                         {doc.file_type?.toUpperCase() || 'FILE'}
                       </span>
-                      <span className="text-xs text-muted-foreground">
-                        {doc.total_chunks} chunks
-                      </span>
+                      {!doc.processed && doc.job_id ? (
+                        <span className="flex items-center gap-1 text-xs text-primary">
+                          <Loader2 className="w-3 h-3 animate-spin" />
+                          {jobProgress[doc.id]
+                            ? `${jobProgress[doc.id].stage} ${Math.round(jobProgress[doc.id].progress * 100)}%`
+                            : 'queued'}
+                        </span>
+                      ) : (
+                        <span className="text-xs text-muted-foreground">
+                          {doc.total_chunks} chunks
+                        </span>
+                      )}
                       {doc.upload_date && (
                         <span className="text-xs text-muted-foreground">
                           • {format(new Date(doc.upload_date), 'MMM d')}
@@ -53,8 +53,13 @@ const DocumentUpload = ({ onDocumentUploaded }) => {
       const response = await axios.post(`${API}/documents/upload`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
-      toast.success(`${file.name} uploaded successfully`);
-      onDocumentUploaded(response.data);
+      if (response.status === 200) {
+        // Same content as a document already in the list
+        toast.info(`${file.name} is already uploaded`);
+      } else {
+        toast.success(`${file.name} uploaded, processing in background`);
+        onDocumentUploaded(response.data);
+      }
     } catch (error) {
       console.error('Upload error:', error);
       toast.error('Failed to upload document');
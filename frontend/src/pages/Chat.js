@@ -9,6 +9,7 @@ import ChatMessageRenderer from '../components/ChatMessageRenderer';
 const Chat = () => {
   const navigate = useNavigate();
   const [chats, setChats] = useState([]);
+  const [chatsCursor, setChatsCursor] = useState(null);
   const [currentChat, setCurrentChat] = useState(null);
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
@@ -75,7 +76,8 @@ const Chat = () => {
     const loadChats = async () => {
       try {
         const response = await axios.get(`${API_BASE}/api/chats`);
-        setChats(response.data);
+        setChats(response.data.chats);
+        setChatsCursor(response.data.next_cursor);
       } catch (error) {
         console.error('Error loading chats:', error);
       }
@@ -122,6 +124,24 @@ const Chat = () => {
     }
   };
 
+  // Load older messages of the current chat
+  const handleLoadEarlier = async () => {
+    if (!currentChat || messages.length === 0) return;
+    try {
+      const response = await axios.get(
+        `${API_BASE}/api/chats/${currentChat.id}/messages`,
+        { params: { before: messages[0].seq } }
+      );
+      setMessages(prev => [...response.data, ...prev]);
+      setCurrentChat(prev => ({
+        ...prev,
+        has_more_messages: response.data.length > 0 && response.data[0].seq > 0
+      }));
+    } catch (error) {
+      console.error('Error loading earlier messages:', error);
+    }
+  };
+
   // Send message
   const handleSendMessage = async (e) => {
     e.preventDefault();
@@ -322,7 +342,19 @@ const Chat = () => {
   const loadChats = async () => {
     try {
       const response = await axios.get(`${API_BASE}/api/chats`);
-      setChats(response.data);
+      setChats(response.data.chats);
+      setChatsCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading chats:', error);
+    }
+  };
+
+  const loadMoreChats = async () => {
+    if (!chatsCursor) return;
+    try {
+      const response = await axios.get(`${API_BASE}/api/chats`, { params: { cursor: chatsCursor } });
+      setChats(prev => [...prev, ...response.data.chats]);
+      setChatsCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error loading chats:', error);
     }
@@ -553,6 +585,14 @@ const Chat = () => {
                 </div>
               ))
             )}
+            {chatsCursor && (
+              <button
+                onClick={loadMoreChats}
+                className="w-full text-xs text-slate-400 hover:text-slate-200 py-2"
+              >
+                Show older chats
+              </button>
+            )}
           </div>
         </div>
       </div>
@@ -616,6 +656,16 @@ const Chat = () => {
             </div>
           ) : (
             <>
+              {currentChat?.has_more_messages && (
+                <div className="flex justify-center pb-4">
+                  <button
+                    onClick={handleLoadEarlier}
+                    className={`text-sm px-4 py-2 rounded-lg transition-colors ${isDarkMode ? 'text-gray-300 hover:bg-gray-800' : 'text-slate-600 hover:bg-slate-100'}`}
+                  >
+                    Load earlier messages
+                  </button>
+                </div>
+              )}
               {messages.map((msg) => (
                 <div key={msg.id} className={`px-6 py-6 ${msg.role === 'user' ? (isDarkMode ? 'bg-gray-900' : 'bg-white') : (isDarkMode ? 'bg-gray-800' : 'bg-slate-50')}`}>
                   <div className={`max-w-4xl ${msg.role === 'user' ? 'ml-auto mr-0' : 'ml-0 mr-auto'}`}>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import axios from 'axios';
 import { Brain, Upload, FileText, Trash2, ChevronDown, ChevronUp, Info } from 'lucide-react';
 import { toast } from 'sonner';
@@ -33,9 +33,17 @@ const Dashboard = () => {
   };
 
   const handleDocumentUploaded = (newDoc) => {
-    setDocuments([newDoc, ...documents]);
+    setDocuments(prev => [newDoc, ...prev.filter(doc => doc.id !== newDoc.id)]);
   };
 
+  const handleDocumentProcessed = useCallback((processedDoc) => {
+    setDocuments(prev => prev.map(doc => (doc.id === processedDoc.id ? processedDoc : doc)));
+  }, []);
+
+  const handleDocumentFailed = useCallback((docId) => {
+    setDocuments(prev => prev.filter(doc => doc.id !== docId));
+  }, []);
+
   const handleDeleteDocument = async (docId) => {
     try {
       await axios.delete(`${API}/documents/${docId}`);
@@ -121,6 +129,8 @@ const Dashboard = () => {
                 )
               }}
               onDeleteDocument={handleDeleteDocument}
+              onDocumentProcessed={handleDocumentProcessed}
+              onDocumentFailed={handleDocumentFailed}
             />
           </div>
         </div>
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# The backend is a flat module directory, not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+# server opens its (lazy) MongoDB client at import; no server is contacted
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test_database')
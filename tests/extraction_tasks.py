@@ -0,0 +1,14 @@
+"""Stand-in extractors for the ExtractionPool tests; imported by spawned workers, so not by server"""
+import signal
+import time
+
+
+def hang():
+    """Never returns, like an extractor stuck in native code: the deadline signal stays blocked"""
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    while True:
+        time.sleep(60)
+
+
+def echo(value):
+    return value
@@ -0,0 +1,137 @@
+"""A small in-memory stand-in for the Motor database, covering the queries the index code runs"""
+import copy
+from types import SimpleNamespace
+
+
+def _matches(document, query):
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(_matches(document, branch) for branch in condition):
+                return False
+            continue
+        present = field in document
+        value = document.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if op == '$ne' and value == operand:
+                return False
+            if op == '$in' and value not in operand:
+                return False
+            if op == '$exists' and present != operand:
+                return False
+            if op == '$gt' and not (present and value > operand):
+                return False
+            if op == '$lt' and not (present and value < operand):
+                return False
+            if op == '$lte' and not (present and value <= operand):
+                return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    included = [field for field, keep in projection.items() if keep and field != '_id']
+    if included:
+        return {field: copy.deepcopy(document[field]) for field in included if field in document}
+    return {field: copy.deepcopy(value) for field, value in document.items()
+            if projection.get(field, 1) and field != '_id'}
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self._documents = documents
+
+    def sort(self, field, direction=1):
+        self._documents.sort(key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    async def to_list(self, length=None):
+        return self._documents[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._documents:
+            yield document
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor([_project(d, projection) for d in self.documents if _matches(d, query or {})])
+
+    async def find_one(self, query, projection=None):
+        found = [d for d in self.documents if _matches(d, query)]
+        return _project(found[0], projection) if found else None
+
+    def aggregate(self, pipeline):
+        """Supports a $match stage followed by a $group stage of $first accumulators"""
+        documents = [d for d in self.documents if _matches(d, pipeline[0]['$match'])]
+        group = pipeline[1]['$group']
+        groups = {}
+        for document in documents:
+            key = document.get(group['_id'].lstrip('$'))
+            if key not in groups:
+                groups[key] = {'_id': key, **{field: document.get(accumulator['$first'].lstrip('$'))
+                                              for field, accumulator in group.items() if field != '_id'}}
+        return FakeCursor(list(groups.values()))
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.documents if _matches(d, query))
+
+    async def insert_one(self, document):
+        self.documents.append(copy.deepcopy(document))
+
+    async def insert_many(self, documents):
+        self.documents.extend(copy.deepcopy(documents))
+
+    def _update(self, document, update):
+        for field, value in update.get('$set', {}).items():
+            document[field] = value
+        for field, amount in update.get('$inc', {}).items():
+            document[field] = document.get(field, 0) + amount
+
+    async def find_one_and_update(self, query, update, upsert=False, **kwargs):
+        found = [d for d in self.documents if _matches(d, query)]
+        if not found and upsert:
+            found = [{k: v for k, v in query.items() if not isinstance(v, dict)}]
+            self.documents.append(found[0])
+        if not found:
+            return None
+        self._update(found[0], update)
+        return copy.deepcopy(found[0])
+
+    async def update_many(self, query, update):
+        found = [d for d in self.documents if _matches(d, query)]
+        for document in found:
+            self._update(document, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found))
+
+    async def update_one(self, query, update):
+        found = [d for d in self.documents if _matches(d, query)][:1]
+        for document in found:
+            self._update(document, update)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found))
+
+    async def delete_many(self, query):
+        kept = [d for d in self.documents if not _matches(d, query)]
+        deleted = len(self.documents) - len(kept)
+        self.documents = kept
+        return SimpleNamespace(deleted_count=deleted)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection())
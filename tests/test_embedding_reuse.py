@@ -0,0 +1,43 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import server
+from tests.fake_db import FakeDatabase
+
+
+class CountingEmbedder:
+    """Records every text it is asked to encode"""
+
+    def __init__(self):
+        self.encoded = []
+
+    async def encode_documents(self, texts, batch_size=32):
+        self.encoded.extend(texts)
+        return np.stack([np.full(4, len(text), dtype='float32') for text in texts])
+
+
+@pytest.fixture
+def embedder(monkeypatch):
+    counting = CountingEmbedder()
+    monkeypatch.setattr(server, 'embedding_service', counting)
+    return counting
+
+
+def test_stored_text_is_not_encoded_again(monkeypatch, embedder):
+    db = FakeDatabase()
+    monkeypatch.setattr(server, 'db', db)
+    stored = np.arange(4, dtype='float32')
+    db.document_chunks.documents.append({
+        'text_hash': server.hash_text('known text'),
+        'embedding': server.encode_embedding(stored),
+        'embedding_dtype': server.EMBEDDING_STORAGE_DTYPE
+    })
+    texts = ['known text', 'new text', 'new text']
+
+    embeddings, reused = asyncio.run(server.embed_chunks(texts, [server.hash_text(t) for t in texts]))
+    assert embedder.encoded == ['new text']
+    assert reused.tolist() == [True, False, False]
+    np.testing.assert_array_equal(embeddings[0], stored)
+    np.testing.assert_array_equal(embeddings[1], embeddings[2])
@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests import extraction_tasks
+
+
+def test_stuck_worker_is_killed_and_pool_recovers():
+    pool = server.ExtractionPool(1, timeout=0.5, memory_limit_mb=0, kill_grace=1)
+
+    async def run():
+        with pytest.raises(HTTPException) as error:
+            await pool._call(extraction_tasks.hang)
+        assert error.value.status_code == 422
+        # With one worker, this only runs if the stuck one was replaced
+        return await pool._call(extraction_tasks.echo, 'done')
+
+    try:
+        assert asyncio.run(run()) == 'done'
+    finally:
+        pool.shutdown()
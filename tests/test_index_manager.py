@@ -0,0 +1,157 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import server
+from tests.fake_db import FakeDatabase
+
+DIMENSION = 32
+CHUNKS_PER_DOCUMENT = 50
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    fake = FakeDatabase()
+    monkeypatch.setattr(server, 'db', fake)
+    monkeypatch.setattr(server, 'INDEX_SNAPSHOT_PATH', tmp_path / 'faiss')
+    monkeypatch.setattr(server, 'INDEX_MIN_TRAIN_SIZE', 500)
+    return fake
+
+
+def unit_vectors(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+async def ingest(manager, db, document_id, vectors):
+    """Store a document's chunks the way ingestion does, then index them"""
+    vector_ids = await server.allocate_vector_ids(len(vectors))
+    chunks = [{
+        'id': f'{document_id}-{i}',
+        'document_id': document_id,
+        'document_name': f'{document_id}.txt',
+        'chunk_index': i,
+        'text': f'chunk {i} of {document_id} part E-{vector_id}',
+        'vector_id': vector_id,
+        'embedding': server.encode_embedding(vector),
+        'embedding_dtype': server.EMBEDDING_STORAGE_DTYPE
+    } for i, (vector_id, vector) in enumerate(zip(vector_ids.tolist(), vectors))]
+    await db.document_chunks.insert_many(chunks)
+    await manager.add_chunks(vectors, chunks)
+
+
+async def remove(manager, db, document_id):
+    await db.document_chunks.delete_many({'document_id': document_id})
+    await manager.remove_document(document_id)
+
+
+def live_vectors(manager):
+    """Live (vector_ids, vectors) of a manager, sorted by vector_id"""
+    vector_ids, vectors = server.stored_vectors(manager.index)
+    keep = ~np.isin(vector_ids, list(manager.tombstones))
+    vector_ids, vectors = vector_ids[keep], vectors[keep]
+    order = np.argsort(vector_ids)
+    return vector_ids[order], vectors[order]
+
+
+def self_recall(manager, vectors, vector_ids, k=5):
+    _, found = manager.search(vectors, k)
+    return np.mean([vector_id in row for vector_id, row in zip(vector_ids, found)])
+
+
+@pytest.mark.parametrize('index_type', server.INDEX_TYPES)
+def test_add_remove_search(db, index_type):
+    vectors = unit_vectors(20 * CHUNKS_PER_DOCUMENT)
+    added = unit_vectors(CHUNKS_PER_DOCUMENT, seed=1)
+
+    async def run():
+        manager = server.FaissIndexManager()
+        for d in range(20):
+            await ingest(manager, db, f'doc{d}', vectors[d * CHUNKS_PER_DOCUMENT:(d + 1) * CHUNKS_PER_DOCUMENT])
+        await manager.compact(index_type)
+        assert manager.index_type == index_type
+        # IVFPQ only stores compressed codes, so its recall is approximate
+        minimum_recall = 1.0 if index_type == 'flat' else 0.9
+        assert self_recall(manager, vectors[::7], np.arange(0, len(vectors), 7)) >= minimum_recall
+
+        removed = np.arange(3 * CHUNKS_PER_DOCUMENT, 4 * CHUNKS_PER_DOCUMENT)
+        await remove(manager, db, 'doc3')
+        _, found = manager.search(vectors[removed], 10)
+        assert not np.isin(found, removed).any()
+        assert manager.size == 19 * CHUNKS_PER_DOCUMENT
+
+        await ingest(manager, db, 'doc20', added)
+        added_ids = np.arange(20 * CHUNKS_PER_DOCUMENT, 21 * CHUNKS_PER_DOCUMENT)
+        assert self_recall(manager, added, added_ids) >= minimum_recall
+
+        _, found = manager.search_scoped(vectors[:5], 3, ['doc1'])
+        assert np.isin(found, np.arange(CHUNKS_PER_DOCUMENT, 2 * CHUNKS_PER_DOCUMENT)).all()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('index_type', ['flat', 'hnsw'])
+def test_snapshot_and_replay_match_live_index(db, index_type):
+    vectors = unit_vectors(14 * CHUNKS_PER_DOCUMENT)
+
+    def document_vectors(d):
+        return vectors[d * CHUNKS_PER_DOCUMENT:(d + 1) * CHUNKS_PER_DOCUMENT]
+
+    async def run():
+        live = server.FaissIndexManager()
+        for d in range(10):
+            await ingest(live, db, f'doc{d}', document_vectors(d))
+        # Pinning the backend also writes a snapshot
+        await live.compact(index_type)
+        for d in range(10, 14):
+            await ingest(live, db, f'doc{d}', document_vectors(d))
+        await remove(live, db, 'doc2')
+        await remove(live, db, 'doc11')
+
+        restored = server.FaissIndexManager()
+        assert await restored.load_snapshot()
+        rebuilt = server.FaissIndexManager()
+        await rebuilt.rebuild()
+        return live, restored, rebuilt
+
+    live, restored, rebuilt = asyncio.run(run())
+    assert restored.version == live.version
+    assert restored.index_type == live.index_type == index_type
+    assert restored.index_type_override == index_type
+
+    live_ids, live_vecs = live_vectors(live)
+    for other in (restored, rebuilt):
+        assert other.chunk_metadata == live.chunk_metadata
+        assert other.document_vector_ids.keys() == live.document_vector_ids.keys()
+        other_ids, other_vecs = live_vectors(other)
+        np.testing.assert_array_equal(other_ids, live_ids)
+        np.testing.assert_allclose(other_vecs, live_vecs, atol=1e-6)
+        for query in ('part E-120', 'chunk 7 of doc12', 'doc2'):
+            np.testing.assert_array_equal(other.lexical.search(query, 10)[0], live.lexical.search(query, 10)[0])
+
+    queries = live_vecs[::11]
+    _, expected = live.search(queries, 1)
+    for other in (restored, rebuilt):
+        _, found = other.search(queries, 1)
+        np.testing.assert_array_equal(found, expected)
+
+
+def test_saving_a_snapshot_prunes_the_change_log(db, monkeypatch):
+    monkeypatch.setattr(server, 'INDEX_CHANGE_RETENTION', 2)
+    vectors = unit_vectors(6 * CHUNKS_PER_DOCUMENT)
+
+    async def run():
+        manager = server.FaissIndexManager()
+        for d in range(5):
+            await ingest(manager, db, f'doc{d}', vectors[d * CHUNKS_PER_DOCUMENT:(d + 1) * CHUNKS_PER_DOCUMENT])
+        await manager.save_snapshot()
+        assert [c['version'] for c in db.index_changes.documents] == [4, 5]
+
+        await ingest(manager, db, 'doc5', vectors[5 * CHUNKS_PER_DOCUMENT:])
+        restored = server.FaissIndexManager()
+        assert await restored.load_snapshot()
+        assert restored.version == manager.version == 6
+        assert restored.chunk_metadata == manager.chunk_metadata
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import math
+
+import numpy as np
+import pytest
+
+import server
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'pump', 'valve', 'seal', 'e-1042', 'v2.3.1', 'part_no', 'the', 'of']
+QUERIES = ['pump valve', 'E-1042', 'v2.3.1 seal', 'part_no alpha alpha', 'the of', 'missing term']
+
+
+def corpus(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return {vector_id: ' '.join(rng.choice(WORDS, size=rng.integers(3, 40)))
+            for vector_id in range(100, 100 + count)}
+
+
+def reference_bm25(texts, query):
+    """Textbook BM25 over lexical_tokens, computed independently of the index"""
+    documents = {vector_id: server.lexical_tokens(text) for vector_id, text in texts.items()}
+    average_length = sum(map(len, documents.values())) / len(documents)
+    scores = {}
+    for term in dict.fromkeys(server.lexical_tokens(query)):
+        document_frequency = sum(term in tokens for tokens in documents.values())
+        if not document_frequency:
+            continue
+        idf = math.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+        for vector_id, tokens in documents.items():
+            frequency = tokens.count(term)
+            if frequency:
+                norm = server.BM25_K1 * (1 - server.BM25_B + server.BM25_B * len(tokens) / average_length)
+                scores[vector_id] = scores.get(vector_id, 0.0) + idf * frequency * (server.BM25_K1 + 1) / (frequency + norm)
+    return scores
+
+
+def search_all(index, query, scope=None):
+    vector_ids, scores = index.search(query, 10_000, scope)
+    assert np.all(np.diff(scores) <= 0)
+    return dict(zip(vector_ids.tolist(), scores.tolist()))
+
+
+def assert_matches_reference(index, texts):
+    for query in QUERIES:
+        expected = reference_bm25(texts, query)
+        found = search_all(index, query)
+        assert found.keys() == expected.keys()
+        for vector_id, score in expected.items():
+            assert found[vector_id] == pytest.approx(score, rel=1e-4)
+
+
+def test_lexical_tokens_keep_identifiers_and_their_parts():
+    assert server.lexical_tokens('Error E-1042 in the v2.3.1 Pump') == ['error', 'e-1042', 'v2.3.1', 'pump', 'e', '1042', 'v2', '3', '1']
+
+
+def test_scores_match_reference_through_incremental_adds():
+    texts = corpus(300)
+    index = server.LexicalIndex()
+    items = list(texts.items())
+    # Many small batches exercise segment merging
+    for start in range(0, len(items), 17):
+        index.add_many(items[start:start + 17])
+    assert index.size == len(texts)
+    assert_matches_reference(index, texts)
+
+
+def test_scores_match_reference_after_removals_and_compaction():
+    texts = corpus(300)
+    index = server.LexicalIndex.build(texts.items())
+    removed = list(texts)[::10]
+    index.remove(removed)
+    for vector_id in removed:
+        del texts[vector_id]
+    # Below the compaction ratio, removed rows are only marked dead
+    assert len(index.live) > index.size
+    assert_matches_reference(index, texts)
+
+    removed = list(texts)[::3]
+    index.remove(removed)
+    for vector_id in removed:
+        del texts[vector_id]
+    assert len(index.live) == index.size
+    assert_matches_reference(index, texts)
+
+
+def test_scoped_search_only_returns_scope():
+    texts = corpus(200)
+    index = server.LexicalIndex.build(texts.items())
+    scope = np.arange(150, 180, dtype='int64')
+    for query in QUERIES:
+        everything = search_all(index, query)
+        assert search_all(index, query, scope) == {v: s for v, s in everything.items() if v in set(scope.tolist())}
+
+
+def test_arrays_round_trip():
+    texts = corpus(200)
+    index = server.LexicalIndex.build(list(texts.items())[:120])
+    index.add_many(list(texts.items())[120:])
+    index.remove(list(texts)[:5])
+    restored = server.LexicalIndex.from_arrays(index.to_arrays())
+    assert restored.size == index.size
+    for query in QUERIES:
+        assert search_all(restored, query) == search_all(index, query)
@@ -0,0 +1,112 @@
+import asyncio
+
+import numpy as np
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import server
+
+
+def test_reciprocal_rank_fusion():
+    scores = server.reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+    assert scores == pytest.approx({1: 1 / 61 + 1 / 62, 2: 1 / 62, 3: 1 / 63 + 1 / 61})
+    assert sorted(scores, key=scores.get, reverse=True) == [1, 3, 2]
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_embedding_round_trip(monkeypatch, dtype):
+    monkeypatch.setattr(server, 'EMBEDDING_STORAGE_DTYPE', dtype)
+    embedding = np.random.default_rng(0).standard_normal(384).astype('float32')
+    stored = server.encode_embedding(embedding)
+    assert len(stored) == 384 * np.dtype(dtype).itemsize
+    decoded = server.decode_embedding(stored, dtype)
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, embedding, rtol=1e-3 if dtype == 'float16' else 0)
+
+
+def test_legacy_float_list_embedding():
+    decoded = server.decode_embedding([0.5, -1.0, 2.0])
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, [0.5, -1.0, 2.0])
+
+
+def test_offset_index():
+    index = server.OffsetIndex()
+    assert index.lookup(5) is None
+    for offset, value in [(0, 'a'), (10, 'b'), (20, 'c')]:
+        index.add(offset, value)
+    assert [index.lookup(o) for o in (0, 9, 10, 25)] == ['a', 'a', 'b', 'c']
+    index.prune(15)
+    assert index.values == ['b', 'c']
+    assert index.lookup(15) == 'b'
+
+
+def test_iter_chunks_tracks_page_and_section_of_each_chunk():
+    async def pieces():
+        for page in range(1, 6):
+            text = ' '.join(f'p{page}w{i}' for i in range(300)) + '\n\n'
+            headings = [(0, f'Section {page}')] if page % 2 == 0 else []
+            yield server.TextPiece(text, page / 5, page, headings)
+
+    async def collect():
+        splitter = RecursiveCharacterTextSplitter(chunk_size=server.CHUNK_SIZE, chunk_overlap=server.CHUNK_OVERLAP,
+                                                  separators=["\n\n", "\n", ". ", " ", ""])
+        return [result async for result in server.iter_chunks(pieces(), splitter)]
+
+    results = asyncio.run(collect())
+    assert len(results) > 5
+    progress = [p for _, p, _, _ in results]
+    assert progress == sorted(progress) and progress[-1] == 1.0
+    words = set()
+    for chunk, _, page_number, section_title in results:
+        first_page = int(chunk.split()[0][1:].split('w')[0])
+        assert page_number == first_page
+        # Odd pages inherit the section started on the page before them
+        expected_section = None if first_page == 1 else f'Section {first_page - first_page % 2}'
+        assert section_title == expected_section
+        words.update(chunk.split())
+    assert len(words) == 5 * 300
+
+
+def source(chunk_id, text, chunk_index, document_id='doc'):
+    return {'chunk_id': chunk_id, 'document_id': document_id, 'document_name': 'doc.txt',
+            'chunk_index': chunk_index, 'text': text}
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Count one token per word, so budgets are easy to reason about"""
+    monkeypatch.setattr(server, 'count_tokens', lambda text: len(text.split()))
+    monkeypatch.setattr(server, 'truncate_to_tokens', lambda text, n: ' '.join(text.split()[:n]))
+    monkeypatch.setitem(server.CONTEXT_TOKEN_BUDGETS, 'concise', 60)
+
+
+def words(prefix, count):
+    return ' '.join(f'{prefix}{i}' for i in range(count))
+
+
+def test_assemble_context_drops_duplicates_and_skips_what_does_not_fit(word_tokens):
+    # Each source costs its words + 1 (name) + 8 (header)
+    chunks = [
+        source('a', words('a', 20), 0),
+        source('dup', words('a', 20), 5),
+        source('big', words('b', 40), 9),
+        source('c', words('c', 10), 12),
+    ]
+    sources = server.assemble_context(chunks, 'concise')
+    assert [s['chunk_id'] for s in sources] == ['a', 'c']
+    assert sum(s['tokens'] for s in sources) <= 60
+
+
+def test_assemble_context_truncates_an_oversized_best_chunk(word_tokens):
+    sources = server.assemble_context([source('big', words('b', 100), 0), source('c', words('c', 5), 3)], 'concise')
+    assert [s['chunk_id'] for s in sources] == ['big']
+    assert sources[0]['tokens'] == 60
+
+
+def test_assemble_context_merges_adjacent_chunks(word_tokens):
+    chunks = [source('second', words('x', 10), 1), source('first', words('y', 10), 0)]
+    sources = server.assemble_context(chunks, 'concise')
+    assert len(sources) == 1
+    assert sources[0]['chunk_ids'] == ['first', 'second']
+    assert sources[0]['citation_text'] == words('x', 10)
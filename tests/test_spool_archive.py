@@ -0,0 +1,41 @@
+import zipfile
+
+import pytest
+
+import server
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def spool_dir(monkeypatch, tmp_path):
+    spool = tmp_path / 'spool'
+    spool.mkdir()
+    monkeypatch.setattr(server, 'INSTANCE_SPOOL_DIR', spool)
+    return spool
+
+
+def make_archive(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, size in members:
+            archive.writestr(name, b'\0' * size)
+    return path
+
+
+def test_members_past_the_file_limit_are_rejected_unread(spool_dir, tmp_path):
+    archive = make_archive(tmp_path / 'docs.zip', [(f'{i}.txt', 100) for i in range(5)])
+    spooled = server.spool_archive(archive, max_files=3)
+    assert [item.path is not None for item in spooled] == [True, True, True, False, False]
+    assert spooled[3].error == f"More than {server.BULK_MAX_FILES} files in one upload"
+    assert len(list(spool_dir.iterdir())) == 3
+
+
+def test_unpacked_size_is_bounded_across_members(monkeypatch, spool_dir, tmp_path):
+    monkeypatch.setattr(server, 'BULK_MAX_UNPACKED_SIZE_MB', 1)
+    monkeypatch.setattr(server, 'UPLOAD_CHUNK_SIZE', 64 * 1024)
+    # Small when compressed, but the second member crosses the 1 MB total while being written
+    archive = make_archive(tmp_path / 'bomb.zip', [('a.txt', MB // 2), ('b.txt', MB // 2 + 1), ('c.txt', 10)])
+    spooled = server.spool_archive(archive, max_files=10)
+    assert spooled[0].path is not None
+    assert [item.error for item in spooled[1:]] == ["Archive unpacks to more than 1 MB"] * 2
+    assert [path.stat().st_size for path in spool_dir.iterdir()] == [MB // 2]